@@ -1,34 +1,80 @@
+from collections import OrderedDict
 import logging
 from multiprocessing import Pool
+import os
 from os.path import isfile
-import pandas as pd
-import plotnine as gg
 import sqlite3
-from stockfish import Stockfish
+import statistics
+import threading
 import time
-from typing import List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+from engine import TelemetryStockfish, host
+from metrics import metrics
 import pgnproc
 
 logger = logging.getLogger('__main__.' + __name__)
 
+# Engine binary, STOCKFISH_PATH can point at another build or at stub_engine.py
+stockfish_path = os.environ.get('STOCKFISH_PATH', '/opt/homebrew/bin/stockfish')
+
 class DBConn:
 	instance = None
 
+	# Columns of EngineTelemetry written for each evaluation, as built by search_telemetry
+	telemetry_columns = ('position_id', 'evaluated_at', 'host', 'engine_version', 'workers', 'threads', 'hash_mb',
+						 'depth', 'depth_reached', 'seldepth', 'nodes', 'nps', 'time_ms', 'hashfull', 'wall_ms')
+
+	# Columns of an exported evaluation, positions are matched across databases by fen
+	evaluation_columns = ('fen', 'material', 'eval_depth',
+						  'first_move', 'first_move_eval', 'first_move_eval_type',
+						  'second_move', 'second_move_eval', 'second_move_eval_type',
+						  'third_move', 'third_move_eval', 'third_move_eval_type')
+
 	def __new__(cls, *args, **kwargs):
 		if cls.instance == None:
 			cls.instance = super().__new__(DBConn)
 		return cls.instance
 	
-	def __init__(self, db_name: str, logging: bool = False, sf_depth: int = 15):
+	def __init__(self, db_name: str, logging: bool = False, sf_depth: int = 15, query_cache_size: int = 256, ingest_batch_size: int = 200):
 		self.name = db_name
+		# Games parsed and written per transaction by add_pgn and add_user_to_db
+		self.ingest_batch_size = ingest_batch_size
+		# The connection is shared by the pipeline threads, hold the lock around each use
+		self.lock = threading.RLock()
 		self.conn = self.connect()
 		self.cursor = self.conn.cursor()
+		self.migrate_tables()
 
-		# Initialize engine
-		self.engine = Stockfish(path='/opt/homebrew/bin/stockfish')
+		# The engine is started the first time it is needed, it has its own lock so searches do not hold the database
+		self._engine = None
+		self.engine_lock = threading.RLock()
 		self.sf_depth = sf_depth
-		self.engine.set_depth(self.sf_depth)
+
+		# Rows of per game queries by (query, arguments) as (game_id, rows), least recently used first,
+		# and the keys held for each game so a write to a game drops exactly its entries
+		self.query_cache = OrderedDict()
+		self.query_cache_size = query_cache_size
+		self.cached_games: Dict[int, set] = {}
+		self.cache_hits = 0
+		self.cache_misses = 0
+		self.cache_invalidations = 0
+
+		# Telemetry of evaluations not yet written, written along with the next evaluations
+		self.pending_telemetry: List[tuple] = []
+
+	@property
+	def engine(self) -> TelemetryStockfish:
+		"""
+		Stockfish instance of this connection, started on first use
+		"""
+
+		with self.engine_lock:
+			if self._engine is None:
+				self._engine = TelemetryStockfish(path=stockfish_path)
+				self._engine.set_depth(self.sf_depth)
+
+		return self._engine
 	
 	def connect(self):
 		"""
@@ -36,9 +82,9 @@ class DBConn:
 		"""
 		
 		# Create db and make tables if it does not exist
-		if not isfile('./chesscom_db.db'):
+		if not isfile(self.name):
 			try:
-				self.conn = sqlite3.connect(self.name)
+				self.conn = sqlite3.connect(self.name, check_same_thread=False)
 				self.cursor = self.conn.cursor()
 				logger.info('No existing database, creating database.')
 				self.create_tables()
@@ -49,7 +95,7 @@ class DBConn:
 		else:
 			try:
 				logger.info("Connecting to database.")
-				return sqlite3.connect(self.name)
+				return sqlite3.connect(self.name, check_same_thread=False)
 			except sqlite3.Error as e:
 				logger.critical("Error connecting to database.")
 				quit()
@@ -90,9 +136,85 @@ class DBConn:
 		self.cursor.executescript(commands)
 		self.commit()
 
+		# The tables kept in their own scripts, such as EngineTelemetry and the player statistics, are created by the migration
+		self.migrate_tables()
+
+	def migrate_tables(self):
+		"""
+		Bring a database created by an older version of create_tables.sql up to date
+		"""
+
+		# Tables added after the first version are created if missing
+		with open('./SQLite_scripts/create_telemetry.sql', 'r') as fh:
+			self.cursor.executescript(fh.read())
+
+		columns = [row[1] for row in self.cursor.execute("PRAGMA table_info(Position)").fetchall()]
+
+		# Material balance is computed at ingest, fill it in for positions added before that
+		if 'material' not in columns:
+			logger.info("Adding material column to Position.")
+			self.cursor.execute("ALTER TABLE Position ADD COLUMN material INTEGER")
+			positions = self.cursor.execute("SELECT position_id, fen FROM Position WHERE material IS NULL").fetchall()
+			self.cursor.executemany("UPDATE Position SET material=? WHERE position_id=?",
+									[(pgnproc.fen_material(fen), position_id) for position_id, fen in positions])
+			self.commit()
+
+		# The frequency of each position is counted once for the games already held, then kept by triggers on GameMove
+		if 'frequency' not in columns:
+			logger.info("Adding frequency column to Position.")
+			self.cursor.executescript("""ALTER TABLE Position ADD COLUMN frequency INTEGER NOT NULL DEFAULT 0;
+
+										 WITH counts AS (SELECT m.position_id, COUNT(*) AS frequency
+														 FROM GameMove gm
+														 JOIN Move m
+														 ON gm.move_id = m.move_id
+														 GROUP BY m.position_id)
+										 UPDATE Position SET frequency = counts.frequency FROM counts WHERE Position.position_id = counts.position_id;
+
+										 CREATE INDEX IF NOT EXISTS position_frequency ON Position(frequency);
+
+										 CREATE TRIGGER IF NOT EXISTS gamemove_frequency_insert AFTER INSERT ON GameMove
+										 BEGIN
+											UPDATE Position SET frequency = frequency + 1 WHERE position_id = (SELECT position_id FROM Move WHERE move_id = NEW.move_id);
+										 END;
+
+										 CREATE TRIGGER IF NOT EXISTS gamemove_frequency_delete AFTER DELETE ON GameMove
+										 BEGIN
+											UPDATE Position SET frequency = frequency - 1 WHERE position_id = (SELECT position_id FROM Move WHERE move_id = OLD.move_id);
+										 END;""")
+			self.commit()
+
+		# The time control of games ingested before it was stored is unknown
+		if 'time_control' not in [row[1] for row in self.cursor.execute("PRAGMA table_info(Game)").fetchall()]:
+			logger.info("Adding time_control column to Game.")
+			self.cursor.execute("ALTER TABLE Game ADD COLUMN time_control TEXT")
+			self.commit()
+
+		# The game counts of each player are counted once for the games already held, then kept by triggers on Game
+		counted = self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'PlayerGameCount'").fetchone()
+		with open('./SQLite_scripts/create_playerstats.sql', 'r') as fh:
+			self.cursor.executescript(fh.read())
+		if not counted:
+			logger.info("Counting the games of each player by ECO and time control.")
+			self.cursor.execute("""INSERT INTO PlayerGameCount(user_id, kind, value, games, wins, draws, losses)
+								   SELECT user_id, kind, value, COUNT(*), SUM(score = 1), SUM(score = 0.5), SUM(score = 0)
+								   FROM (SELECT white AS user_id, 'eco' AS kind, COALESCE(ECO, 'Unknown') AS value,
+												CASE result WHEN '1-0' THEN 1 WHEN '0-1' THEN 0 WHEN '1/2-1/2' THEN 0.5 END AS score FROM Game
+										 UNION ALL
+										 SELECT black, 'eco', COALESCE(ECO, 'Unknown'),
+												CASE result WHEN '0-1' THEN 1 WHEN '1-0' THEN 0 WHEN '1/2-1/2' THEN 0.5 END FROM Game
+										 UNION ALL
+										 SELECT white, 'time_control', COALESCE(time_control, 'Unknown'),
+												CASE result WHEN '1-0' THEN 1 WHEN '0-1' THEN 0 WHEN '1/2-1/2' THEN 0.5 END FROM Game
+										 UNION ALL
+										 SELECT black, 'time_control', COALESCE(time_control, 'Unknown'),
+												CASE result WHEN '0-1' THEN 1 WHEN '1-0' THEN 0 WHEN '1/2-1/2' THEN 0.5 END FROM Game)
+								   GROUP BY user_id, kind, value""")
+			self.commit()
+
 	def execute_command(self, command: str, arguments: Optional[tuple], commit: bool=True):
 		"""
-		Execute arbitrary command
+		Execute arbitrary command, the games it touches are unknown so the whole query cache is dropped
 		"""
 
 		logger.debug(f"Executing command {command}.")
@@ -100,6 +222,7 @@ class DBConn:
 			self.cursor.execute(command)
 		else:
 			self.cursor.execute(command, arguments)
+		self.clear_query_cache()
 		if commit: self.commit()
 
 	def execute_query(self, query: str, arguments: Optional[tuple]=None):
@@ -113,6 +236,96 @@ class DBConn:
 		else:
 			return self.cursor.execute(query, arguments)
 
+	def cached_query(self, game_id: int, query: str, arguments: tuple) -> List[tuple]:
+		"""
+		Rows of a read only query about a single game, answered from the query cache until a write touches that game
+		"""
+
+		key = (query, arguments)
+		with self.lock:
+			entry = self.query_cache.get(key)
+			if entry is not None:
+				self.query_cache.move_to_end(key)
+				self.cache_hits += 1
+				metrics.inc('query_cache_hits_total')
+				return list(entry[1])
+
+			self.cache_misses += 1
+			metrics.inc('query_cache_misses_total')
+			rows = self.conn.execute(query, arguments).fetchall()
+
+			game_id = int(game_id)
+			self.query_cache[key] = (game_id, rows)
+			self.cached_games.setdefault(game_id, set()).add(key)
+			if len(self.query_cache) > self.query_cache_size:
+				evicted, (evicted_game, _) = self.query_cache.popitem(last=False)
+				self._forget(evicted_game, evicted)
+
+		return list(rows)
+
+	def invalidate_games(self, game_ids: Iterable) -> None:
+		"""
+		Drop the cached query results of the given games
+		"""
+
+		with self.lock:
+			for game_id in set(int(game_id) for game_id in game_ids):
+				keys = self.cached_games.pop(game_id, ())
+				for key in keys:
+					del self.query_cache[key]
+				if keys:
+					self.cache_invalidations += 1
+					metrics.inc('query_cache_invalidations_total')
+
+	def invalidate_positions(self, position_ids: Iterable[int]) -> None:
+		"""
+		Drop the cached query results of every cached game containing one of the positions, positions are shared between games
+		"""
+
+		with self.lock:
+			if not self.cached_games:
+				return
+			position_ids = list(set(position_ids))
+			games = set()
+			# Stay well below the SQLite limit on query parameters
+			for i in range(0, len(position_ids), 500):
+				chunk = position_ids[i:i + 500]
+				games.update(row[0] for row in self.conn.execute(f"""SELECT DISTINCT gm.game_id
+																	   FROM GameMove gm
+																	   JOIN Move m
+																	   ON gm.move_id = m.move_id
+																	   WHERE m.position_id IN ({','.join('?' * len(chunk))})""", chunk))
+			self.invalidate_games(games & self.cached_games.keys())
+
+	def clear_query_cache(self) -> None:
+		with self.lock:
+			if self.query_cache:
+				self.cache_invalidations += len(self.cached_games)
+				metrics.inc('query_cache_invalidations_total', len(self.cached_games))
+			self.query_cache.clear()
+			self.cached_games.clear()
+
+	def query_cache_stats(self) -> dict:
+		"""
+		Hits, misses, hit rate, invalidated games and the current size of the query cache
+		"""
+
+		with self.lock:
+			lookups = self.cache_hits + self.cache_misses
+			return {'hits': self.cache_hits,
+					'misses': self.cache_misses,
+					'hit_rate': self.cache_hits / lookups if lookups else 0.0,
+					'invalidations': self.cache_invalidations,
+					'entries': len(self.query_cache),
+					'games': len(self.cached_games)}
+
+	def _forget(self, game_id: int, key: tuple) -> None:
+		keys = self.cached_games.get(game_id)
+		if keys is not None:
+			keys.discard(key)
+			if not keys:
+				del self.cached_games[game_id]
+
 	def create_user(self, user, commit: bool=True):
 		"""
 		Create a user
@@ -140,11 +353,12 @@ class DBConn:
 		Create a game
 		"""
 
-		sql_command = """INSERT OR IGNORE INTO Game(game_id, white, black, white_elo, black_elo, result, occurred_at, ECO)
-					     VALUES(?, (SELECT user_id FROM User WHERE username=?), (SELECT user_id FROM User WHERE username=?), ?, ?, ?, ?, ?)"""
+		sql_command = """INSERT OR IGNORE INTO Game(game_id, white, black, white_elo, black_elo, result, occurred_at, ECO, time_control)
+					     VALUES(?, (SELECT user_id FROM User WHERE username=?), (SELECT user_id FROM User WHERE username=?), ?, ?, ?, ?, ?, ?)"""
 
 		logger.debug(f"Adding game {game[0]} vs. {game[1]} from {game[5]}.")
 		self.cursor.execute(sql_command, game)
+		self.invalidate_games([game[0]])
 		if commit: self.conn.commit()
 	
 	def create_games(self, games: List[tuple], commit: bool=True):
@@ -152,11 +366,12 @@ class DBConn:
 		Create games, create_users should be run before this to populate the User table
 		"""
 
-		sql_command = """INSERT OR IGNORE INTO Game(game_id, white, black, white_elo, black_elo, result, occurred_at, ECO)
-					     VALUES(?, (SELECT user_id FROM User WHERE username=?), (SELECT user_id FROM User WHERE username=?), ?, ?, ?, ?, ?)"""
+		sql_command = """INSERT OR IGNORE INTO Game(game_id, white, black, white_elo, black_elo, result, occurred_at, ECO, time_control)
+					     VALUES(?, (SELECT user_id FROM User WHERE username=?), (SELECT user_id FROM User WHERE username=?), ?, ?, ?, ?, ?, ?)"""
 
 		logger.debug(f"Adding games.")
 		self.cursor.executemany(sql_command, games)
+		self.invalidate_games(game[0] for game in games)
 		if commit: self.conn.commit()
 	
 	def create_positions(self, moves: List[tuple], commit: bool=True):
@@ -164,10 +379,10 @@ class DBConn:
 		Create all positions from the move list
 		"""
 
-		sql_command = """INSERT OR IGNORE INTO Position(fen, colour) VALUES(?, ?)"""
+		sql_command = """INSERT OR IGNORE INTO Position(fen, colour, material) VALUES(?, ?, ?)"""
 
 		# Condition inputs
-		moves = [(x[5], x[5].split(' ')[1]) for x in moves]
+		moves = [(x[5], x[5].split(' ')[1], x[6]) for x in moves]
 
 		logger.debug("Adding positions to database.")
 		self.cursor.executemany(sql_command, moves)
@@ -199,33 +414,43 @@ class DBConn:
 
 		logger.debug("Creating game/move associations.")
 		self.cursor.executemany(sql_command, moves)
+		self.invalidate_games(set(move[0] for move in moves))
 		if commit: self.commit()
 
-	def add_user_to_db(self, username: str) -> None:
+	def add_games(self, batches: Iterable[Tuple[List[tuple], set, List[tuple]]]) -> int:
 		"""
-		Construct lists from username and write to database
+		Write batches of games from pgnproc.batch_games, each batch in its own transaction so a large history is never held at once.
+		Returns the number of games written.
 		"""
 
-		games, users, moves = pgnproc.construct_lists_by_username(username)
+		written = 0
+		for games, users, moves in batches:
+			with self.lock:
+				self.create_users(users, commit=False)
+				self.create_games(games, commit=False)
+				self.create_positions(moves, commit=False)
+				self.create_moves(moves, commit=False)
+				self.create_gamemoves(moves, commit=False)
+				self.commit()
+			written += len(games)
+			logger.debug(f"Written {written} games.")
 
-		self.create_users(users, commit=False)
-		self.create_games(games, commit=False)
-		self.create_positions(moves, commit=False)
-		self.create_moves(moves, commit=False)
-		self.create_gamemoves(moves, commit=True)
+		return written
 
-	def add_pgn(self, username: str, month: str):
+	def add_user_to_db(self, username: str) -> None:
 		"""
-		Given username and month, process into lists and add to database
+		Stream every archive of the username into the database in batches
 		"""
 
-		games, users, moves = pgnproc.single_pgn_to_lists_by_username(username=username, month=month)
+		written = self.add_games(pgnproc.batch_games(pgnproc.iter_games_by_username(username), self.ingest_batch_size))
+		logger.info(f"Added {written} games of {username}.")
+
+	def add_pgn(self, username: str, month: str):
+		"""
+		Given username and month, stream the archive into the database in batches
+		"""
 
-		self.create_users(users)
-		self.create_games(games)
-		self.create_positions(moves)
-		self.create_moves(moves)
-		self.create_gamemoves(moves)
+		self.add_games(pgnproc.batch_games(pgnproc.iter_games_by_username_and_month(username=username, month=month), self.ingest_batch_size))
 	
 	def change_depth(self, depth: int) -> bool:
 		"""
@@ -248,15 +473,173 @@ class DBConn:
 					   FROM Game
 					   WHERE game_id = ?"""
 		
-		resp = self.cursor.execute(sql_query, (game_id,)).fetchall()
+		resp = self.cached_query(game_id, sql_query, (game_id,))
 
 		return bool(len(resp))
 
+	def game_eval_depth(self, game_id: int) -> int:
+		"""
+		Return the lowest evaluation depth of the positions in a game, 0 if any position is unevaluated
+		"""
+
+		sql_query = """SELECT MIN(COALESCE(p.eval_depth, 0))
+					   FROM GameMove gm
+					   JOIN Move m
+					   ON gm.move_id = m.move_id
+					   JOIN Position p
+					   ON m.position_id = p.position_id
+					   WHERE gm.game_id = ?"""
+
+		resp = self.cached_query(game_id, sql_query, (game_id,))[0]
+
+		return resp[0] or 0
+
+	def game_eval_coverage(self, game_id: int) -> Tuple[int, int]:
+		"""
+		Return the number of plies in a game and how many of them still need an evaluation at the current depth
+		"""
+
+		sql_query = """SELECT COUNT(*), COALESCE(SUM(p.eval_depth IS NULL OR p.eval_depth < ?), 0)
+					   FROM GameMove gm
+					   JOIN Move m
+					   ON gm.move_id = m.move_id
+					   JOIN Position p
+					   ON m.position_id = p.position_id
+					   WHERE gm.game_id = ?"""
+
+		resp = self.cached_query(game_id, sql_query, (self.sf_depth, game_id))[0]
+
+		return resp[0], resp[1]
+
 	def evaluate_game_by_id(self, game_id: int, parallel: bool=False, commit: bool=True):
 		"""
 		Evaluate all positions from the given game_id
 		"""
 
+		# Request positions without an evaluation
+		with self.lock:
+			resp = self.unevaluated_positions(game_id)
+
+		# Get the evaluations
+		if parallel:
+			evaluations = self.eval_positions_parallel(resp)
+		else:
+			evaluations = self.eval_positions(resp)
+
+		logger.debug("Done evaluating positions.")
+
+		# Write all of the evaluations to the database, committed together with the player statistics they change
+		with self.lock:
+			self.write_evaluations(evaluations, commit=False)
+			self.update_player_stats([game_id], commit=False)
+			if commit: self.commit()
+
+	def update_player_stats(self, game_ids: Iterable[int], commit: bool=True) -> int:
+		"""
+		Write the move loss and move rank counts of each side of the fully evaluated games to PlayerGameStats,
+		the triggers on it keep the running sums of each player in PlayerStats.  Returns the number of games changed.
+		"""
+
+		# The statistics of CardData, the loss of a ply is the change of the evaluation it caused with mates as 10 pawns,
+		# the rank of a move its place among the top three moves of the previous position or 5 when it is none of them
+		sql_read_command = """	WITH plies AS (SELECT gm.move_num,
+													  p.colour,
+													  m.move_uci,
+													  p.eval_depth,
+													  p.first_move,
+													  p.second_move,
+													  p.third_move,
+													  CASE WHEN p.first_move_eval_type = 'mate'
+														   THEN 1000 * ((p.first_move_eval > 0) - (p.first_move_eval < 0))
+														   ELSE p.first_move_eval END AS eval
+											   FROM GameMove gm
+											   JOIN Move m
+											   ON gm.move_id = m.move_id
+											   JOIN Position p
+											   ON m.position_id = p.position_id
+											   WHERE gm.game_id = ?),
+									 moves AS (SELECT CASE colour WHEN 'b' THEN 'White' ELSE 'Black' END AS mover,
+													  eval_depth,
+													  eval - LAG(eval) OVER ply AS diff,
+													  CASE move_uci WHEN LAG(first_move) OVER ply THEN 1
+																	WHEN LAG(second_move) OVER ply THEN 2
+																	WHEN LAG(third_move) OVER ply THEN 3
+																	ELSE 5 END AS rank
+											   FROM plies
+											   WINDOW ply AS (ORDER BY move_num, colour))
+								SELECT mover,
+									   COUNT(*) - COUNT(eval_depth),
+									   MIN(eval_depth),
+									   COUNT(diff),
+									   ABS(COALESCE(SUM(diff), 0)) / 100.0,
+									   SUM(rank = 1),
+									   SUM(rank = 2),
+									   SUM(rank = 3),
+									   SUM(rank = 5)
+								FROM moves
+								GROUP BY mover"""
+
+		sql_write_command = """	INSERT INTO PlayerGameStats(game_id, colour, user_id, eval_depth, moves, loss, rank_1, rank_2, rank_3, rank_other)
+								SELECT game_id, ?, CASE ? WHEN 'White' THEN white ELSE black END, ?, ?, ?, ?, ?, ?, ?
+								FROM Game
+								WHERE game_id = ?"""
+
+		changed = 0
+		with self.lock:
+			for game_id in game_ids:
+				rows = self.cursor.execute(sql_read_command, (game_id,)).fetchall()
+				# Only games with every ply evaluated count towards the players
+				if not rows or any(unevaluated for _, unevaluated, *_ in rows):
+					continue
+				stats = [(mover, *values) for mover, _, *values in rows]
+				recorded = self.cursor.execute("""SELECT colour, eval_depth, moves, loss, rank_1, rank_2, rank_3, rank_other
+												  FROM PlayerGameStats WHERE game_id = ? ORDER BY colour""", (game_id,)).fetchall()
+				if recorded == sorted(stats):
+					continue
+
+				# Replacing the rows of a game takes its old statistics out of PlayerStats and adds the new ones
+				self.cursor.execute("DELETE FROM PlayerGameStats WHERE game_id = ?", (game_id,))
+				self.cursor.executemany(sql_write_command, [(mover, mover, *values, game_id) for mover, *values in stats])
+				changed += 1
+			if commit and changed: self.commit()
+
+		return changed
+
+	def player_summary(self, username: str) -> Optional[dict]:
+		"""
+		Running statistics of a player and their games by ECO and time control, read from the aggregates rather than the games.
+		None if the player is unknown.
+		"""
+
+		with self.lock:
+			user = self.cursor.execute("SELECT user_id FROM User WHERE username = ?", (username,)).fetchone()
+			if user is None:
+				return None
+			stats = self.cursor.execute("""SELECT games, moves, loss, rank_1, rank_2, rank_3, rank_other
+										   FROM PlayerStats WHERE user_id = ?""", user).fetchone() or (0,) * 7
+			counts = self.cursor.execute("""SELECT kind, value, games, wins, draws, losses
+											FROM PlayerGameCount WHERE user_id = ? AND games > 0
+											ORDER BY kind, games DESC, value""", user).fetchall()
+
+		games, moves, loss, *ranks = stats
+		ranked = sum(ranks)
+		summary = {'username': username,
+				   'games': sum(row[2] for row in counts if row[0] == 'eco'),
+				   'evaluated_games': games,
+				   'avg_move_loss': loss / moves if moves else None,
+				   'avg_move_rank': sum(rank * count for rank, count in zip((1, 2, 3, 5), ranks)) / ranked if ranked else None,
+				   'move_ranks': dict(zip(('best', 'second', 'third', 'other'), ranks))}
+		for kind in ('eco', 'time_control'):
+			summary[kind] = {value: {'games': games, 'wins': wins, 'draws': draws, 'losses': losses}
+							 for row_kind, value, games, wins, draws, losses in counts if row_kind == kind}
+
+		return summary
+
+	def unevaluated_positions(self, game_id: int) -> List[tuple]:
+		"""
+		Return the (position_id, fen) of the positions in a game below the evaluation depth
+		"""
+
 		sql_read_command = """	SELECT p.position_id, p.fen
 								FROM Game g
 								JOIN GameMove gm
@@ -268,25 +651,132 @@ class DBConn:
 								WHERE g.game_id = ?
 								  AND (eval_depth < ? or eval_depth IS NULL)
 								ORDER BY move_num"""
-		sql_write_command = """UPDATE Position SET eval_depth=?, first_move=?, second_move=?, third_move=?, first_move_eval=?, second_move_eval=?, third_move_eval=?, first_move_eval_type=?, second_move_eval_type=?, third_move_eval_type=? WHERE position_id = ?"""
 
-		# Request positions without an evaluation
 		self.cursor.execute(sql_read_command, (game_id, self.sf_depth))
 		resp = self.cursor.fetchall()
 		logger.info(f"Evaluating {len(resp)} positions at depth {self.sf_depth}.")
 
-		# Get the evaluations
+		return resp
+
+	def write_evaluations(self, evaluations: List[tuple], commit: bool=True):
+		"""
+		Write evaluations from evaluate_position to the database
+		"""
+
+		sql_write_command = """UPDATE Position SET eval_depth=?, first_move=?, second_move=?, third_move=?, first_move_eval=?, second_move_eval=?, third_move_eval=?, first_move_eval_type=?, second_move_eval_type=?, third_move_eval_type=? WHERE position_id = ?"""
+
+		with self.lock:
+			self.cursor.executemany(sql_write_command, evaluations)
+			# The position id is the last value of each evaluation
+			self.invalidate_positions(evaluation[-1] for evaluation in evaluations)
+			self.write_telemetry()
+			# Committing outside the lock could end a transaction another thread is writing, such as a batch of add_games
+			if commit: self.commit()
+
+	def record_telemetry(self, telemetry: List[tuple]) -> None:
+		"""
+		Keep the telemetry of evaluations until they are written
+		"""
+
+		with self.lock:
+			self.pending_telemetry += telemetry
+
+	def write_telemetry(self, commit: bool = False) -> None:
+		"""
+		Write the pending telemetry of evaluations to EngineTelemetry
+		"""
+
+		sql_write_command = f"""INSERT INTO EngineTelemetry({', '.join(self.telemetry_columns)}) VALUES({', '.join('?' * len(self.telemetry_columns))})"""
+
+		with self.lock:
+			telemetry, self.pending_telemetry = self.pending_telemetry, []
+			if not telemetry:
+				return
+			self.cursor.executemany(sql_write_command, telemetry)
+			nps = [row[self.telemetry_columns.index('nps')] for row in telemetry]
+			if any(nps):
+				metrics.set('engine_nodes_per_second', statistics.mean(value or 0 for value in nps))
+			if commit: self.commit()
+
+	def evaluated_positions(self, min_depth: int = 1, batch_size: int = 10000) -> Iterator[List[tuple]]:
+		"""
+		Yield the positions evaluated to at least min_depth in batches, as tuples in the order of evaluation_columns
+		"""
+
+		cursor = self.conn.execute(f"""SELECT {', '.join(self.evaluation_columns)}
+									   FROM Position
+									   WHERE eval_depth >= ?
+									   ORDER BY position_id""", (min_depth,))
+		while batch := cursor.fetchmany(batch_size):
+			yield batch
+
+	def merge_evaluations(self, evaluations: List[tuple], commit: bool = True) -> int:
+		"""
+		Add evaluations from another database, as tuples in the order of evaluation_columns.
+		Unknown positions are inserted and an evaluation only replaces a shallower one.
+		Returns the number of positions inserted or updated.
+		"""
+
+		columns = ('colour',) + self.evaluation_columns
+		updates = ', '.join(f"{column}=excluded.{column}" for column in self.evaluation_columns[2:])
+		sql_command = f"""INSERT INTO Position({', '.join(columns)}) VALUES({', '.join('?' * len(columns))})
+						  ON CONFLICT(fen) DO UPDATE SET {updates}
+						  WHERE Position.eval_depth IS NULL OR excluded.eval_depth > Position.eval_depth"""
+
+		with self.lock:
+			before = self.conn.total_changes
+			self.cursor.executemany(sql_command, [(evaluation[0].split(' ')[1], *evaluation) for evaluation in evaluations])
+			changed = self.conn.total_changes - before
+			# Which games contain the merged positions is not worth looking up for a bulk import
+			if changed:
+				self.clear_query_cache()
+			if commit: self.commit()
+
+		return changed
+	
+	def frequent_positions(self, number_of_positions: int, depth: int, min_frequency: int = 2) -> List[tuple]:
+		"""
+		Return the (position_id, fen) of the positions reached most often that are not yet evaluated to depth
+		"""
+
+		sql_read_command = """SELECT position_id, fen
+								FROM Position
+								WHERE frequency >= ?
+								  AND (eval_depth < ? OR eval_depth IS NULL)
+								ORDER BY frequency DESC
+								LIMIT ?"""
+
+		return self.conn.execute(sql_read_command, (min_frequency, depth, number_of_positions)).fetchall()
+
+	def evaluate_frequent_positions(self, number_of_positions: int, depth: int, min_frequency: int = 2, parallel: bool = False, commit: bool = True) -> int:
+		"""
+		Evaluate the most frequent positions below depth at depth ahead of the requests reaching them, returns the number evaluated
+		"""
+
+		with self.lock:
+			positions = self.frequent_positions(number_of_positions, depth, min_frequency)
+		if not positions:
+			return 0
+
+		logger.info(f"Evaluating {len(positions)} frequent positions at depth {depth}.")
 		if parallel:
-			evaluations = self.eval_positions_parallel(resp)
+			evaluations = self.eval_positions_parallel(positions, depth=depth)
 		else:
-			evaluations = self.eval_positions(resp)
+			evaluations = self.eval_positions(positions, depth=depth)
+		self.write_evaluations(evaluations, commit=commit)
 
-		logger.debug("Done evaluating positions.")
+		return len(positions)
+
+	def frequency_coverage(self, depth: int) -> float:
+		"""
+		Fraction of all the plies held whose position is evaluated to at least depth
+		"""
+
+		evaluated, total = self.conn.execute("""SELECT SUM(CASE WHEN eval_depth >= ? THEN frequency ELSE 0 END), SUM(frequency)
+												FROM Position""", (depth,)).fetchone()
+
+		return (evaluated or 0) / total if total else 0.0
 
-		# Write all of the evaluations to the database
-		self.cursor.executemany(sql_write_command, evaluations)
-		if commit: self.commit()
-	
 	def evaluate_next_n_positions(self, number_of_positions: int=10, parallel: bool=False, commit: bool=True):
 		"""
 		Evaluate the next n positions in the database
@@ -294,11 +784,11 @@ class DBConn:
 		# TODO: Could modify query to order by eval_depth and then once all positions had been evaluated you could go through it again at a higher depth
 
 		sql_read_command = """SELECT position_id, fen FROM Position WHERE eval_depth IS NULL LIMIT ?"""
-		sql_write_command = """UPDATE Position SET eval_depth=?, first_move=?, second_move=?, third_move=?, first_move_eval=?, second_move_eval=?, third_move_eval=?, first_move_eval_type=?, second_move_eval_type=?, third_move_eval_type=? WHERE position_id = ?"""
 
 		# Request positions without an evaluation
-		self.cursor.execute(sql_read_command, (number_of_positions,))
-		resp = self.cursor.fetchall()
+		with self.lock:
+			self.cursor.execute(sql_read_command, (number_of_positions,))
+			resp = self.cursor.fetchall()
 
 		# Get the evaluations
 		if parallel:
@@ -309,26 +799,40 @@ class DBConn:
 		logger.debug("Done evaluating positions.")
 
 		# Write all of the evaluations to the database
-		self.cursor.executemany(sql_write_command, evaluations)
-		if commit: self.commit()
+		self.write_evaluations(evaluations, commit=commit)
 	
-	def eval_positions(self, positions: List[tuple], commit: bool = True):
+	def eval_positions(self, positions: List[tuple], commit: bool = True, depth: Optional[int] = None):
 		"""
-		Evaluate the given list of positions
+		Evaluate the given list of positions, at the default depth unless another is given
 		"""
 		# TODO: Potential feature to give a single worker multiple positions to remove some of the overhead of creating the stockfish instance
-		evaluations = [DBConn.evaluate_position(self.engine, pos_id, fen, self.sf_depth) for pos_id, fen in positions]
+		depth = depth or self.sf_depth
+
+		# The engine is shared, put its depth back before anyone else uses it, the database stays free for other threads meanwhile
+		with self.engine_lock:
+			self.engine.set_depth(depth)
+			try:
+				evaluations, telemetry = [], []
+				for pos_id, fen in positions:
+					evaluations.append(DBConn.evaluate_position(self.engine, pos_id, fen, depth))
+					telemetry.append(DBConn.search_telemetry(self.engine, pos_id, depth, 1))
+			finally:
+				self.engine.set_depth(self.sf_depth)
+
+		self.record_telemetry(telemetry)
 		return evaluations
 	
-	def eval_positions_parallel(self, positions: List[tuple], commit: bool=True):
+	def eval_positions_parallel(self, positions: List[tuple], commit: bool=True, depth: Optional[int] = None):
 		"""
 		Evalute positions in a parallel manner using multiprocessing
 		"""
 		# Condition response for multiprocessing by adding depth
-		positions = [(t[0], t[1], self.sf_depth) for t in positions]
+		positions = [(t[0], t[1], depth or self.sf_depth) for t in positions]
 
 		# Evaluate the positions in parallel
-		with Pool() as p:
+		processes = os.cpu_count() or 1
+		positions = [(*position, processes) for position in positions]
+		with Pool(processes) as p:
 			# Start up the processes for each of the positions
 			pooling = p.starmap_async(DBConn.eval_positions_parallel_helper, positions)
 
@@ -336,23 +840,45 @@ class DBConn:
 			pooling.wait(timeout=50)
 			
 			# Get the evaluations or insert default 'error' response if timeout
-			evaluations = [value or (1, None, None, None, None, None, None, None, None, None, positions[i][0]) for i, value in enumerate(pooling._value)]
+			evaluations = [value[0] if value else (1, None, None, None, None, None, None, None, None, None, positions[i][0]) for i, value in enumerate(pooling._value)]
+			self.record_telemetry([value[1] for value in pooling._value if value])
 
 		return evaluations
 
 	@staticmethod
-	def eval_positions_parallel_helper(position_id: int, position: str, depth: int):
+	def eval_positions_parallel_helper(position_id: int, position: str, depth: int, workers: int = 1):
 		"""
-		Initialize Stockfish instance for each parallel call to evaluate_position, to be used by DBConn.eval_positions_parallel
+		Initialize Stockfish instance for each parallel call to evaluate_position, to be used by DBConn.eval_positions_parallel.
+		Returns the evaluation and its telemetry.
 		"""
 		# Initialize sf
-		sf = Stockfish(path='/opt/homebrew/bin/stockfish')
+		sf = TelemetryStockfish(path=stockfish_path)
 		sf.set_depth(depth)
 
-		return DBConn.evaluate_position(sf, position_id, position, depth)
+		return DBConn.evaluate_position(sf, position_id, position, depth), DBConn.search_telemetry(sf, position_id, depth, workers)
+
+	@staticmethod
+	def search_telemetry(sf: TelemetryStockfish, position_id: int, depth: int, workers: int) -> tuple:
+		"""
+		Row of EngineTelemetry for the last search of sf, workers is the number of engines evaluating alongside it
+		"""
+
+		search = sf.last_search()
+		parameters = sf.get_parameters()
+		row = {'position_id': position_id,
+			   'evaluated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			   'host': host,
+			   'engine_version': sf.version,
+			   'workers': workers,
+			   'threads': parameters.get('Threads'),
+			   'hash_mb': parameters.get('Hash'),
+			   'depth': depth,
+			   **search}
+
+		return tuple(row[column] for column in DBConn.telemetry_columns)
 
 	@staticmethod
-	def evaluate_position(sf: Stockfish, position_id: int, position: str, depth: int):
+	def evaluate_position(sf: TelemetryStockfish, position_id: int, position: str, depth: int):
 		"""
 		Helper function to evaluate a single position with Stockfish
 		"""
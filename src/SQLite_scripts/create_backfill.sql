@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS BackfillMonth (
+	username TEXT NOT NULL,
+	month TEXT NOT NULL,
+	stage TEXT NOT NULL,
+	bytes INTEGER,
+	games INTEGER,
+	plies INTEGER,
+	positions INTEGER,
+	error TEXT,
+	updated_at REAL NOT NULL,
+	PRIMARY KEY(username, month)
+);
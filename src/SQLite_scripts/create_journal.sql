@@ -0,0 +1,23 @@
+CREATE TABLE IF NOT EXISTS Job (
+	job_id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+	game_id INTEGER NOT NULL,
+	user TEXT,
+	stage TEXT NOT NULL,
+	error TEXT,
+	created_at REAL NOT NULL,
+	updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS JobTweet (
+	tweet_id INTEGER NOT NULL PRIMARY KEY,
+	job_id INTEGER NOT NULL,
+	replied INTEGER NOT NULL DEFAULT 0,
+	FOREIGN KEY(job_id) REFERENCES Job(job_id)
+);
+
+CREATE INDEX IF NOT EXISTS JobStage ON Job(stage);
+
+CREATE TABLE IF NOT EXISTS Checkpoint (
+	name TEXT NOT NULL PRIMARY KEY,
+	value INTEGER
+);
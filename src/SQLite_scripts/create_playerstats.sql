@@ -0,0 +1,94 @@
+-- Running statistics of each player, kept up to date as games are ingested and evaluated so a player summary reads a few rows
+
+-- Games of each player by ECO and by time control, counted as games are ingested
+CREATE TABLE IF NOT EXISTS PlayerGameCount (
+	user_id INTEGER NOT NULL,
+	kind TEXT NOT NULL,
+	value TEXT NOT NULL,
+	games INTEGER NOT NULL DEFAULT 0,
+	wins INTEGER NOT NULL DEFAULT 0,
+	draws INTEGER NOT NULL DEFAULT 0,
+	losses INTEGER NOT NULL DEFAULT 0,
+	PRIMARY KEY(user_id, kind, value),
+	FOREIGN KEY(user_id) REFERENCES User(user_id)
+);
+
+CREATE TRIGGER IF NOT EXISTS game_player_count_insert AFTER INSERT ON Game
+BEGIN
+	INSERT INTO PlayerGameCount(user_id, kind, value, games, wins, draws, losses)
+	VALUES (NEW.white, 'eco', COALESCE(NEW.ECO, 'Unknown'), 1, NEW.result = '1-0', NEW.result = '1/2-1/2', NEW.result = '0-1'),
+		   (NEW.black, 'eco', COALESCE(NEW.ECO, 'Unknown'), 1, NEW.result = '0-1', NEW.result = '1/2-1/2', NEW.result = '1-0'),
+		   (NEW.white, 'time_control', COALESCE(NEW.time_control, 'Unknown'), 1, NEW.result = '1-0', NEW.result = '1/2-1/2', NEW.result = '0-1'),
+		   (NEW.black, 'time_control', COALESCE(NEW.time_control, 'Unknown'), 1, NEW.result = '0-1', NEW.result = '1/2-1/2', NEW.result = '1-0')
+	ON CONFLICT(user_id, kind, value) DO UPDATE SET games = games + excluded.games,
+													wins = wins + excluded.wins,
+													draws = draws + excluded.draws,
+													losses = losses + excluded.losses;
+END;
+
+CREATE TRIGGER IF NOT EXISTS game_player_count_delete AFTER DELETE ON Game
+BEGIN
+	UPDATE PlayerGameCount
+	SET games = games - 1,
+		wins = wins - CASE WHEN OLD.result = '1-0' THEN user_id = OLD.white ELSE OLD.result = '0-1' AND user_id = OLD.black END,
+		draws = draws - (OLD.result = '1/2-1/2'),
+		losses = losses - CASE WHEN OLD.result = '1-0' THEN user_id = OLD.black ELSE OLD.result = '0-1' AND user_id = OLD.white END
+	WHERE user_id IN (OLD.white, OLD.black)
+	  AND ((kind = 'eco' AND value = COALESCE(OLD.ECO, 'Unknown')) OR (kind = 'time_control' AND value = COALESCE(OLD.time_control, 'Unknown')));
+END;
+
+-- Move loss and move rank counts of each side of an evaluated game, as shown on its card, written by DBConn.update_player_stats
+CREATE TABLE IF NOT EXISTS PlayerGameStats (
+	game_id INTEGER NOT NULL,
+	colour TEXT NOT NULL,
+	user_id INTEGER NOT NULL,
+	eval_depth INTEGER,
+	moves INTEGER NOT NULL,
+	loss REAL NOT NULL,
+	rank_1 INTEGER NOT NULL,
+	rank_2 INTEGER NOT NULL,
+	rank_3 INTEGER NOT NULL,
+	rank_other INTEGER NOT NULL,
+	PRIMARY KEY(game_id, colour),
+	FOREIGN KEY(game_id) REFERENCES Game(game_id),
+	FOREIGN KEY(user_id) REFERENCES User(user_id)
+);
+
+-- Sums of PlayerGameStats by player, kept by the triggers below
+CREATE TABLE IF NOT EXISTS PlayerStats (
+	user_id INTEGER NOT NULL PRIMARY KEY,
+	games INTEGER NOT NULL DEFAULT 0,
+	moves INTEGER NOT NULL DEFAULT 0,
+	loss REAL NOT NULL DEFAULT 0,
+	rank_1 INTEGER NOT NULL DEFAULT 0,
+	rank_2 INTEGER NOT NULL DEFAULT 0,
+	rank_3 INTEGER NOT NULL DEFAULT 0,
+	rank_other INTEGER NOT NULL DEFAULT 0,
+	FOREIGN KEY(user_id) REFERENCES User(user_id)
+);
+
+CREATE TRIGGER IF NOT EXISTS player_game_stats_insert AFTER INSERT ON PlayerGameStats
+BEGIN
+	INSERT INTO PlayerStats(user_id, games, moves, loss, rank_1, rank_2, rank_3, rank_other)
+	VALUES (NEW.user_id, 1, NEW.moves, NEW.loss, NEW.rank_1, NEW.rank_2, NEW.rank_3, NEW.rank_other)
+	ON CONFLICT(user_id) DO UPDATE SET games = games + 1,
+									   moves = moves + excluded.moves,
+									   loss = loss + excluded.loss,
+									   rank_1 = rank_1 + excluded.rank_1,
+									   rank_2 = rank_2 + excluded.rank_2,
+									   rank_3 = rank_3 + excluded.rank_3,
+									   rank_other = rank_other + excluded.rank_other;
+END;
+
+CREATE TRIGGER IF NOT EXISTS player_game_stats_delete AFTER DELETE ON PlayerGameStats
+BEGIN
+	UPDATE PlayerStats
+	SET games = games - 1,
+		moves = moves - OLD.moves,
+		loss = loss - OLD.loss,
+		rank_1 = rank_1 - OLD.rank_1,
+		rank_2 = rank_2 - OLD.rank_2,
+		rank_3 = rank_3 - OLD.rank_3,
+		rank_other = rank_other - OLD.rank_other
+	WHERE user_id = OLD.user_id;
+END;
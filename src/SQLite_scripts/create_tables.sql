@@ -13,6 +13,7 @@ CREATE TABLE Game (
 	result TEXT NOT NULL,
 	occurred_at TEXT,
 	ECO TEXT,
+	time_control TEXT,
 	FOREIGN KEY(white) REFERENCES User(user_id),
 	FOREIGN KEY(black) REFERENCES User(user_id)
 );
@@ -40,6 +41,7 @@ CREATE TABLE Position (
 	position_id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
 	fen TEXT NOT NULL UNIQUE,
 	colour TEXT NOT NULL,
+	material INTEGER,
 	eval_depth INTEGER,
 	first_move TEXT,
 	first_move_eval REAL,
@@ -49,6 +51,20 @@ CREATE TABLE Position (
 	second_move_eval_type TEXT,
 	third_move TEXT,
 	third_move_eval REAL,
-	third_move_eval_type TEXT
+	third_move_eval_type TEXT,
+	frequency INTEGER NOT NULL DEFAULT 0
 );
 
+-- Number of GameMove rows reaching each position, kept up to date as games are ingested
+CREATE INDEX position_frequency ON Position(frequency);
+
+CREATE TRIGGER gamemove_frequency_insert AFTER INSERT ON GameMove
+BEGIN
+	UPDATE Position SET frequency = frequency + 1 WHERE position_id = (SELECT position_id FROM Move WHERE move_id = NEW.move_id);
+END;
+
+CREATE TRIGGER gamemove_frequency_delete AFTER DELETE ON GameMove
+BEGIN
+	UPDATE Position SET frequency = frequency - 1 WHERE position_id = (SELECT position_id FROM Move WHERE move_id = OLD.move_id);
+END;
+
@@ -0,0 +1,22 @@
+-- Statistics of the engine search behind each evaluation, one row per evaluation
+CREATE TABLE IF NOT EXISTS EngineTelemetry (
+	telemetry_id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+	position_id INTEGER NOT NULL,
+	evaluated_at TEXT NOT NULL,
+	host TEXT,
+	engine_version TEXT,
+	workers INTEGER,
+	threads INTEGER,
+	hash_mb INTEGER,
+	depth INTEGER,
+	depth_reached INTEGER,
+	seldepth INTEGER,
+	nodes INTEGER,
+	nps INTEGER,
+	time_ms INTEGER,
+	hashfull INTEGER,
+	wall_ms REAL,
+	FOREIGN KEY (position_id) REFERENCES Position(position_id)
+);
+
+CREATE INDEX IF NOT EXISTS engine_telemetry_evaluated_at ON EngineTelemetry(evaluated_at);
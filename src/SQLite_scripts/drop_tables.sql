@@ -9,3 +9,10 @@ DROP TABLE IF EXISTS GameMove;
 
 DROP TABLE IF EXISTS Position;
 
+DROP TABLE IF EXISTS EngineTelemetry;
+
+DROP TABLE IF EXISTS PlayerGameCount;
+
+DROP TABLE IF EXISTS PlayerGameStats;
+
+DROP TABLE IF EXISTS PlayerStats;
@@ -1,10 +1,18 @@
 
+from datetime import datetime, timezone
 import logging
 import os
-from typing import List, Optional
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
 
 import dotenv
+import requests
+from requests.adapters import HTTPAdapter
 import tweepy as tp
+from urllib.parse import urlsplit, urlunsplit
+
+from metrics import metrics
 
 dotenv_file = dotenv.find_dotenv()
 dotenv.load_dotenv(dotenv_file)
@@ -16,7 +24,14 @@ class TwitterAPI:
     Class for access of the Twitter API using tweepy
     """
 
-    def __init__(self, max_tweet_results: int = 10):
+    # Uploaded media can be attached for 24 hours, reuse it for a little less than that
+    media_ttl = 23 * 3600
+    # Attempts of an upload or reply and the first delay between them, doubled after each failure
+    retries = 4
+    retry_delay = 1.0
+
+    def __init__(self, max_tweet_results: int = 10, latest_responded: Optional[int] = None, api: Optional[tp.API] = None,
+                 base_url: Optional[str] = None):
         
         # Consumer tokens
         self.API_key = os.environ.get('TWITTER_CONSUMER_API_KEY')
@@ -38,9 +53,20 @@ class TwitterAPI:
         # Test
         self.latest_responded = 0
 
-        # Initialize authorization of the twitter API
-        self.get_auth()
-        self.init_latest()
+        # Media id and upload time by card digest, and the uploads in progress
+        self.media_cache = {}
+        self.uploading = {}
+        self.media_lock = threading.Lock()
+
+        # Initialize authorization of the twitter API, an api object given here is used as is
+        if api is not None:
+            self.api = api
+        elif base_url is not None:
+            self.api = self.local_api(base_url)
+        else:
+            self.get_auth()
+        # Without a checkpoint from a previous run everything up to the newest tweet is skipped, found by the first search
+        self.latest_responded = latest_responded
     
     def get_auth(self):
         """
@@ -73,6 +99,20 @@ class TwitterAPI:
                                              access_token_secret=self.access_token_secret)
             self.api = tp.API(self.auth)
 
+    @staticmethod
+    def local_api(base_url: str) -> tp.API:
+        """
+        API object sending every request to base_url instead of Twitter, such as a fake_twitter server, no tokens needed
+        """
+
+        api = tp.API(tp.OAuth1UserHandler('local', 'local', 'local', 'local'))
+        # tweepy only builds https urls for its hosts, the adapter swaps in the local server
+        adapter = RedirectAdapter(base_url)
+        api.session.mount(f"https://{api.host}/", adapter)
+        api.session.mount(f"https://{api.upload_host}/", adapter)
+
+        return api
+
     def twitter_pin_auth(self):
         """
         Complete the pin auth procedure
@@ -96,45 +136,170 @@ class TwitterAPI:
         Update the latest responded field, to be used on startup
         """
 
-        latest = self.search_hashtag()[0]
-        self.latest_responded = latest[0]
+        # Only the newest tweet is needed, a single page
+        results = self.api.search_30_day(self.label, query=self.query, maxResults=10)
+        self.latest_responded = results[0].id if len(results) else 0
+
+    @staticmethod
+    def tweet_time(tweet_id: int) -> datetime:
+        """
+        Creation time of a tweet, tweet ids start with the milliseconds since the Twitter epoch
+        """
+
+        return datetime.fromtimestamp(((tweet_id >> 22) + 1288834974657) / 1000, tz=timezone.utc)
 
     def search_hashtag(self):
         """
-        Search twitter for recent tweets
+        Search twitter for tweets newer than the latest responded, newest first.
+        The search starts at the minute of the latest responded tweet so only new tweets are transferred,
+        following further pages until a tweet seen before or the last page, as the new tweets are only complete together.
+        Without a latest responded tweet the first search only finds the newest tweet and returns nothing.
         """
 
+        if self.latest_responded is None:
+            # A failed search is retried by the next poll
+            try:
+                self.init_latest()
+            except Exception as e:
+                logger.error(f"Error querying latest tweets, retrying next poll: {e}")
+            return []
+
+        kwargs = {'query': self.query, 'maxResults': self.maxResults}
+        if self.latest_responded:
+            # The search only takes whole minutes, the tweets from earlier in that minute are filtered out below
+            kwargs['fromDate'] = self.tweet_time(self.latest_responded).strftime('%Y%m%d%H%M')
+
+        tweets = []
         try:
-            results = self.api.search_30_day(self.label,
-                                             query=self.query,
-                                             maxResults=self.maxResults)
+            # No page limit, the checkpoint moves to the newest tweet so a page left unread would never be searched again
+            for page in tp.Cursor(self.api.search_30_day, self.label, **kwargs).pages():
+                new = [tweet for tweet in page if tweet.id > self.latest_responded]
+                tweets.extend((tweet.id, tweet.text, tweet.created_at, tweet.user.screen_name) for tweet in new)
+                # Pages run from newest to oldest, anything after an old tweet was seen before
+                if len(new) < len(page):
+                    break
+        except tp.TooManyRequests:
+            rate_limit = self.rate_limit()
+            # The pages already read are only the newest tweets, the whole search is repeated by the next poll
+            logger.warning(f"Search rate limited until {time.ctime(rate_limit[1]) if rate_limit else 'unknown'}, retrying next poll.")
+            return []
         except Exception as e:
-            logger.error(f"Error querying latest tweets: {e}")
-            quit()
-        
-        tweets = []
-        for tweet in results:
-            if tweet.id > self.latest_responded:
-                tweets.append((tweet.id, tweet.text, tweet.created_at))
+            # Tweets of the pages already read are not lost, they are newer than latest_responded and found again by the next poll
+            logger.error(f"Error querying latest tweets, retrying next poll: {e}")
+            return []
         
         return tweets
+
+    def rate_limit(self) -> Optional[Tuple[int, float]]:
+        """
+        Requests remaining in the rate limit window and the epoch time the window resets, from the last response
+        """
+
+        response = getattr(self.api, 'last_response', None)
+        if response is None or 'x-rate-limit-remaining' not in response.headers:
+            return None
+
+        return int(response.headers['x-rate-limit-remaining']), float(response.headers['x-rate-limit-reset'])
     
     def reply(self, replies: List[tuple]):
         """
         Reply to all tweets given in replies list
-        List[(id, filename)]
+        List[(id, CardImage)]
         """
 
         for reply in replies:
-            logger.info(f"Replying to tweet: {reply}")
-            media = self.api.media_upload(reply[1])
-
-            self.api.update_status("All evaluations are in units of pawns(point of material).", 
-                                   in_reply_to_status_id=reply[0], 
-                                   media_ids=[media.media_id], 
-                                   auto_populate_reply_metadata=True)
+            self.reply_card(*reply)
         
         # Update the latest replied
         self.latest_responded = replies[0][0]
         
         print("Done replying")
+
+    def reply_card(self, tweet_id: int, card):
+        """
+        Reply to a single tweet with a CardImage
+        """
+
+        self.reply_media(tweet_id, self.upload_card(card))
+
+    def upload_card(self, card) -> int:
+        """
+        Upload a CardImage and return the media id, the same media can be attached to several replies.
+        A card uploaded within the media validity window is not uploaded again.
+        """
+
+        while 1:
+            with self.media_lock:
+                cached = self.media_cache.get(card.digest)
+                if cached is not None and time.time() - cached[1] < self.media_ttl:
+                    logger.info(f"Reusing media {cached[0]}")
+                    metrics.inc('media_reused_total')
+                    return cached[0]
+                # Wait for an upload of the same card already in progress rather than uploading it twice
+                uploading = self.uploading.get(card.digest)
+                if uploading is None:
+                    self.uploading[card.digest] = threading.Event()
+                    break
+            # Either the media is now cached or that upload failed and this one takes over
+            uploading.wait()
+
+        try:
+            logger.info(f"Uploading {len(card)} byte {card.format} card")
+            # Upload straight from memory, the filename only tells Twitter the media type
+            with metrics.span('upload'):
+                media_id = self._retry(lambda: self.api.media_upload(card.filename, file=card.buffer()).media_id)
+            with self.media_lock:
+                self.media_cache[card.digest] = (media_id, time.time())
+        finally:
+            with self.media_lock:
+                self.uploading.pop(card.digest).set()
+
+        return media_id
+
+    def reply_media(self, tweet_id: int, media_id: int):
+        """
+        Reply to a single tweet with already uploaded media
+        """
+
+        logger.info(f"Replying to tweet: {tweet_id}")
+        with metrics.span('reply'):
+            self._retry(lambda: self.api.update_status("All evaluations are in units of pawns(point of material).", 
+                                                       in_reply_to_status_id=tweet_id, 
+                                                       media_ids=[media_id], 
+                                                       auto_populate_reply_metadata=True))
+
+    def _retry(self, request: Callable):
+        """
+        Make a request, retrying server errors, rate limits and dropped connections with exponential backoff
+        """
+
+        delay = self.retry_delay
+        for attempt in range(1, self.retries + 1):
+            try:
+                return request()
+            except (tp.TwitterServerError, tp.TooManyRequests, requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                wait = delay
+                # A rate limited request is retried once the window resets
+                rate_limit = self.rate_limit()
+                if isinstance(e, tp.TooManyRequests) and rate_limit is not None:
+                    wait = max(wait, rate_limit[1] - time.time())
+                logger.warning(f"Twitter request failed ({e!r}), attempt {attempt} of {self.retries}, retrying in {wait:.1f}s.")
+                time.sleep(wait)
+                delay *= 2
+
+
+class RedirectAdapter(HTTPAdapter):
+    """
+    Transport adapter sending requests to another scheme and host, keeping the path and query
+    """
+
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base = urlsplit(base_url)
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        request.url = urlunsplit((self.base.scheme, self.base.netloc, url.path, url.query, url.fragment))
+        return super().send(request, **kwargs)
@@ -0,0 +1,319 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import DBConn as dbconn
+from DBConn import DBConn
+import pgnproc
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class BackfillCheckpoint:
+    """
+    SQLite record of the last stage each month archive of a backfill completed, so an interrupted backfill resumes where it stopped.
+    """
+
+    # Stages in the order they complete
+    stages = ['downloaded', 'ingested', 'evaluated']
+    failed = 'failed'
+
+    def __init__(self, name: str = 'backfill.db'):
+        self.name = name
+        self.lock = threading.Lock()
+
+        try:
+            self.conn = sqlite3.connect(self.name, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            with open('./SQLite_scripts/create_backfill.sql', 'r') as fh:
+                self.conn.executescript(fh.read())
+            self.conn.commit()
+        except sqlite3.Error as e:
+            logger.critical(f"Error opening backfill checkpoint: {e}")
+            quit()
+
+    def __del__(self):
+        self.conn.close()
+
+    def stage(self, username: str, month: str) -> Optional[str]:
+        """
+        Last stage completed for a month archive, None if it was never started
+        """
+
+        with self.lock:
+            resp = self.conn.execute("SELECT stage FROM BackfillMonth WHERE username = ? AND month = ?", (username, month)).fetchone()
+        return resp[0] if resp else None
+
+    def advance(self, username: str, month: str, stage: str, **counts: int) -> None:
+        """
+        Record a completed stage of a month archive along with its bytes, games, plies or positions
+        """
+
+        columns = ['stage', 'error', 'updated_at'] + list(counts)
+        values = [stage, None, time.time()] + list(counts.values())
+        updates = ', '.join(f"{column}=excluded.{column}" for column in columns)
+        with self.lock:
+            self.conn.execute(f"""INSERT INTO BackfillMonth(username, month, {', '.join(columns)}) VALUES(?, ?, {', '.join('?' * len(columns))})
+                                  ON CONFLICT(username, month) DO UPDATE SET {updates}""", (username, month, *values))
+            self.conn.commit()
+
+    def fail(self, username: str, month: str, error: str) -> None:
+        """
+        Mark a month archive as failed, it is retried by the next run
+        """
+
+        self.advance(username, month, self.failed)
+        with self.lock:
+            self.conn.execute("UPDATE BackfillMonth SET error = ? WHERE username = ? AND month = ?", (error, username, month))
+            self.conn.commit()
+
+    def counts(self) -> dict:
+        """
+        Number of month archives at each stage
+        """
+
+        with self.lock:
+            return dict(self.conn.execute("SELECT stage, COUNT(*) FROM BackfillMonth GROUP BY stage").fetchall())
+
+
+class Backfill:
+    """
+    Download, ingest and optionally evaluate the full history of a list of users, checkpointing every month archive.
+    Archives are downloaded by several workers while the database is written by one, months already completed are skipped,
+    except for the latest month of each user which is still being played and is always fetched again.
+    """
+
+    def __init__(self, db: DBConn, checkpoint: BackfillCheckpoint, workers: int = 2, evaluate: bool = False, parallel: bool = False,
+                 months: Optional[Iterable[str]] = None):
+        self.db = db
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.evaluate = evaluate
+        self.parallel = parallel
+        self.months = set(months) if months else None
+        self.done = 'evaluated' if evaluate else 'ingested'
+        self.totals = {'months': 0, 'failed': 0, 'bytes': 0, 'games': 0, 'plies': 0, 'positions': 0}
+
+    def plan(self, usernames: List[str]) -> List[Tuple[str, str, bool]]:
+        """
+        The (username, month, download) of every month archive still to be done
+        """
+
+        plan = []
+        for username in usernames:
+            try:
+                months = pgnproc.get_player_months([username])[username]["Dates"]
+            except Exception as e:
+                logger.error(f"Error listing the archives of {username}, skipping them: {e}")
+                continue
+            for month in months:
+                if self.months is not None and month not in self.months:
+                    continue
+                stage = self.checkpoint.stage(username, month)
+                latest = month == months[-1]
+                if not latest and stage in self.checkpoint.stages and self.checkpoint.stages.index(stage) >= self.checkpoint.stages.index(self.done):
+                    continue
+                # Archives downloaded by an interrupted run are not fetched again, unless they are gone
+                download = latest or stage in (None, self.checkpoint.failed) or not os.path.isfile(self._path(username, month))
+                plan.append((username, month, download))
+
+        logger.info(f"{len(plan)} month archives of {len(usernames)} users to backfill, {sum(download for *_, download in plan)} to download.")
+        return plan
+
+    def run(self, usernames: List[str]) -> Dict[str, float]:
+        """
+        Backfill the users and return the totals and throughput, also when interrupted
+        """
+
+        start = time.perf_counter()
+        plan = self.plan(usernames)
+
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='backfill')
+        try:
+            downloads = {executor.submit(self.download, username, month): (username, month) for username, month, download in plan if download}
+            # Months already downloaded are written while the downloads run
+            for username, month, download in plan:
+                if not download:
+                    self.process(username, month)
+            for future in as_completed(downloads):
+                username, month = downloads[future]
+                try:
+                    size = future.result()
+                except Exception as e:
+                    self._fail(username, month, f"download: {e}")
+                    continue
+                self.checkpoint.advance(username, month, 'downloaded', bytes=size)
+                self.totals['bytes'] += size
+                self.process(username, month)
+        except KeyboardInterrupt:
+            logger.warning("Interrupted, the next run continues from the last completed month.")
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        return self.report(time.perf_counter() - start)
+
+    def download(self, username: str, month: str) -> int:
+        """
+        Save a month archive to the pgn directory and return its size in bytes
+        """
+
+        pgnproc.make_directory(username, pgn_directory=pgnproc.global_pgn_directory)
+        asyncio.run(pgnproc.save_player_games_by_month(username, month[:4], month[-2:], pgn_directory=pgnproc.global_pgn_directory))
+
+        return os.path.getsize(self._path(username, month))
+
+    def process(self, username: str, month: str) -> None:
+        """
+        Ingest and optionally evaluate a downloaded month archive, checkpointing each stage
+        """
+
+        try:
+            month_start = time.perf_counter()
+            game_ids, plies = [], [0]
+            games = self.db.add_games(pgnproc.batch_games(self._counted(pgnproc.iter_games_by_username_and_month(username, month), game_ids, plies),
+                                                          self.db.ingest_batch_size))
+            self.checkpoint.advance(username, month, 'ingested', games=games, plies=plies[0])
+
+            positions = 0
+            if self.evaluate:
+                for game_id in game_ids:
+                    positions += self.db.game_eval_coverage(game_id)[1]
+                    self.db.evaluate_game_by_id(game_id, parallel=self.parallel)
+                self.checkpoint.advance(username, month, 'evaluated', positions=positions)
+        except Exception as e:
+            self._fail(username, month, f"{type(e).__name__}: {e}")
+            return
+
+        seconds = time.perf_counter() - month_start
+        self.totals['months'] += 1
+        self.totals['games'] += games
+        self.totals['plies'] += plies[0]
+        self.totals['positions'] += positions
+        logger.info(f"{username} {month}: {games} games, {plies[0]} plies" + (f", {positions} positions evaluated" if self.evaluate else "")
+                    + f" in {seconds:.1f}s.")
+
+    def report(self, seconds: float) -> Dict[str, float]:
+        """
+        Totals of this run and their rates per second
+        """
+
+        report = dict(self.totals)
+        report['seconds'] = round(seconds, 2)
+        for name in ('games', 'plies', 'positions'):
+            report[f'{name}_per_s'] = round(self.totals[name] / seconds, 2) if seconds else 0.0
+        report['download_mb'] = round(self.totals['bytes'] / 2**20, 2)
+        report['checkpoint'] = self.checkpoint.counts()
+
+        return report
+
+    def _fail(self, username: str, month: str, error: str) -> None:
+        logger.error(f"Backfill of {username} {month} failed, it is retried by the next run: {error}")
+        self.checkpoint.fail(username, month, error)
+        self.totals['failed'] += 1
+
+    @staticmethod
+    def _counted(games: Iterator[Tuple[tuple, list]], game_ids: List[int], plies: List[int]) -> Iterator[Tuple[tuple, list]]:
+        """
+        Pass the games through, keeping their ids and counting their plies
+        """
+
+        for game, game_plies in games:
+            game_ids.append(int(game[0]))
+            plies[0] += len(game_plies)
+            yield game, game_plies
+
+    @staticmethod
+    def _path(username: str, month: str) -> str:
+        return f"{pgnproc.global_pgn_directory}{username}/{month}.txt"
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s - %(name)s')
+
+    if args.chesscom_url:
+        pgnproc.use_chesscom_host(args.chesscom_url)
+    if args.engine:
+        dbconn.stockfish_path = args.engine
+
+    db = DBConn(args.database, sf_depth=int(args.default_depth))
+    backfill = Backfill(db, BackfillCheckpoint(args.checkpoint), workers=int(args.workers), evaluate=args.evaluate,
+                        parallel=args.parallel, months=args.months)
+    report = backfill.run(args.usernames)
+
+    for key, value in report.items():
+        print(f"{key:>16}: {value}")
+
+def parse_arguments():
+    """
+    Parse the command-line arguments
+    """
+
+    parser = argparse.ArgumentParser(prog='backfill',
+                                     description='Download, ingest and optionally evaluate the full game history of chess.com users, resuming where an earlier run stopped.')
+
+    parser.add_argument('usernames',
+                        help='chess.com usernames to backfill',
+                        nargs='+')
+
+    parser.add_argument('-b',
+                        '--database',
+                        help='set database file - Default: chesscom_db.db',
+                        action='store',
+                        default='chesscom_db.db')
+
+    parser.add_argument('-j',
+                        '--checkpoint',
+                        help='set file recording the completed months - Default: backfill.db',
+                        action='store',
+                        default='backfill.db')
+
+    # Downloads wait on chess.com, the database is written by one thread
+    parser.add_argument('-w',
+                        '--workers',
+                        help='set number of concurrent archive downloads - Default: 2 - Range: [1, 10]',
+                        action='store',
+                        default=2)
+
+    parser.add_argument('-m',
+                        '--months',
+                        help='set months to backfill as yyyy-mm - Default: all of them',
+                        action='store',
+                        nargs='+',
+                        default=None)
+
+    parser.add_argument('-e',
+                        '--evaluate',
+                        help='evaluate the games of each month after ingesting it',
+                        action='store_true')
+
+    parser.add_argument('-d',
+                        '--default_depth',
+                        help='set evaluation depth in moves - Default: 15 - Range: [1, 20]',
+                        action='store',
+                        default=15)
+
+    parser.add_argument('-p',
+                        '--parallel',
+                        help='evaluate with a process per position',
+                        action='store_true')
+
+    parser.add_argument('-s',
+                        '--chesscom_url',
+                        help='set base url of a local chess.com - Default: none, the real chess.com',
+                        action='store',
+                        default=None)
+
+    parser.add_argument('--engine',
+                        help='set engine executable - Default: STOCKFISH_PATH or /opt/homebrew/bin/stockfish',
+                        action='store',
+                        default=None)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,365 @@
+import argparse
+import csv
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cardcache import CardCache
+from cardconstruction import CardConstruction
+from cardimage import CardEncoding, CardImage
+import DBConn as dbconn
+from DBConn import DBConn
+from enginepool import EnginePool
+import pgnproc
+from pipeline import Stage
+from renderpool import LazyPlotter, RenderPool
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class BatchJob:
+    """
+    A game of a batch, the stages it completed and how long each took
+    """
+
+    def __init__(self, game_id: int):
+        self.game_id = game_id
+        self.archieve: Optional[Tuple[str, str]] = None
+        self.card: Optional[CardImage] = None
+        # Where the card was saved, the image itself is dropped once the job is done
+        self.path: Optional[str] = None
+        self.plies = 0
+        self.unevaluated = 0
+        self.error: Optional[str] = None
+
+        self.submitted = time.perf_counter()
+        self.finished: Optional[float] = None
+        # Seconds spent in each stage, by stage name
+        self.timings = {}
+
+    def __repr__(self) -> str:
+        return f"BatchJob(game={self.game_id})"
+
+
+class BatchCards:
+    """
+    Generate the cards of many games through the stages of the bot: fetch -> ingest -> evaluate -> render -> save.
+    Engines and render workers are started once for the whole batch, and a month archieve holding several of the games
+    is downloaded and ingested once. The cards land in the card cache, where the bot finds them, and optionally in an output directory.
+    """
+
+    # Columns of the summary, the stage columns are seconds
+    stages = ['fetch', 'ingest', 'evaluate', 'render', 'save']
+    summary_columns = ['game_id', 'status', 'plies', 'unevaluated'] + stages + ['total', 'path', 'error']
+
+    def __init__(self, cc: CardConstruction, fetch_workers: int = 2, eval_workers: int = 1, render_workers: int = 1,
+                 output_directory: Optional[str] = None, force: bool = False):
+        self.cc = cc
+        self.output_directory = output_directory
+        self.force = force
+
+        # Ingest writes a whole archieve in one transaction, more workers would only wait on the lock
+        self.pipeline = [Stage('fetch', self._fetch, fetch_workers, self._failed),
+                         Stage('ingest', self._ingest, 1, self._failed),
+                         Stage('evaluate', self._evaluate, eval_workers, self._failed),
+                         Stage('render', self._render, render_workers, self._failed),
+                         Stage('save', self._save, 1, self._failed)]
+        for stage, following in zip(self.pipeline, self.pipeline[1:]):
+            stage.next = following
+
+        # Month archieves of this batch, downloaded once and ingested once
+        self.downloads: Dict[Tuple[str, str], threading.Event] = {}
+        self.ingested = set()
+        self.lock = threading.Lock()
+
+        self.jobs: List[BatchJob] = []
+
+    def run(self, game_ids: Iterable[int]) -> List[BatchJob]:
+        """
+        Generate the cards of the games and return their jobs once every card is done or failed
+        """
+
+        for stage in self.pipeline:
+            stage.start()
+        logger.info("Started batch with " + ", ".join(f"{s.workers} {s.name}" for s in self.pipeline) + " workers.")
+
+        for game_id in game_ids:
+            job = BatchJob(game_id)
+            self.jobs.append(job)
+            self.pipeline[0].put(job)
+
+        # Each stage finishes its queued jobs before the next stage is stopped
+        for stage in self.pipeline:
+            stage.stop()
+
+        return self.jobs
+
+    def _fetch(self, job: BatchJob) -> None:
+        job.archieve = self.cc.locate(job.game_id)
+        if job.archieve is None:
+            return
+
+        # Games from the same month archieve wait on the first download of it
+        with self.lock:
+            done = self.downloads.get(job.archieve)
+            first = done is None
+            if first:
+                done = self.downloads[job.archieve] = threading.Event()
+        if first:
+            try:
+                self.cc.download(*job.archieve)
+            finally:
+                done.set()
+        else:
+            done.wait()
+
+    def _ingest(self, job: BatchJob) -> None:
+        if job.archieve is not None and job.archieve not in self.ingested:
+            self.cc.ingest(*job.archieve)
+            self.ingested.add(job.archieve)
+
+    def _evaluate(self, job: BatchJob) -> None:
+        coverage = self.cc.coverage(job.game_id)
+        if coverage is None:
+            raise LookupError(f"game {job.game_id} is not in the database")
+        job.plies, job.unevaluated = coverage
+        self.cc.evaluate(job.game_id)
+
+    def _render(self, job: BatchJob) -> None:
+        job.card = self.cc.render(job.game_id, force=self.force)
+
+    def _save(self, job: BatchJob) -> None:
+        if self.output_directory is not None:
+            job.card.save(os.path.join(self.output_directory, str(job.game_id)))
+        job.path = job.card.path
+        self._finish(job)
+
+    def _failed(self, job: BatchJob, error: str) -> None:
+        job.error = error
+        self._finish(job)
+
+    def _finish(self, job: BatchJob) -> None:
+        job.finished = time.perf_counter()
+        done = sum(job.finished is not None for job in self.jobs)
+        logger.info(f"{job} {'failed' if job.error else 'done'} in {job.finished - job.submitted:.1f}s, {done}/{len(self.jobs)} games.")
+        # The image of every card would otherwise stay in memory until the summary
+        job.card = None
+
+    @classmethod
+    def summary_row(cls, job: BatchJob) -> dict:
+        """
+        Row of the summary for a job
+        """
+
+        row = {'game_id': job.game_id,
+               'status': 'failed' if job.error else 'done',
+               'plies': job.plies,
+               'unevaluated': job.unevaluated,
+               'total': round(job.finished - job.submitted, 3) if job.finished is not None else None,
+               'path': job.path,
+               'error': job.error}
+        for stage in cls.stages:
+            row[stage] = round(job.timings[stage], 3) if stage in job.timings else None
+
+        return row
+
+    @classmethod
+    def write_summary(cls, jobs: List[BatchJob], filename: str) -> None:
+        """
+        Write the per game timings as CSV
+        """
+
+        with open(filename, 'w', newline='') as fh:
+            writer = csv.DictWriter(fh, fieldnames=cls.summary_columns)
+            writer.writeheader()
+            writer.writerows(cls.summary_row(job) for job in jobs)
+
+def read_game_ids(filename: str) -> List[int]:
+    """
+    Game ids from a file, one per line, without duplicates. Blank lines and lines starting with # are skipped, - reads stdin.
+    """
+
+    fh = sys.stdin if filename == '-' else open(filename, 'r')
+    game_ids = []
+    with fh:
+        for number, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                game_ids.append(int(line.split()[0]))
+            except ValueError:
+                logger.warning(f"Line {number} of {filename} is not a game id: {line}")
+
+    return list(dict.fromkeys(game_ids))
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s - %(name)s')
+
+    if args.chesscom_url:
+        pgnproc.use_chesscom_host(args.chesscom_url)
+    if args.engine:
+        dbconn.stockfish_path = args.engine
+
+    game_ids = read_game_ids(args.game_ids)
+    logger.info(f"Generating the cards of {len(game_ids)} games.")
+
+    db = DBConn(args.database, sf_depth=int(args.default_depth))
+    encoding = CardEncoding(image_format=args.image_format,
+                            quality=int(args.image_quality),
+                            max_bytes=int(args.image_max_kb) * 1024 if args.image_max_kb else None)
+    plotter = LazyPlotter(renderer=args.renderer, db=db, encoding=encoding)
+    render_pool = RenderPool(renderer=args.renderer, processes=int(args.render_workers), encoding=encoding) if int(args.render_workers) else None
+    engine_pool = EnginePool(dbconn.stockfish_path, processes=int(args.engine_workers) or None)
+    cache = CardCache(directory=args.card_directory, max_bytes=int(args.card_cache_mb) * 2**20)
+    cc = CardConstruction(db=db, plotter=plotter, cache=cache, render_pool=render_pool, engine_pool=engine_pool,
+                          chesscom_url=args.chesscom_url or "https://www.chess.com")
+    if args.output_directory:
+        os.makedirs(args.output_directory, exist_ok=True)
+
+    # Each game holds an engine worker for a short while, a second game keeps them busy while the first is read and written
+    batch = BatchCards(cc,
+                       fetch_workers=int(args.fetch_workers),
+                       eval_workers=int(args.eval_workers),
+                       render_workers=render_pool.processes if render_pool else 1,
+                       output_directory=args.output_directory,
+                       force=args.force)
+
+    start = time.perf_counter()
+    try:
+        jobs = batch.run(game_ids)
+    finally:
+        engine_pool.close()
+        if render_pool is not None:
+            render_pool.close()
+    seconds = time.perf_counter() - start
+
+    BatchCards.write_summary(jobs, args.summary)
+    done = [job for job in jobs if not job.error]
+    logger.info(f"{len(done)} cards in {seconds:.1f}s, {len(done) / seconds:.2f} cards/s, "
+                f"{sum(job.unevaluated for job in done) / seconds:.1f} positions/s evaluated, {len(jobs) - len(done)} failed. "
+                f"Summary written to {args.summary}.")
+
+def parse_arguments():
+    """
+    Parse the command-line arguments
+    """
+
+    parser = argparse.ArgumentParser(prog='batchcards',
+                                     description='Generate the cards of many games ahead of the requests for them, or again after a renderer change.')
+
+    parser.add_argument('game_ids',
+                        help='file of game ids, one per line, - reads them from stdin')
+
+    parser.add_argument('-b',
+                        '--database',
+                        help='set database file - Default: chesscom_db.db',
+                        action='store',
+                        default='chesscom_db.db')
+
+    parser.add_argument('-d',
+                        '--default_depth',
+                        help='set evaluation depth in moves - Default: 15 - Range: [1, 20]',
+                        action='store',
+                        default=15)
+
+    parser.add_argument('-r',
+                        '--renderer',
+                        help='set card renderer - Default: plotnine - Options: plotnine, matplotlib',
+                        action='store',
+                        choices=['plotnine', 'matplotlib'],
+                        default='plotnine')
+
+    # Each worker holds a warm plotter, 0 draws cards in the main process
+    parser.add_argument('-w',
+                        '--render_workers',
+                        help='set number of render worker processes - Default: 0 - Range: [0, cpu count]',
+                        action='store',
+                        default=0)
+
+    # Each worker keeps one engine running for the whole batch
+    parser.add_argument('-E',
+                        '--engine_workers',
+                        help='set number of engine worker processes, 0 for one per cpu - Default: 0 - Range: [0, cpu count]',
+                        action='store',
+                        default=0)
+
+    parser.add_argument('-e',
+                        '--eval_workers',
+                        help='set number of games evaluated concurrently - Default: 2 - Range: [1, inf)',
+                        action='store',
+                        default=2)
+
+    parser.add_argument('-n',
+                        '--fetch_workers',
+                        help='set number of concurrent chess.com downloads - Default: 2 - Range: [1, 10]',
+                        action='store',
+                        default=2)
+
+    parser.add_argument('-f',
+                        '--image_format',
+                        help='set card image format - Default: png - Options: png, jpeg, webp',
+                        action='store',
+                        choices=['png', 'jpeg', 'webp'],
+                        default='png')
+
+    parser.add_argument('-q',
+                        '--image_quality',
+                        help='set starting JPEG/WebP quality - Default: 90 - Range: [30, 100]',
+                        action='store',
+                        default=90)
+
+    parser.add_argument('-k',
+                        '--image_max_kb',
+                        help='set target card size in KB - Default: none - Range: [1, 5120]',
+                        action='store',
+                        default=None)
+
+    parser.add_argument('-c',
+                        '--card_cache_mb',
+                        help='set maximum size of the rendered card directory in MB - Default: 500 - Range: [1, inf)',
+                        action='store',
+                        default=500)
+
+    parser.add_argument('-o',
+                        '--card_directory',
+                        help='set directory of the rendered card cache - Default: ./../cards/',
+                        action='store',
+                        default='./../cards/')
+
+    parser.add_argument('-O',
+                        '--output_directory',
+                        help='set directory the cards are also copied to, named by game id - Default: none',
+                        action='store',
+                        default=None)
+
+    # Cards are cached by renderer version, forcing is only needed when a change did not bump it
+    parser.add_argument('-F',
+                        '--force',
+                        help='draw every card again even if it is in the card cache',
+                        action='store_true')
+
+    parser.add_argument('-j',
+                        '--summary',
+                        help='set CSV file of the per game timings - Default: batch_summary.csv',
+                        action='store',
+                        default='batch_summary.csv')
+
+    parser.add_argument('-s',
+                        '--chesscom_url',
+                        help='set base url of a local chess.com - Default: none, the real chess.com',
+                        action='store',
+                        default=None)
+
+    parser.add_argument('--engine',
+                        help='set engine executable - Default: STOCKFISH_PATH or /opt/homebrew/bin/stockfish',
+                        action='store',
+                        default=None)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
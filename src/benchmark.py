@@ -0,0 +1,634 @@
+import argparse
+from argparse import Namespace
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import patchworklib as pw
+from PIL import Image
+
+from carddata import CardData, card_plies_query, summary_query
+from cardimage import CardEncoding
+from cardplotter import CardPlotter
+import DBConn as dbconn
+from DBConn import DBConn
+from fake_chesscom import FakeChessComServer
+from fake_twitter import FakeTwitterServer
+import loadgen
+from mplcardplotter import MplCardPlotter
+import pgnproc
+from renderpool import RenderPool
+
+renderers = {'plotnine': CardPlotter, 'matplotlib': MplCardPlotter}
+
+fixture_directory = str(Path(__file__).parent.parent) + "/fixtures/pgns/"
+stub_engine = str(Path(__file__).parent) + "/stub_engine.py"
+
+# CardPlotter sections and the figure size each is drawn at in a card
+card_sections = {'gen_title': (6, 1.25), 'gen_stats': (6, 1.25), 'gen_eval_plot': (8, 2),
+                 'gen_time_plot': (8, 2), 'gen_loss_plot': (8, 2), 'gen_loss_hist': (8, 2)}
+
+
+def summarize(times: List[float]) -> Dict[str, float]:
+    """
+    Summarize wall times in milliseconds
+    """
+
+    return {'mean_ms': statistics.mean(times),
+            'median_ms': statistics.median(times),
+            'min_ms': min(times),
+            'max_ms': max(times)}
+
+
+def time_call(func: Callable, repeat: int) -> Dict[str, float]:
+    """
+    Call func repeat times and summarize the wall time of each call in milliseconds
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return summarize(times)
+
+
+def rate(summary: Dict[str, float], count: int) -> float:
+    """
+    Items per second at the median time of a summary
+    """
+
+    return count / summary['median_ms'] * 1000 if summary['median_ms'] else 0.0
+
+
+def bench_card_preprocessing(db: DBConn, game_ids: List[int], repeat: int = 20) -> Dict[int, Dict[str, Dict[str, float]]]:
+    """
+    Time the per card preprocessing, the full load (fetch and derive) and the derivation of all plot data alone
+    """
+
+    results = {}
+    for game_id in game_ids:
+        rows = db.execute_query(card_plies_query, (game_id,)).fetchall()
+        summary = db.execute_query(summary_query, (game_id,)).fetchall()[0]
+
+        results[game_id] = {'plies': len(rows),
+                            'load': time_call(lambda: CardData.load(db, game_id), repeat),
+                            'derive': time_call(lambda: CardData(game_id, pd.DataFrame(rows, columns=CardData.ply_columns), summary), repeat)}
+
+    return results
+
+
+def bench_render(db: DBConn, game_ids: List[int], repeat: int = 5) -> Dict[int, Dict[str, Dict[str, float]]]:
+    """
+    Time drawing and saving a card with each renderer, the data is loaded once beforehand
+    """
+
+    plotters = {name: renderer(db=db) for name, renderer in renderers.items()}
+    directory = tempfile.mkdtemp()
+
+    results = {}
+    for game_id in game_ids:
+        data = CardData.load(db, game_id)
+        results[game_id] = {'plies': len(data.move_num)}
+        for name, plotter in plotters.items():
+            results[game_id][name] = time_call(lambda: plotter.render(data, f"{directory}/{name}_{game_id}"), repeat)
+
+    return results
+
+
+def bench_render_pool(db: DBConn, game_ids: List[int], renderer: str = 'matplotlib', processes: Optional[int] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Time drawing all of the cards one after another in this process against drawing them in a warm render pool
+    """
+
+    cards = [CardData.load(db, game_id) for game_id in game_ids]
+    directory = tempfile.mkdtemp()
+
+    start = time.perf_counter()
+    plotter = renderers[renderer](db=db)
+    for data in cards:
+        plotter.render(data, f"{directory}/serial_{data.game_id}")
+    serial = time.perf_counter() - start
+
+    # Startup is reported separately, it is paid once per process rather than per card
+    start = time.perf_counter()
+    pool = RenderPool(renderer=renderer, processes=processes)
+    pool.wait_ready()
+    startup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pool.render_many([(data, f"{directory}/pool_{data.game_id}") for data in cards])
+    pooled = time.perf_counter() - start
+    pool.close()
+
+    return {'cards': len(cards),
+            'serial': {'total_s': serial, 'cards_per_s': len(cards) / serial},
+            'pool': {'startup_s': startup, 'total_s': pooled, 'cards_per_s': len(cards) / pooled}}
+
+
+def bench_encoding(db: DBConn, game_ids: List[int], repeat: int = 5, max_bytes: Optional[int] = None) -> Dict[int, Dict[str, Dict[str, float]]]:
+    """
+    Time encoding a rendered card in each format and report the encoded size
+    """
+
+    plotter = MplCardPlotter(db=db)
+
+    results = {}
+    for game_id in game_ids:
+        png = plotter.render(CardData.load(db, game_id)).data
+        results[game_id] = {'png_kb': round(len(png) / 1024, 1)}
+        for image_format in CardEncoding.extensions:
+            encoding = CardEncoding(image_format=image_format, max_bytes=max_bytes)
+            summary = time_call(lambda: encoding.encode(png), repeat)
+            summary['size_kb'] = len(encoding.encode(png)) / 1024
+            results[game_id][image_format] = summary
+
+    return results
+
+
+def fixture_months(directory: str = fixture_directory) -> List[Tuple[str, str]]:
+    """
+    (username, yyyy-mm) of every month archive in a directory laid out like pgns/
+    """
+
+    return sorted((username, file[:-4]) for username in os.listdir(directory) if os.path.isdir(directory + username)
+                  for file in os.listdir(directory + username) if file[-4:] == ".txt")
+
+
+def bench_parse(directory: str, months: List[Tuple[str, str]], repeat: int = 5) -> Dict[str, Dict]:
+    """
+    Time pgn_to_db_lists on each month archive, the file is read once beforehand
+    """
+
+    results = {}
+    for username, month in months:
+        with open(f"{directory}{username}/{month}.txt") as fh:
+            pgn = fh.read()
+        games, _, moves = pgnproc.pgn_to_db_lists(pgn)
+
+        summary = time_call(lambda: pgnproc.pgn_to_db_lists(pgn), repeat)
+        summary.update(games_per_s=rate(summary, len(games)), plies_per_s=rate(summary, len(moves)))
+        results[f"{username}/{month}"] = {'games': len(games), 'plies': len(moves), 'pgn_to_db_lists': summary}
+
+    return results
+
+
+def bench_ingest(directory: str, months: List[Tuple[str, str]], repeat: int = 3, depth: int = 10) -> Tuple[Dict[str, Dict], DBConn]:
+    """
+    Time add_pgn of each month archive in order into a new database, once per repetition.
+    Games already added from another player's archive are inserted again like in the bot.
+    Returns the results and the database of the last repetition.
+    """
+
+    pgnproc.global_pgn_directory = directory
+    work_directory = tempfile.mkdtemp()
+    plies = {(username, month): len(pgnproc.single_pgn_to_lists_by_username(username, month)[2]) for username, month in months}
+
+    times = {key: [] for key in months}
+    for i in range(repeat):
+        db = DBConn(f"{work_directory}/ingest_{i}.db", sf_depth=depth)
+        for key in months:
+            start = time.perf_counter()
+            db.add_pgn(*key)
+            times[key].append((time.perf_counter() - start) * 1000)
+
+    results = {}
+    for (username, month), month_times in times.items():
+        summary = summarize(month_times)
+        summary['plies_per_s'] = rate(summary, plies[(username, month)])
+        results[f"{username}/{month}"] = {'plies': plies[(username, month)], 'add_pgn': summary}
+
+    return results, db
+
+
+def bench_evaluate(db: DBConn, game_ids: List[int], repeat: int = 3, parallel: bool = False) -> Dict:
+    """
+    Time evaluate_game_by_id for each game in order, every evaluation is cleared before each repetition.
+    Positions shared with an earlier game are only evaluated once, as in the bot.
+    """
+
+    positions = {game_id: [] for game_id in game_ids}
+    times = {game_id: [] for game_id in game_ids}
+    for _ in range(repeat):
+        db.execute_command("UPDATE Position SET eval_depth = NULL", None)
+        for game_id in game_ids:
+            positions[game_id].append(db.game_eval_coverage(game_id)[1])
+            start = time.perf_counter()
+            db.evaluate_game_by_id(game_id, parallel=parallel)
+            times[game_id].append((time.perf_counter() - start) * 1000)
+
+    results = {}
+    for game_id in game_ids:
+        summary = summarize(times[game_id])
+        summary['positions_per_s'] = rate(summary, positions[game_id][0])
+        results[game_id] = {'positions': positions[game_id][0], 'evaluate_game_by_id': summary}
+
+    total_positions = sum(counts[0] for counts in positions.values())
+    total_s = sum(statistics.median(game_times) for game_times in times.values()) / 1000
+    results['all'] = {'positions': total_positions, 'total': {'total_s': total_s, 'positions_per_s': total_positions / total_s if total_s else 0.0}}
+
+    return results
+
+
+def bench_sections(db: DBConn, game_ids: List[int], repeat: int = 3) -> Dict[int, Dict]:
+    """
+    Time each CardPlotter section, built and drawn at its size in the card, the data is loaded once beforehand
+    """
+
+    plotter = CardPlotter(db=db)
+
+    results = {}
+    for game_id in game_ids:
+        data = CardData.load(db, game_id)
+        plotter.game_id = game_id
+        plotter.x_limit = data.x_limit
+        results[game_id] = {'plies': len(data.move_num)}
+        for section, figsize in card_sections.items():
+            results[game_id][section] = time_call(lambda: pw.load_ggplot(getattr(plotter, section)(data), figsize=figsize), repeat)
+
+    return results
+
+
+def bench_gen_card(db: DBConn, game_ids: List[int], repeat: int = 3) -> Dict[int, Dict]:
+    """
+    Time gen_card with each renderer, loading the data, drawing, encoding and saving the card
+    """
+
+    plotters = {name: renderer(db=db) for name, renderer in renderers.items()}
+    directory = tempfile.mkdtemp() + "/"
+
+    results = {}
+    for game_id in game_ids:
+        results[game_id] = {'plies': db.game_eval_coverage(game_id)[0]}
+        for name, plotter in plotters.items():
+            results[game_id][name] = time_call(lambda: plotter.gen_card(game_id, filepath=directory, filename=f"{name}_{game_id}"), repeat)
+
+    return results
+
+
+def bench_startup(repeat: int = 5, engine: str = stub_engine) -> Dict[str, Dict]:
+    """
+    Time starting main.py in a new process: importing it, and from launch to its first search against local stand-ins.
+    The first start creates the database and journal, the following ones are restarts with them in place.
+    """
+
+    imports = time_call(lambda: subprocess.run([sys.executable, '-c', 'import main'], cwd=loadgen.src_directory, check=True), repeat)
+
+    twitter = FakeTwitterServer().start()
+    chesscom = FakeChessComServer().start()
+    work_directory = tempfile.mkdtemp()
+    settings = Namespace(engine=engine, engine_delay_ms=0, bot_args=[])
+
+    times = []
+    for _ in range(repeat + 1):
+        searches = twitter.searches
+        start = time.perf_counter()
+        bot = loadgen.start_bot(twitter, chesscom, work_directory, settings)
+        while twitter.searches == searches and bot.poll() is None:
+            time.sleep(0.001)
+        times.append((time.perf_counter() - start) * 1000)
+        loadgen.stop_bot(bot)
+
+    twitter.stop()
+    chesscom.stop()
+
+    return {'main': {'import': imports, 'first_start': summarize(times[:1]), 'restart': summarize(times[1:])}}
+
+
+# Ingests a user history in a new process, so its peak resident memory is that of the ingest alone, and prints the result as JSON.
+# The peak is read from VmHWM, ru_maxrss on Linux keeps the peak of the forked benchmark process across exec.
+ingest_memory_script = """
+import json, resource, sys, time
+import pgnproc
+from DBConn import DBConn
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as fh:
+            return next(int(line.split()[1]) for line in fh if line.startswith('VmHWM:')) / 1024
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+mode, directory, username, database, batch_size = sys.argv[1:]
+pgnproc.global_pgn_directory = directory
+db = DBConn(database, ingest_batch_size=int(batch_size))
+baseline = peak_rss_mb()
+start = time.perf_counter()
+if mode == 'stream':
+    db.add_user_to_db(username)
+else:
+    db.add_games([pgnproc.construct_lists_by_username(username)])
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'baseline_rss_mb': baseline, 'peak_rss_mb': peak_rss_mb()}))
+"""
+
+
+def synthetic_history(directory: str, copies: int, source: str = fixture_directory, username: str = 'history') -> Tuple[int, float]:
+    """
+    Write a long user history to directory/username/ from copies of every archive in source, one month per copy of an archive.
+    Game ids are renumbered per copy so every game is distinct.
+    Returns the number of games and the size of the history in MB.
+    """
+
+    archives = []
+    for source_user, month in fixture_months(source):
+        with open(f"{source}{source_user}/{month}.txt") as fh:
+            archives.append(fh.read())
+
+    os.makedirs(directory + username, exist_ok=True)
+    games, size = 0, 0
+    for copy in range(copies):
+        for i, pgn in enumerate(archives):
+            month = copy * len(archives) + i
+            pgn = re.sub(r'(\[Link "[^"]*/)(\d+)"', lambda match: f'{match.group(1)}{int(match.group(2)) + (month + 1) * 10**6}"', pgn)
+            with open(f"{directory}{username}/{2000 + month // 12}-{month % 12 + 1:02d}.txt", 'w') as fh:
+                fh.write(pgn)
+            games += pgn.count('[Link ')
+            size += len(pgn)
+
+    return games, size / 2**20
+
+
+def bench_ingest_memory(copies: int = 20, batch_size: int = 200, source: str = fixture_directory) -> Dict[str, Dict]:
+    """
+    Peak resident memory and time of add_user_to_db on a long synthetic history, streamed in batches,
+    against parsing the whole history into lists before writing it as was done before.
+    """
+
+    work_directory = tempfile.mkdtemp() + "/"
+    games, size = synthetic_history(work_directory + "pgns/", copies, source)
+
+    results = {}
+    for mode in ('stream', 'lists'):
+        output = subprocess.run([sys.executable, '-c', ingest_memory_script, mode, work_directory + "pgns/", 'history', f"{work_directory}{mode}.db", str(batch_size)],
+                                cwd=loadgen.src_directory, check=True, capture_output=True, text=True).stdout
+        results[mode] = {'games': games, 'pgn_mb': round(size, 1), 'ingest': json.loads(output.strip().splitlines()[-1])}
+
+    return results
+
+
+def representative_games(db: DBConn, game_ids: List[int]) -> List[int]:
+    """
+    The shortest, median and longest of the games by plies
+    """
+
+    by_length = sorted(game_ids, key=lambda game_id: db.game_eval_coverage(game_id)[0])
+    return sorted(set([by_length[0], by_length[len(by_length) // 2], by_length[-1]]), key=by_length.index)
+
+
+def run_suite(directory: str, engine: str, depth: int, repeat: int, game_ids: Optional[List[int]] = None, parallel: bool = False) -> Dict:
+    """
+    Run every stage of the card pipeline on the month archives in directory with a new database:
+    parsing, ingest, evaluation with the given engine, each card section and full cards.
+    The sections and cards are timed on game_ids, by default the shortest, median and longest game.
+    """
+
+    dbconn.stockfish_path = engine
+    months = fixture_months(directory)
+
+    results = {'parse': bench_parse(directory, months, repeat)}
+    print_results(results['parse'])
+
+    results['ingest'], db = bench_ingest(directory, months, repeat, depth)
+    print_results(results['ingest'])
+
+    all_games = [row[0] for row in db.execute_query("SELECT game_id FROM Game ORDER BY game_id").fetchall()]
+    results['evaluate'] = bench_evaluate(db, all_games, repeat, parallel)
+    print_results(results['evaluate'])
+
+    game_ids = game_ids or representative_games(db, all_games)
+    results['sections'] = bench_sections(db, game_ids, repeat)
+    print_results(results['sections'])
+    results['gen_card'] = bench_gen_card(db, game_ids, repeat)
+    print_results(results['gen_card'])
+
+    return {'meta': run_metadata(engine=engine, depth=depth, repeat=repeat, fixtures=directory, parallel=parallel),
+            'results': results}
+
+
+def run_metadata(**settings) -> Dict:
+    """
+    Where and when a run was made, so results from different runs can be told apart
+    """
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {'time': datetime.now().isoformat(timespec='seconds'),
+            'commit': commit or None,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            **settings}
+
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    """
+    Flatten nested results to 'section/group/stage/measure' keys
+    """
+
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}/"))
+        else:
+            flat[f"{prefix}{key}"] = value
+
+    return flat
+
+
+def compare_results(baseline: Dict, current: Dict, threshold: float = 0.1) -> bool:
+    """
+    Print the change of every median time against a baseline run, False if any is slower by more than threshold
+    """
+
+    old = flatten(baseline['results'])
+    new = flatten(current['results'])
+
+    passed = True
+    for key in sorted(k for k in new if k.endswith('median_ms') and k in old):
+        change = new[key] / old[key] - 1 if old[key] else 0.0
+        passed &= change <= threshold
+        print(f"{key:<60} {old[key]:>10.2f} -> {new[key]:>10.2f} ms {change:>+7.1%} {'SLOWER' if change > threshold else ''}")
+
+    return passed
+
+
+def pixel_difference(path_a: str, path_b: str) -> float:
+    """
+    Mean absolute difference of two images in [0, 1], the second image is resized to the first
+    """
+
+    image_a = Image.open(path_a).convert('RGB')
+    image_b = Image.open(path_b).convert('RGB').resize(image_a.size)
+
+    return float(np.abs(np.asarray(image_a, dtype=np.int16) - np.asarray(image_b, dtype=np.int16)).mean() / 255)
+
+
+def compare_renderers(db: DBConn, game_ids: List[int], max_difference: float) -> bool:
+    """
+    Render each game with both renderers and check the matplotlib card stays close to the plotnine card
+    """
+
+    directory = tempfile.mkdtemp()
+    passed = True
+    for game_id in game_ids:
+        data = CardData.load(db, game_id)
+        paths = {name: renderer(db=db).render(data, f"{directory}/{name}_{game_id}").path for name, renderer in renderers.items()}
+        difference = pixel_difference(paths['plotnine'], paths['matplotlib'])
+        passed &= difference <= max_difference
+        print(f"{game_id:>14} pixel_difference={difference:.4f} {'ok' if difference <= max_difference else 'FAIL'}")
+
+    return passed
+
+
+def print_results(results: Dict):
+    """
+    Print the results of a benchmark, one line per game and stage
+    """
+
+    for game_id, stages in results.items():
+        # Plain values such as the ply count are printed on every line of their group
+        extra = " ".join(f"{k}={v}" for k, v in stages.items() if not isinstance(v, dict))
+        for stage, summary in stages.items():
+            if isinstance(summary, dict):
+                print(f"{game_id:>14} {stage:>10} {extra} " + " ".join(f"{k}={v:.3f}" for k, v in summary.items()))
+
+
+def parse_arguments():
+    """
+    Parse the command-line arguments
+    """
+
+    parser = argparse.ArgumentParser(prog='TwitterChessBot Benchmarks',
+                                     description='Micro-benchmarks of the card generation hot paths.')
+
+    parser.add_argument('benchmark',
+                        help='benchmark to run',
+                        choices=['preprocessing', 'render', 'compare', 'pool', 'encoding', 'suite', 'startup', 'ingest_memory'])
+
+    parser.add_argument('-g',
+                        '--game_ids',
+                        help='game ids to benchmark, they must already be in the database, optional for suite',
+                        nargs='+',
+                        type=int,
+                        default=None)
+
+    parser.add_argument('-r',
+                        '--repeat',
+                        help='number of repetitions per game - Default: 20, 3 for suite',
+                        type=int,
+                        default=None)
+
+    parser.add_argument('--max_diff',
+                        help='largest mean pixel difference between renderers accepted by compare - Default: 0.06',
+                        type=float,
+                        default=0.06)
+
+    parser.add_argument('-w',
+                        '--workers',
+                        help='number of render workers for the pool benchmark - Default: cpu count',
+                        type=int,
+                        default=None)
+
+    parser.add_argument('-k',
+                        '--max_kb',
+                        help='target card size in KB for the encoding benchmark - Default: none',
+                        type=int,
+                        default=None)
+
+    parser.add_argument('--db',
+                        help='database to benchmark against - Default: chesscom_db.db',
+                        default='chesscom_db.db')
+
+    parser.add_argument('--fixtures',
+                        help='month archives the suite runs on, laid out like pgns/ - Default: ../fixtures/pgns/',
+                        default=fixture_directory)
+
+    parser.add_argument('--engine',
+                        help='engine the suite evaluates with - Default: stub_engine.py',
+                        default=stub_engine)
+
+    parser.add_argument('--depth',
+                        help='evaluation depth of the suite - Default: 10',
+                        type=int,
+                        default=10)
+
+    parser.add_argument('--parallel',
+                        help='evaluate with the multiprocessing pool in the suite',
+                        action='store_true')
+
+    parser.add_argument('--copies',
+                        help='copies of the fixture archives in the history of the ingest_memory benchmark - Default: 20',
+                        type=int,
+                        default=20)
+
+    parser.add_argument('--batch_size',
+                        help='games written per transaction in the ingest_memory benchmark - Default: 200',
+                        type=int,
+                        default=200)
+
+    parser.add_argument('-o',
+                        '--output',
+                        help='file the suite results are written to as JSON - Default: benchmark_results.json',
+                        default='benchmark_results.json')
+
+    parser.add_argument('--baseline',
+                        help='suite results of an earlier run to compare against, fails if a median time is over 10%% slower',
+                        default=None)
+
+    args = parser.parse_args()
+    if args.benchmark not in ('suite', 'startup', 'ingest_memory') and args.game_ids is None:
+        parser.error(f"the {args.benchmark} benchmark requires --game_ids")
+
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    if args.benchmark == 'suite':
+        results = run_suite(args.fixtures, args.engine, args.depth, args.repeat or 3, args.game_ids, args.parallel)
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+        print(f"Results written to {args.output}")
+        if args.baseline:
+            with open(args.baseline) as fh:
+                sys.exit(0 if compare_results(json.load(fh), results) else 1)
+        sys.exit(0)
+
+    if args.benchmark == 'startup':
+        print_results(bench_startup(repeat=args.repeat or 5, engine=args.engine))
+        sys.exit(0)
+
+    if args.benchmark == 'ingest_memory':
+        print_results(bench_ingest_memory(copies=args.copies, batch_size=args.batch_size, source=args.fixtures))
+        sys.exit(0)
+
+    args.repeat = args.repeat or 20
+    db = DBConn(args.db)
+
+    if args.benchmark == 'preprocessing':
+        print_results(bench_card_preprocessing(db, args.game_ids, repeat=args.repeat))
+    elif args.benchmark == 'render':
+        print_results(bench_render(db, args.game_ids, repeat=args.repeat))
+    elif args.benchmark == 'pool':
+        print_results({'all': bench_render_pool(db, args.game_ids, processes=args.workers)})
+    elif args.benchmark == 'encoding':
+        print_results(bench_encoding(db, args.game_ids, repeat=args.repeat, max_bytes=args.max_kb * 1024 if args.max_kb else None))
+    elif args.benchmark == 'compare':
+        sys.exit(0 if compare_renderers(db, args.game_ids, args.max_diff) else 1)
@@ -0,0 +1,106 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class CardCache:
+    """
+    Rendered cards on disk keyed by game, evaluation depth and renderer version.
+    The directory is bounded in size, the least recently used cards are removed first.
+    """
+
+    extensions = ('.png', '.jpg', '.jpeg', '.webp')
+
+    def __init__(self, directory: str = "./../cards/", max_bytes: int = 500 * 2**20):
+        self.directory = os.path.join(directory, '')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Render workers of the pipeline share the cache
+        self.lock = threading.Lock()
+
+        # Index of path -> size, ordered from least to most recently used
+        self.index = OrderedDict()
+        self.total_bytes = 0
+        self._load_index()
+
+    @staticmethod
+    def name(game_id: int, eval_depth: int, renderer_version: str) -> str:
+        """
+        File name of a card without the extension
+        """
+
+        return f"{game_id}_d{eval_depth}_{renderer_version}"
+
+    def get(self, game_id: int, eval_depth: int, renderer_version: str, extension: str = '.png') -> Optional[str]:
+        """
+        Return the path of the cached card or None if it has not been rendered with this key and image format
+        """
+
+        path = os.path.join(self.directory, self.name(game_id, eval_depth, renderer_version)) + extension
+        with self.lock:
+            if path in self.index and os.path.isfile(path):
+                self.hits += 1
+                self.index.move_to_end(path)
+                # Keep the file times in step so the order survives a restart
+                os.utime(path)
+                return path
+
+            self._forget(path)
+            self.misses += 1
+            return None
+
+    def add(self, path: str) -> None:
+        """
+        Add a newly rendered card and evict the least recently used cards if over the size limit
+        """
+
+        with self.lock:
+            self._forget(path)
+            size = os.path.getsize(path)
+            self.index[path] = size
+            self.total_bytes += size
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove cards until the directory is within the size limit, never removing the most recent card
+        """
+
+        while self.total_bytes > self.max_bytes and len(self.index) > 1:
+            path, size = self.index.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+                logger.debug(f"Evicted card {path}.")
+            except FileNotFoundError:
+                pass
+
+    def _forget(self, path: str) -> None:
+        size = self.index.pop(path, None)
+        if size is not None:
+            self.total_bytes -= size
+
+    def _load_index(self) -> None:
+        """
+        Build the index from the cards already on disk, oldest first
+        """
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self.extensions):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+
+        for _, path, size in sorted(entries):
+            self.index[path] = size
+            self.total_bytes += size
+
+        logger.info(f"Card cache holds {len(self.index)} cards, {self.total_bytes / 2**20:.1f} MiB.")
+        self.evict()
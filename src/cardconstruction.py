@@ -1,14 +1,20 @@
 
 import logging
-import pandas as pd
-import patchworklib as pw
 import requests
-from typing import Tuple
+import time
+from typing import TYPE_CHECKING, Optional, Tuple
 
-from cardplotter import CardPlotter
+from cardcache import CardCache
+from cardimage import CardImage
 from DBConn import DBConn
+from enginepool import EnginePool
+from metrics import metrics
 import pgnproc
-import TwitterAPI as ta
+from renderpool import RenderPool
+
+# The plotting libraries are only imported once a card is drawn
+if TYPE_CHECKING:
+    from cardplotter import CardPlotter
 
 logger = logging.getLogger('__main__.' + __name__)
 
@@ -17,16 +23,22 @@ class CardConstruction:
     Request, store, process, store, and plot data from chess.com, specified by game_id
     """
     
-    def __init__(self, db: DBConn, plotter: CardPlotter) -> None:
+    def __init__(self, db: DBConn, plotter: 'CardPlotter', cache: Optional[CardCache] = None, render_pool: Optional[RenderPool] = None,
+                 chesscom_url: str = "https://www.chess.com", engine_pool: Optional[EnginePool] = None) -> None:
         
         # It only makes sense for the CardPlotter to use the same database as CardConstruction
         self.db = db
         self.plotter = plotter
+        self.cache = cache
+        # Cards are drawn in the pool's workers when given, the plotter then only supplies the renderer version
+        self.render_pool = render_pool
+        # Positions are evaluated by the pool's running engines when given, rather than an engine started per position
+        self.engine_pool = engine_pool
 
         self.game_id = None
-        self.details_url_base = "https://www.chess.com/callback/live/game/"
+        self.details_url_base = chesscom_url.rstrip('/') + "/callback/live/game/"
 
-    def __call__(self, game_id: int):
+    def __call__(self, game_id: int) -> CardImage:
         """
         Take the game_id, orchestrate the whole retrieval and output
         """
@@ -34,36 +46,137 @@ class CardConstruction:
         self.game_id = game_id
         logger.info(f"Generating for game: {self.game_id}")
 
+        # Download the month archieve for the player if the game is not in the database yet
+        archieve = self.fetch(game_id)
+        if archieve is not None:
+            # Add the games from the pgn to the database
+            self.ingest(*archieve)
+
+        # Evaluate game
+        self.evaluate(game_id)
+
+        # Generate card
+        return self.render(game_id)
+
+    def coverage(self, game_id: int) -> Optional[Tuple[int, int]]:
+        """
+        Return the ply count and the number of plies left to evaluate, None if the game is not in the database
+        """
+
+        with self.db.lock:
+            plies, unevaluated = self.db.game_eval_coverage(game_id)
+
+        return (plies, unevaluated) if plies else None
+
+    def fetch(self, game_id: int) -> Optional[Tuple[str, str]]:
+        """
+        Download the month archieve holding the game, return the username and month or None if the game is already present
+        """
+
+        archieve = self.locate(game_id)
+        if archieve is not None:
+            self.download(*archieve)
+
+        return archieve
+
+    def locate(self, game_id: int) -> Optional[Tuple[str, str]]:
+        """
+        Return the username and month of the archieve holding the game or None if the game is already present
+        """
+
         # Check if game_id is in the database
-        if not self.db.does_game_exist_by_id(self.game_id):
-            logger.info("Game not in database")
+        with self.db.lock:
+            present = self.db.does_game_exist_by_id(game_id)
+        if present:
+            logger.info("Game present")
+            return None
+
+        logger.info("Game not in database")
+
+        # Get the game details for requesting data
+        with metrics.span('details'):
+            return self._get_game_details(game_id)
 
-            # Get the game details for requesting data
-            username, month = self._get_game_details()
+    def download(self, username: str, month: str) -> None:
+        """
+        Download the month archieve for the player
+        """
 
-            # Download the month archieve for the player
+        with metrics.span('download'):
             self._download_month_archieve(username, month)
 
-            # Add the games from the pgn to the database
+    def ingest(self, username: str, month: str) -> None:
+        """
+        Add a downloaded month archieve to the database
+        """
+
+        with self.db.lock, metrics.span('ingest'):
             self._add_archieve_to_db(username, month)
+
+    def evaluate(self, game_id: int) -> None:
+        """
+        Evaluate game positions using DBConn, the database is only held while reading and writing
+        """
+
+        with self.db.lock:
+            positions = self.db.unevaluated_positions(game_id)
+        if not positions:
+            # The positions may have been evaluated for other games, the players still need the statistics of this one
+            with self.db.lock:
+                self.db.update_player_stats([game_id])
+            return
+
+        start = time.perf_counter()
+        if self.engine_pool is None:
+            evaluations = self.db.eval_positions_parallel(positions)
         else:
-            logger.info("Game present")
-        
-        # Evaluate game
-        self._evaluate_game()
+            evaluations, telemetry = self.engine_pool.evaluate(positions, self.db.sf_depth)
+            self.db.record_telemetry(telemetry)
+        seconds = time.perf_counter() - start
+        logger.debug("Done evaluating positions.")
 
-        # Generate card
-        return self._generate_card()
+        metrics.observe('evaluate', seconds)
+        metrics.inc('positions_evaluated_total', len(positions))
+        metrics.set('engine_positions_per_second', len(positions) / seconds)
 
+        with self.db.lock:
+            self.db.write_evaluations(evaluations)
+            self.db.update_player_stats([game_id])
 
-    def _get_game_details(self) -> Tuple[str, str]:
+    def render(self, game_id: int, force: bool = False) -> CardImage:
+        """
+        Generate the card in memory, reusing the cached card if nothing has changed unless forced to draw it again
+        """
+
+        if self.cache is None:
+            return self._draw_card(game_id)
+
+        with self.db.lock:
+            eval_depth = self.db.game_eval_depth(game_id)
+        if not force:
+            extension = self.plotter.encoding.extension
+            cached = self.cache.get(game_id, eval_depth, self.plotter.version, extension)
+            if cached is not None:
+                logger.info("Card cache hit")
+                metrics.inc('cache_hits_total')
+                return CardImage.from_file(cached)
+        metrics.inc('cache_misses_total')
+
+        # Persisted only for the cache, the upload uses the card in memory
+        card = self._draw_card(game_id)
+        with metrics.span('save'):
+            self.cache.add(card.save(self.cache.directory + CardCache.name(game_id, eval_depth, self.plotter.version)))
+
+        return card
+
+    def _get_game_details(self, game_id: int) -> Tuple[str, str]:
         """
         Send request to chess.com for game details
         - Return username and date to be retrieved
         """
 
         try:
-            json_resp = requests.get(self.details_url_base + str(self.game_id)).json()
+            json_resp = requests.get(self.details_url_base + str(game_id)).json()
         except Exception as e:
             logger.error(f"Error requesting game data from Chess.com: {e}")
             quit()
@@ -96,23 +209,28 @@ class CardConstruction:
 
         self.db.add_pgn(username, month)
 
-    def _evaluate_game(self):
+    def _draw_card(self, game_id: int) -> CardImage:
         """
-        Evaluate game positions using DBConn
+        Draw the card in this process or hand the loaded data to a render worker
         """
 
-        self.db.evaluate_game_by_id(game_id=self.game_id, parallel=True)
+        from carddata import CardData
 
-    def _generate_card(self):
-        """
-        Call the plotter to generate the card and output
-        """
+        with self.db.lock, metrics.span('load'):
+            data = CardData.load(self.db, game_id)
 
-        return self.plotter.gen_card(game_id=self.game_id)
+        with metrics.span('draw'):
+            card = self.plotter.render(data) if self.render_pool is None else self.render_pool.render(data)
+        # Sections are timed by the plotter, which may be in a render worker
+        for section, seconds in card.timings.items():
+            metrics.observe(section, seconds)
 
+        return card
 
 if __name__ == '__main__':
     # A bunch of testing remnants
+    from cardplotter import CardPlotter
+    import TwitterAPI as ta
 
     # Model setup
     db = DBConn('testdb.db', logging=True)
@@ -130,8 +248,8 @@ if __name__ == '__main__':
     responses = []
     tweets = twitter_access.search_hashtag()
     for tweet in tweets:
-        filename = cc(tweet[1].split(' ')[0])
-        responses.append((tweet[0], filename))
+        card = cc(tweet[1].split(' ')[0])
+        responses.append((tweet[0], card))
     
     twitter_access.reply(responses)
         
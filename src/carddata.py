@@ -0,0 +1,220 @@
+import logging
+import numpy as np
+import pandas as pd
+
+from DBConn import DBConn
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class CardData:
+    """
+    All of the data required to draw a card, fetched once and derived with numpy.
+    The arrays are read-only and every section frame is built as a view onto them.
+    """
+
+    pawn_limit = 10
+    colours = ['Black', 'White']
+    rank_columns = ['Best Move', 'Second Best Move', 'Third Best Move', 'Other Moves']
+    ply_columns = ['move_num', 'colour', 'move_uci', 'clock', 'position', 'material', 'eval', 'eval_type', 'first_move', 'second_move', 'third_move']
+
+    def __init__(self, game_id: int, plies: pd.DataFrame, summary: tuple):
+        self.game_id = game_id
+        self.summary = summary
+
+        # Columns straight from the database, one row per ply in ply order
+        self.move_num = self._freeze(plies.move_num.to_numpy(dtype=np.int64))
+        self.colour = self._freeze(plies.colour.to_numpy(dtype=object))
+        self.move_uci = self._freeze(plies.move_uci.to_numpy(dtype=object))
+        self.position = self._freeze(plies.position.to_numpy(dtype=object))
+        self.clock = self._freeze(plies.clock.to_numpy(dtype=np.float64, na_value=np.nan))
+
+        # The position colour is the side to move, so a 'b' position follows a white move
+        white_moved = self.colour == 'b'
+        self.mover = self._freeze(np.where(white_moved, 'White', 'Black').astype(object))
+        self.ply_num = self._freeze(np.where(white_moved, self.move_num, self.move_num + 0.5))
+        self.x_limit = self.ply_num.max()
+
+        # Evaluations, mates are pinned to a large value with the sign of the mate
+        raw_eval = plies['eval'].to_numpy(dtype=np.float64, na_value=np.nan)
+        is_mate = plies.eval_type.to_numpy(dtype=object) == 'mate'
+        eval_1000 = np.where(is_mate, 1000 * np.sign(raw_eval), raw_eval)
+        eval_10000 = np.where(is_mate, 10000 * np.sign(raw_eval), raw_eval)
+
+        # Evaluation and material series in pawns
+        self.eval = self._freeze(self._clip(self._ffill(eval_1000 / 100)))
+        self.eval_shift = self._freeze(np.append(self.eval[1:], np.nan))
+        self.material = self._freeze(self._clip(plies.material.to_numpy(dtype=np.float64, na_value=np.nan)))
+
+        # Evaluation change caused by each ply, the loss plot uses a larger mate value than the statistics
+        self.eval_loss = self._freeze(self._clip(self._diff(eval_10000) / 100))
+        self.eval_diff = self._freeze(self._diff(eval_1000))
+
+        # Rank of each move played among the top three moves of the preceding position
+        self.move_rank = self._freeze(self._move_ranks(self.move_uci, plies[['first_move', 'second_move', 'third_move']].to_numpy(dtype=object)))
+
+        # Clock balance, pair white's clock after each white move with black's clock after the same move number
+        move_w, idx_w, idx_b = np.intersect1d(self.move_num[white_moved], self.move_num[~white_moved], return_indices=True)
+        self.clock_move_num = self._freeze(move_w)
+        self.white_clock = self._freeze(self.clock[white_moved][idx_w])
+        self.black_clock = self._freeze(self.clock[~white_moved][idx_b])
+        self.clock_diff = self._freeze(self.white_clock - self.black_clock)
+        self.time_control = self.white_clock[0] if len(self.white_clock) else np.nan
+
+        # Statistics
+        self.stats = self._stats()
+
+    @classmethod
+    def load(cls, db: DBConn, game_id: int) -> 'CardData':
+        """
+        Fetch the plies and summary of the game, two round trips in total
+        """
+
+        try:
+            plies = db.cached_query(game_id, card_plies_query, (game_id,))
+            summary = db.cached_query(game_id, summary_query, (game_id,))[0]
+        except Exception as e:
+            logger.error(f"Error requesting card data: {e}")
+            quit()
+
+        plies = pd.DataFrame(plies, columns=cls.ply_columns)
+
+        return cls(game_id, plies, summary)
+
+    def eval_frame(self) -> pd.DataFrame:
+        """
+        Evaluation and material by ply
+        """
+
+        return pd.DataFrame({'ply_num': self.ply_num,
+                             'eval': self.eval,
+                             'position': self.position,
+                             'zero': np.zeros(len(self.ply_num)),
+                             'material': self.material,
+                             'eval_shift': self.eval_shift}, copy=False)
+
+    def time_frame(self) -> pd.DataFrame:
+        """
+        Clocks and clock difference by move
+        """
+
+        return pd.DataFrame({'move_num': self.clock_move_num,
+                             'white_clock': self.white_clock,
+                             'black_clock': self.black_clock,
+                             'clock_diff': self.clock_diff,
+                             'zero': np.zeros(len(self.clock_move_num))}, copy=False)
+
+    def loss_frame(self) -> pd.DataFrame:
+        """
+        Evaluation loss by move, clipped to the plot limits
+        """
+
+        return pd.DataFrame({'move_num': self.move_num,
+                             'colour': self.mover,
+                             'eval_diff': self.eval_loss}, copy=False)
+
+    def hist_frame(self) -> pd.DataFrame:
+        """
+        Absolute evaluation loss by move, clipped to the plot limits
+        """
+
+        return pd.DataFrame({'move_num': self.move_num,
+                             'colour': self.mover,
+                             'eval_diff': self._clip(np.abs(self.eval_diff) / 100)}, copy=False)
+
+    def stats_frame(self) -> pd.DataFrame:
+        """
+        Per player statistics, one row per colour
+        """
+
+        return self.stats.copy()
+
+    def _stats(self) -> pd.DataFrame:
+        """
+        Move loss, move rank and move rank counts by colour
+        """
+
+        rows = []
+        for colour in self.colours:
+            mask = self.mover == colour
+            diffs = self.eval_diff[mask]
+            diffs = diffs[~np.isnan(diffs)]
+            ranks = self.move_rank[mask]
+            rows.append([colour,
+                         abs(diffs.mean()) / 100 if len(diffs) else np.nan,
+                         abs(diffs.sum()) / 100,
+                         ranks.mean() if len(ranks) else np.nan,
+                         *[int((ranks == rank).sum()) for rank in (1, 2, 3, 5)]])
+
+        return pd.DataFrame(rows, columns=['colour', 'Avg. Move Loss', 'Total Move Loss', 'Avg. Move Rank', *self.rank_columns])
+
+    @staticmethod
+    def _move_ranks(played: np.ndarray, top_moves: np.ndarray) -> np.ndarray:
+        """
+        1, 2 or 3 if the move played was that engine choice in the previous position, otherwise 5
+        """
+
+        previous = np.vstack([np.full((1, 3), None, dtype=object), top_moves[:-1]])
+        matches = previous == played[:, None]
+        return np.where(matches.any(axis=1), matches.argmax(axis=1) + 1, 5)
+
+    @staticmethod
+    def _diff(values: np.ndarray) -> np.ndarray:
+        """
+        Difference to the previous value, the first value has no previous value
+        """
+
+        return np.append(np.nan, np.diff(values))
+
+    @staticmethod
+    def _ffill(values: np.ndarray) -> np.ndarray:
+        """
+        Forward fill missing values
+        """
+
+        idx = np.where(np.isnan(values), 0, np.arange(len(values)))
+        np.maximum.accumulate(idx, out=idx)
+        return values[idx]
+
+    @classmethod
+    def _clip(cls, values: np.ndarray) -> np.ndarray:
+        return np.clip(values, -cls.pawn_limit, cls.pawn_limit)
+
+    @staticmethod
+    def _freeze(values: np.ndarray) -> np.ndarray:
+        values.setflags(write=False)
+        return values
+
+
+# All plies of a game in ply order, white moves lead to positions with black to move
+card_plies_query = """
+SELECT gm.move_num,
+       p.colour,
+       m.move_uci,
+       gm.clock,
+       p.fen,
+       p.material,
+       p.first_move_eval,
+       p.first_move_eval_type,
+       p.first_move,
+       p.second_move,
+       p.third_move
+FROM GameMove   gm
+JOIN Move       m   ON gm.move_id = m.move_id
+JOIN Position   p   ON m.position_id = p.position_id
+WHERE gm.game_id = ?
+ORDER BY gm.move_num, p.colour
+"""
+
+# Title query
+summary_query = """
+SELECT u1.username AS White,
+       u2.username AS Black,
+       g.result AS Result,
+       g.occurred_at as Date
+FROM Game g
+JOIN User u1
+ON g.white = u1.user_id
+JOIN User u2
+ON g.black = u2.user_id
+WHERE game_id = ?
+"""
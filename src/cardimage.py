@@ -0,0 +1,118 @@
+import hashlib
+import io
+import logging
+from typing import Optional
+
+from PIL import Image
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class CardEncoding:
+    """
+    How a rendered card is encoded for upload: format, quality and an optional byte size target
+    """
+
+    extensions = {'png': '.png', 'jpeg': '.jpg', 'webp': '.webp'}
+    min_quality = 30
+    quality_step = 10
+
+    def __init__(self, image_format: str = 'png', quality: int = 90, max_bytes: Optional[int] = None):
+        if image_format not in self.extensions:
+            raise ValueError(f"Unsupported card format {image_format}.")
+
+        self.format = image_format
+        self.quality = quality
+        self.max_bytes = max_bytes
+
+    @property
+    def extension(self) -> str:
+        return self.extensions[self.format]
+
+    def encode(self, png: bytes) -> bytes:
+        """
+        Re-encode a PNG rendering, lowering the quality until the size target is met or the minimum quality is reached
+        """
+
+        if self.format == 'png':
+            if self.max_bytes is None or len(png) <= self.max_bytes:
+                return png
+            # Cards use a handful of colours, a palette image is far smaller and visually identical
+            return self._save(Image.open(io.BytesIO(png)).convert('RGB').quantize(256), optimize=True)
+
+        image = Image.open(io.BytesIO(png)).convert('RGB')
+        quality = self.quality
+        data = self._save(image, quality=quality)
+        while self.max_bytes is not None and len(data) > self.max_bytes and quality - self.quality_step >= self.min_quality:
+            quality -= self.quality_step
+            data = self._save(image, quality=quality)
+
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            logger.warning(f"Card is {len(data)} bytes at minimum quality, above the target of {self.max_bytes}.")
+
+        return data
+
+    def _save(self, image: Image.Image, **kwargs) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.format.upper(), **kwargs)
+        return buffer.getvalue()
+
+
+class CardImage:
+    """
+    An encoded card held in memory, optionally also persisted to disk
+    """
+
+    def __init__(self, data: bytes, image_format: str = 'png', path: Optional[str] = None):
+        self.data = data
+        self.format = image_format
+        self.path = path
+        self._digest = None
+        # Seconds spent drawing and encoding each section, set by the plotter that rendered the card
+        self.timings = {}
+
+    @classmethod
+    def from_file(cls, path: str) -> 'CardImage':
+        """
+        Read a card that was persisted earlier
+        """
+
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        extension = path.rsplit('.', 1)[-1].lower()
+
+        return cls(data, 'jpeg' if extension in ('jpg', 'jpeg') else extension, path=path)
+
+    @property
+    def filename(self) -> str:
+        """
+        Name used for the upload, Twitter infers the media type from it
+        """
+
+        return f"card{CardEncoding.extensions[self.format]}"
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            self._digest = hashlib.sha1(self.data).hexdigest()
+        return self._digest
+
+    def buffer(self) -> io.BytesIO:
+        """
+        A fresh file-like view of the card
+        """
+
+        return io.BytesIO(self.data)
+
+    def save(self, filename: str) -> str:
+        """
+        Persist the card to filename, the extension is added
+        """
+
+        self.path = filename + CardEncoding.extensions[self.format]
+        with open(self.path, 'wb') as fh:
+            fh.write(self.data)
+
+        return self.path
+
+    def __len__(self) -> int:
+        return len(self.data)
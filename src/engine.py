@@ -0,0 +1,57 @@
+import socket
+import time
+from typing import List, Optional
+
+from stockfish import Stockfish
+
+# Telemetry rows carry the host so evaluations from several nodes can be compared after merging databases
+host = socket.gethostname()
+
+class TelemetryStockfish(Stockfish):
+    """
+    Stockfish that keeps the statistics of its last search, from the info line the search finished on, and its wall time.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # The first line read by Stockfish.__init__ is the engine greeting
+        self.version: Optional[str] = None
+        self.info_line = ""
+        self.wall_ms = 0.0
+        super().__init__(*args, **kwargs)
+
+    def _read_line(self) -> str:
+        line = super()._read_line()
+        if self.version is None:
+            # Such as Stockfish 15.1 by the Stockfish developers (see AUTHORS file)
+            self.version = line.split(' by ')[0]
+        elif line.startswith('info') and ' nodes ' in line:
+            self.info_line = line
+
+        return line
+
+    def get_top_moves(self, num_top_moves: int = 5) -> List[dict]:
+        self.info_line = ""
+        start = time.perf_counter()
+        top_moves = super().get_top_moves(num_top_moves)
+        self.wall_ms = (time.perf_counter() - start) * 1000
+
+        return top_moves
+
+    def last_search(self) -> dict:
+        """
+        Depth reached, selective depth, nodes, nodes per second, engine time in ms, hash fill in permille and wall time in ms of the last search,
+        None for anything the engine did not report
+        """
+
+        tokens = self.info_line.split()
+
+        def value(name: str) -> Optional[int]:
+            return int(tokens[tokens.index(name) + 1]) if name in tokens else None
+
+        return {'depth_reached': value('depth'),
+                'seldepth': value('seldepth'),
+                'nodes': value('nodes'),
+                'nps': value('nps'),
+                'time_ms': value('time'),
+                'hashfull': value('hashfull'),
+                'wall_ms': self.wall_ms}
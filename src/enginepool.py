@@ -0,0 +1,68 @@
+import logging
+from multiprocessing import get_context
+import os
+from typing import List, Optional, Tuple
+
+from DBConn import DBConn
+from engine import TelemetryStockfish
+
+logger = logging.getLogger('__main__.' + __name__)
+
+# The engine owned by a worker process, started once by _init_worker
+_engine: Optional[TelemetryStockfish] = None
+_workers = 1
+
+
+def _init_worker(path: str, workers: int) -> None:
+    """
+    Start the engine once per worker
+    """
+
+    global _engine, _workers
+
+    _engine = TelemetryStockfish(path=path)
+    _workers = workers
+
+
+def _evaluate(position_id: int, fen: str, depth: int) -> Tuple[tuple, tuple]:
+    """
+    Evaluate a position with the worker's engine, returns the evaluation and its telemetry
+    """
+
+    if _engine.depth != str(depth):
+        _engine.set_depth(depth)
+
+    return DBConn.evaluate_position(_engine, position_id, fen, depth), DBConn.search_telemetry(_engine, position_id, depth, _workers)
+
+
+class EnginePool:
+    """
+    Pool of worker processes that each keep one engine running, positions are spread over them.
+    Unlike DBConn.eval_positions_parallel no engine is started per position.
+    """
+
+    def __init__(self, path: str, processes: Optional[int] = None):
+        self.processes = processes or os.cpu_count() or 1
+
+        # Spawn rather than fork so workers do not inherit the database connection
+        context = get_context('spawn')
+        self.pool = context.Pool(self.processes, initializer=_init_worker, initargs=(path, self.processes))
+        logger.info(f"Started {self.processes} engine workers.")
+
+    def evaluate(self, positions: List[tuple], depth: int) -> Tuple[List[tuple], List[tuple]]:
+        """
+        Evaluate (position_id, fen) positions at depth, returns the evaluations for DBConn.write_evaluations and their telemetry
+        """
+
+        if not positions:
+            return [], []
+
+        # A few chunks per worker keeps them busy to the end without a round trip per position
+        chunksize = max(1, len(positions) // (self.processes * 4))
+        results = self.pool.starmap(_evaluate, [(position_id, fen, depth) for position_id, fen in positions], chunksize)
+
+        return [evaluation for evaluation, _ in results], [telemetry for _, telemetry in results]
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,113 @@
+import argparse
+import logging
+import sqlite3
+from typing import List, Optional
+
+logger = logging.getLogger('__main__.' + __name__)
+
+# Columns of EngineTelemetry the report can be grouped by
+groupings = ('host', 'engine_version', 'depth', 'workers', 'threads', 'hash_mb')
+
+def engine_report(conn: sqlite3.Connection, group_by: List[str], since: Optional[str] = None) -> List[dict]:
+    """
+    Throughput of the engine from EngineTelemetry, one row per combination of the group_by columns.
+    Positions per second assumes the workers of a configuration were busy at the same time.
+    """
+
+    columns = ', '.join(group_by)
+    rows = conn.execute(f"""SELECT {columns},
+                                   COUNT(*),
+                                   AVG(wall_ms),
+                                   AVG(nps),
+                                   AVG(nodes),
+                                   AVG(depth_reached),
+                                   MAX(hashfull),
+                                   MIN(evaluated_at),
+                                   MAX(evaluated_at)
+                            FROM EngineTelemetry
+                            WHERE evaluated_at >= ?
+                            GROUP BY {columns}
+                            ORDER BY {columns}""", (since or '',)).fetchall()
+
+    report = []
+    for row in rows:
+        group = dict(zip(group_by, row[:len(group_by)]))
+        positions, wall_ms, nps, nodes, depth_reached, hashfull, first, last = row[len(group_by):]
+        entry = {**group,
+                 'positions': positions,
+                 'wall_ms': wall_ms,
+                 'positions_per_s_per_worker': 1000 / wall_ms if wall_ms else None,
+                 'knps': nps / 1000 if nps is not None else None,
+                 'nodes': nodes,
+                 'depth_reached': depth_reached,
+                 'hashfull': hashfull,
+                 'from': first,
+                 'to': last}
+        if 'workers' in group and entry['positions_per_s_per_worker'] is not None:
+            entry['positions_per_s'] = entry['positions_per_s_per_worker'] * (group['workers'] or 1)
+        report.append(entry)
+
+    return report
+
+def format_report(report: List[dict]) -> str:
+    """
+    The report as an aligned table
+    """
+
+    if not report:
+        return "No engine telemetry recorded."
+
+    def cell(value) -> str:
+        if value is None:
+            return '-'
+        return f"{value:.1f}" if isinstance(value, float) else str(value)
+
+    headers = list(report[0].keys())
+    table = [headers] + [[cell(entry.get(header)) for header in headers] for entry in report]
+    widths = [max(len(line[i]) for line in table) for i in range(len(headers))]
+
+    return "\n".join("  ".join(value.rjust(width) for value, width in zip(line, widths)) for line in table)
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s - %(name)s')
+
+    try:
+        conn = sqlite3.connect(f"file:{args.database}?mode=ro", uri=True)
+        print(format_report(engine_report(conn, args.group_by, args.since)))
+    except sqlite3.Error as e:
+        logger.error(f"Error reading engine telemetry from {args.database}: {e}")
+        quit()
+
+def parse_arguments():
+    """
+    Parse the command-line arguments
+    """
+
+    parser = argparse.ArgumentParser(prog='enginereport',
+                                     description='Report engine throughput from the telemetry recorded with every evaluation.')
+
+    parser.add_argument('-b',
+                        '--database',
+                        help='set database file - Default: chesscom_db.db',
+                        action='store',
+                        default='chesscom_db.db')
+
+    parser.add_argument('-g',
+                        '--group_by',
+                        help='set columns the evaluations are grouped by - Default: host engine_version depth workers',
+                        action='store',
+                        nargs='+',
+                        choices=groupings,
+                        default=['host', 'engine_version', 'depth', 'workers'])
+
+    parser.add_argument('-s',
+                        '--since',
+                        help='set earliest evaluation included as an ISO date or time - Default: none, all of them',
+                        action='store',
+                        default=None)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,179 @@
+import argparse
+import logging
+import struct
+import sys
+import zlib
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+
+from DBConn import DBConn
+
+logger = logging.getLogger('__main__.' + __name__)
+
+# A dump is a header followed by zlib compressed blocks of records, each block preceded by its record count and
+# compressed size and the last one by a count of 0, so a dump is written and read a block at a time.
+# A record is the fen, the material balance and depth, then the move, evaluation type and evaluation of the top three moves.
+magic = b'CEVD'
+version = 1
+header = struct.Struct('<4sB')
+block_header = struct.Struct('<II')
+record_head = struct.Struct('<bB')
+move_eval = struct.Struct('<Bi')
+
+# Evaluation type codes, 0 is a missing move
+eval_types = {None: 0, 'cp': 1, 'mate': 2}
+eval_type_names = {code: name for name, code in eval_types.items()}
+
+def encode_record(record: tuple) -> bytes:
+    """
+    Pack a position in the order of DBConn.evaluation_columns
+    """
+
+    fen, material, depth = record[:3]
+    fen = fen.encode('ascii')
+    parts = [bytes((len(fen),)), fen, record_head.pack(material or 0, depth)]
+    for move, evaluation, eval_type in (record[3:6], record[6:9], record[9:12]):
+        move = (move or '').encode('ascii')
+        parts += [bytes((len(move),)), move, move_eval.pack(eval_types[eval_type], int(evaluation or 0))]
+
+    return b''.join(parts)
+
+def decode_records(data: bytes) -> Iterator[tuple]:
+    """
+    Unpack the positions of a decompressed block
+    """
+
+    offset = 0
+    while offset < len(data):
+        length = data[offset]
+        fen = data[offset + 1:offset + 1 + length].decode('ascii')
+        offset += 1 + length
+        material, depth = record_head.unpack_from(data, offset)
+        offset += record_head.size
+
+        record = [fen, material, depth]
+        for _ in range(3):
+            length = data[offset]
+            move = data[offset + 1:offset + 1 + length].decode('ascii') or None
+            offset += 1 + length
+            code, evaluation = move_eval.unpack_from(data, offset)
+            offset += move_eval.size
+            record += [move, evaluation if code else None, eval_type_names[code]]
+
+        yield tuple(record)
+
+def write_dump(fh: BinaryIO, batches: Iterable[List[tuple]], level: int = 6) -> int:
+    """
+    Write batches of positions as a dump, one block per batch, and return the number of positions written
+    """
+
+    fh.write(header.pack(magic, version))
+    written = 0
+    for batch in batches:
+        block = zlib.compress(b''.join(encode_record(record) for record in batch), level)
+        fh.write(block_header.pack(len(batch), len(block)))
+        fh.write(block)
+        written += len(batch)
+        logger.debug(f"Wrote block of {len(batch)} positions, {len(block)} bytes.")
+    fh.write(block_header.pack(0, 0))
+
+    return written
+
+def read_dump(fh: BinaryIO) -> Iterator[List[tuple]]:
+    """
+    Yield the positions of a dump a block at a time
+    """
+
+    file_magic, file_version = header.unpack(fh.read(header.size))
+    if file_magic != magic or file_version != version:
+        raise ValueError(f"Not an evaluation dump of version {version}.")
+
+    while 1:
+        count, size = block_header.unpack(fh.read(block_header.size))
+        if count == 0:
+            return
+        records = list(decode_records(zlib.decompress(fh.read(size))))
+        if len(records) != count:
+            raise ValueError(f"Corrupt block, expected {count} positions and found {len(records)}.")
+        yield records
+
+def export_evaluations(db: DBConn, fh: BinaryIO, min_depth: int = 1, batch_size: int = 10000) -> int:
+    """
+    Write every position evaluated to at least min_depth to a dump
+    """
+
+    return write_dump(fh, db.evaluated_positions(min_depth=min_depth, batch_size=batch_size))
+
+def import_evaluations(db: DBConn, fh: BinaryIO) -> Tuple[int, int]:
+    """
+    Merge a dump into the database, keeping the deeper evaluation of positions in both.
+    Returns the number of positions read and the number inserted or updated.
+    """
+
+    read, changed = 0, 0
+    for batch in read_dump(fh):
+        read += len(batch)
+        # Each block is committed on its own so an interrupted import keeps its progress
+        changed += db.merge_evaluations(batch)
+        logger.info(f"Merged {read} positions, {changed} inserted or updated.")
+
+    return read, changed
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s - %(name)s')
+
+    db = DBConn(args.database)
+
+    # - is standard output or input, so a dump can be piped straight into another node
+    if args.action == 'export':
+        fh = sys.stdout.buffer if args.file == '-' else open(args.file, 'wb')
+        with fh:
+            written = export_evaluations(db, fh, min_depth=int(args.min_depth), batch_size=int(args.batch_size))
+        logger.info(f"Exported {written} positions evaluated to depth {args.min_depth} or more.")
+    else:
+        fh = sys.stdin.buffer if args.file == '-' else open(args.file, 'rb')
+        with fh:
+            try:
+                read, changed = import_evaluations(db, fh)
+            except (ValueError, struct.error, zlib.error) as e:
+                logger.error(f"Error reading evaluation dump {args.file}: {e}")
+                quit()
+        logger.info(f"Imported {read} positions, {changed} were new or deeper than the evaluations already held.")
+
+def parse_arguments():
+    """
+    Parse the command-line arguments
+    """
+
+    parser = argparse.ArgumentParser(prog='evaldump',
+                                     description='Export the position evaluations of a database or merge them into another.')
+
+    parser.add_argument('action',
+                        help='export the evaluations to the file or import them from it',
+                        choices=['export', 'import'])
+
+    parser.add_argument('file',
+                        help='dump file, - for standard output or input')
+
+    parser.add_argument('-b',
+                        '--database',
+                        help='set database file - Default: chesscom_db.db',
+                        action='store',
+                        default='chesscom_db.db')
+
+    parser.add_argument('-m',
+                        '--min_depth',
+                        help='set shallowest evaluation exported - Default: 1 - Range: [1, 20]',
+                        action='store',
+                        default=1)
+
+    parser.add_argument('-s',
+                        '--batch_size',
+                        help='set positions per compressed block - Default: 10000 - Range: [1, inf)',
+                        action='store',
+                        default=10000)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
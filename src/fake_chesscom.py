@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+logger = logging.getLogger('__main__.' + __name__)
+
+fixture_directory = str(Path(__file__).parent.parent) + "/fixtures/pgns/"
+
+class FakeChessComServer(ThreadingHTTPServer):
+    """
+    Local stand-in for chess.com serving recorded month archives: the game details callback used to find a game
+    and the public API endpoints listing and downloading a player's monthly PGN archives.
+    Archives are read from pgn_directory laid out like pgns/, username/yyyy-mm.txt.
+    """
+
+    daemon_threads = True
+    header = re.compile(r'\[(.*?) \"(.*?)\"\]')
+
+    def __init__(self, pgn_directory: str = fixture_directory, port: int = 0):
+        super().__init__(('127.0.0.1', port), _FakeChessComHandler)
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+
+        # Game id -> headers, and (username, yyyy-mm) -> pgn of each game that user played in that month
+        self.games = {}
+        self.archives = defaultdict(list)
+        self._load(pgn_directory)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def game_ids(self):
+        return sorted(self.games)
+
+    def start(self) -> 'FakeChessComServer':
+        threading.Thread(target=self.serve_forever, name='fake-chesscom', daemon=True).start()
+        logger.info(f"Fake chess.com listening on {self.url} with {len(self.games)} games")
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def _load(self, pgn_directory: str) -> None:
+        """
+        Index every game of the recorded archives under both of its players
+        """
+
+        for username in sorted(os.listdir(pgn_directory)):
+            if not os.path.isdir(pgn_directory + username):
+                continue
+            for file in sorted(os.listdir(pgn_directory + username)):
+                if file[-4:] != ".txt":
+                    continue
+                with open(pgn_directory + username + "/" + file) as fh:
+                    games = fh.read().strip().split('\n\n\n')
+                for game in games:
+                    headers = dict(self.header.findall(game))
+                    game_id = int(headers['Link'].split('/')[-1])
+                    if game_id in self.games:
+                        continue
+                    self.games[game_id] = headers
+                    month = headers['Date'][:7].replace('.', '-')
+                    for player in (headers['White'], headers['Black']):
+                        self.archives[(player.lower(), month)].append(game)
+
+
+class _FakeChessComHandler(BaseHTTPRequestHandler):
+    server: FakeChessComServer
+
+    details = re.compile(r'^/callback/live/game/(\d+)$')
+    archive_list = re.compile(r'^/pub/player/([^/]+)/games/archives$')
+    archive = re.compile(r'^/pub/player/([^/]+)/games/(\d{4})/(\d{2})/pgn$')
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        with self.server.lock:
+            self.server.requests[path.split('/')[1]] += 1
+
+        if match := self.details.match(path):
+            headers = self.server.games.get(int(match.group(1)))
+            if headers is None:
+                return self._respond(404, {'message': 'Game not found'})
+            return self._respond(200, {'game': {'id': int(match.group(1)), 'pgnHeaders': headers}})
+
+        if match := self.archive_list.match(path):
+            username = match.group(1).lower()
+            months = sorted(month for player, month in self.server.archives if player == username)
+            return self._respond(200, {'archives': [f"{self.server.url}/pub/player/{username}/games/{month.replace('-', '/')}" for month in months]})
+
+        if match := self.archive.match(path):
+            games = self.server.archives.get((match.group(1).lower(), f"{match.group(2)}-{match.group(3)}"), [])
+            return self._respond(200, '\n\n\n'.join(games) + '\n', content_type='application/x-chess-pgn')
+
+        self._respond(404, {'message': 'Not found'})
+
+    def _respond(self, status: int, payload, content_type: str = 'application/json'):
+        data = (json.dumps(payload) if content_type == 'application/json' else payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == '__main__':
+    # Serve the fixture archives until interrupted
+    import time
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeChessComServer().start()
+    print(f"Serving {len(server.games)} games from {fixture_directory}, game ids {server.game_ids[0]} - {server.game_ids[-1]}")
+    try:
+        while 1:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
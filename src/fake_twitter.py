@@ -0,0 +1,187 @@
+import json
+import logging
+import threading
+import time
+from email.utils import format_datetime
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class FakeTwitterServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the parts of the Twitter API the bot uses: the 30 day search, media upload and status update.
+    Every request is recorded, and failures and latency can be injected to exercise the retry paths.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, rate_limit: int = 1800, latency: float = 0.0):
+        super().__init__(('127.0.0.1', port), _FakeTwitterHandler)
+        self.lock = threading.Lock()
+
+        # Tweets returned by the search, newest first
+        self.tweets = []
+        self.searches = 0
+        self.uploads = []
+        # (replied to tweet id, media ids, time.time() of the reply)
+        self.replies = []
+
+        # Respond to the next fail_next requests with a 503
+        self.fail_next = 0
+        self.latency = latency
+
+        self.rate_limit = rate_limit
+        self.rate_remaining = rate_limit
+        self.rate_reset = time.time() + 900
+
+        self.next_id = 1
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> 'FakeTwitterServer':
+        threading.Thread(target=self.serve_forever, name='fake-twitter', daemon=True).start()
+        logger.info(f"Fake Twitter listening on {self.url}")
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def add_tweet(self, text: str, user: str = 'someone') -> int:
+        """
+        Add a tweet for the search to find, ids increase with time like real tweet ids
+        """
+
+        now = datetime.now(timezone.utc)
+        tweet_id = (int(now.timestamp() * 1000) - 1288834974657) << 22 | self._id()
+        with self.lock:
+            self.tweets.insert(0, {'id': tweet_id,
+                                   'id_str': str(tweet_id),
+                                   'text': text,
+                                   'created_at': now.strftime('%a %b %d %H:%M:%S +0000 %Y'),
+                                   'user': {'screen_name': user}})
+        return tweet_id
+
+    def _id(self) -> int:
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+
+class _FakeTwitterHandler(BaseHTTPRequestHandler):
+    server: FakeTwitterServer
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            if self.server.fail_next > 0:
+                self.server.fail_next -= 1
+                return self._respond(503, {'errors': [{'code': 130, 'message': 'Over capacity'}]})
+            if time.time() > self.server.rate_reset:
+                self.server.rate_remaining = self.server.rate_limit
+                self.server.rate_reset = time.time() + 900
+            if self.server.rate_remaining <= 0:
+                return self._respond(429, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]})
+            self.server.rate_remaining -= 1
+
+        if url.path.startswith('/1.1/tweets/search/30day/'):
+            self._search(params)
+        elif url.path == '/1.1/media/upload.json':
+            self._upload(body)
+        elif url.path == '/1.1/statuses/update.json':
+            self._update(params)
+        else:
+            self._respond(404, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist.'}]})
+
+    def _search(self, params: dict):
+        with self.server.lock:
+            tweets = list(self.server.tweets)
+            self.server.searches += 1
+
+        # fromDate is a whole minute, like the real search
+        if 'fromDate' in params:
+            start = datetime.strptime(params['fromDate'], '%Y%m%d%H%M').replace(tzinfo=timezone.utc)
+            tweets = [t for t in tweets if datetime.strptime(t['created_at'], '%a %b %d %H:%M:%S %z %Y') >= start]
+
+        offset = int(params.get('next', 0))
+        size = int(params.get('maxResults', 100))
+        payload = {'results': tweets[offset:offset + size]}
+        if offset + size < len(tweets):
+            payload['next'] = str(offset + size)
+
+        self._respond(200, payload)
+
+    def _upload(self, body: bytes):
+        media_id = self.server._id()
+        with self.server.lock:
+            self.server.uploads.append((media_id, len(body)))
+        self._respond(200, {'media_id': media_id, 'media_id_string': str(media_id), 'size': len(body), 'expires_after_secs': 86400})
+
+    def _update(self, params: dict):
+        status_id = self.server._id()
+        with self.server.lock:
+            self.server.replies.append((int(params['in_reply_to_status_id']), params.get('media_ids'), time.time()))
+        self._respond(200, {'id': status_id, 'id_str': str(status_id), 'text': params.get('status', ''),
+                            'in_reply_to_status_id': int(params['in_reply_to_status_id']),
+                            'user': {'screen_name': 'chessindata'}})
+
+    def _respond(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('x-rate-limit-limit', str(self.server.rate_limit))
+        self.send_header('x-rate-limit-remaining', str(self.server.rate_remaining))
+        self.send_header('x-rate-limit-reset', str(int(self.server.rate_reset)))
+        self.send_header('Date', format_datetime(datetime.now(timezone.utc), usegmt=True))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == '__main__':
+    # Exercise the reply path of TwitterAPI against the fake server
+    from concurrent.futures import ThreadPoolExecutor
+
+    from cardimage import CardImage
+    import TwitterAPI as ta
+
+    logging.basicConfig(level=logging.INFO, format='%(threadName)s %(levelname)s %(message)s')
+
+    server = FakeTwitterServer(latency=0.05).start()
+    twitter = ta.TwitterAPI(base_url=server.url, latest_responded=0)
+    twitter.retry_delay = 0.1
+
+    tweet_ids = [server.add_tweet(f"{game_id} #chessindata", user=f"user{i}") for i, game_id in enumerate([1000, 1000, 1001, 1000])]
+    tweets = twitter.search_hashtag()
+    print(f"Search found {len(tweets)} tweets")
+
+    # Two distinct cards for four tweets, and the first two requests fail
+    cards = {1000: CardImage(b'\x89PNG card one', 'png'), 1001: CardImage(b'\x89PNG card two', 'png')}
+    server.fail_next = 2
+
+    def reply(tweet: tuple):
+        twitter.reply_media(tweet[0], twitter.upload_card(cards[int(tweet[1].split(' ')[0])]))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(reply, tweets))
+
+    print(f"{len(server.replies)} replies, {len(server.uploads)} uploads in {time.perf_counter() - start:.2f}s")
+    server.stop()
@@ -0,0 +1,129 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class JobJournal:
+    """
+    SQLite record of every card request and the last stage it completed, so unfinished work survives a restart.
+    Also holds the reply checkpoint, the newest tweet that has been taken on.
+    """
+
+    # Stages in the order they complete, a resumed job continues after its recorded stage
+    stages = ['received', 'ingested', 'evaluated', 'rendered', 'replied']
+    failed = 'failed'
+
+    def __init__(self, name: str = 'journal.db'):
+        self.name = name
+        self.lock = threading.Lock()
+
+        try:
+            self.conn = sqlite3.connect(self.name, check_same_thread=False)
+            # Each stage change is committed on its own, WAL keeps those commits cheap
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            with open('./SQLite_scripts/create_journal.sql', 'r') as fh:
+                self.conn.executescript(fh.read())
+            self.conn.commit()
+        except sqlite3.Error as e:
+            logger.critical(f"Error opening job journal: {e}")
+            quit()
+
+    def __del__(self):
+        self.conn.close()
+
+    def _execute(self, command: str, arguments: tuple = ()) -> sqlite3.Cursor:
+        with self.lock:
+            cursor = self.conn.execute(command, arguments)
+            self.conn.commit()
+        return cursor
+
+    @property
+    def checkpoint(self) -> Optional[int]:
+        """
+        Newest tweet id already taken on, None before the first run
+        """
+
+        with self.lock:
+            resp = self.conn.execute("SELECT value FROM Checkpoint WHERE name = 'latest_responded'").fetchone()
+        return resp[0] if resp else None
+
+    @checkpoint.setter
+    def checkpoint(self, tweet_id: int) -> None:
+        self._execute("INSERT OR REPLACE INTO Checkpoint(name, value) VALUES('latest_responded', ?)", (tweet_id,))
+
+    def seen(self, tweet_id: int) -> bool:
+        """
+        Whether a tweet has already been recorded, tweets found again after a crash are not answered twice
+        """
+
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM JobTweet WHERE tweet_id = ?", (tweet_id,)).fetchone() is not None
+
+    def record(self, game_id: int, user: str, tweet_id: int) -> int:
+        """
+        Record a new request and return its job id
+        """
+
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute("INSERT INTO Job(game_id, user, stage, created_at, updated_at) VALUES(?, ?, 'received', ?, ?)",
+                                       (game_id, user, now, now))
+            self.conn.execute("INSERT OR IGNORE INTO JobTweet(tweet_id, job_id) VALUES(?, ?)", (tweet_id, cursor.lastrowid))
+            self.conn.commit()
+
+        return cursor.lastrowid
+
+    def attach(self, job_id: int, tweet_id: int) -> None:
+        """
+        Record another tweet waiting on a job
+        """
+
+        self._execute("INSERT OR IGNORE INTO JobTweet(tweet_id, job_id) VALUES(?, ?)", (tweet_id, job_id))
+
+    def advance(self, job_id: int, stage: str) -> None:
+        self._execute("UPDATE Job SET stage = ?, updated_at = ? WHERE job_id = ?", (stage, time.time(), job_id))
+
+    def replied(self, tweet_id: int) -> None:
+        self._execute("UPDATE JobTweet SET replied = 1 WHERE tweet_id = ?", (tweet_id,))
+
+    def fail(self, job_id: int, error: str) -> None:
+        """
+        Mark a job as failed, failed jobs are not resumed
+        """
+
+        self._execute("UPDATE Job SET stage = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                      (self.failed, error, time.time(), job_id))
+
+    def unfinished(self) -> List[Tuple[int, int, str, str, List[int]]]:
+        """
+        Return (job_id, game_id, user, stage, unanswered tweet ids) of the jobs that were neither replied to nor failed
+        """
+
+        sql_query = """SELECT j.job_id, j.game_id, j.user, j.stage, jt.tweet_id
+                       FROM Job j
+                       JOIN JobTweet jt
+                       ON j.job_id = jt.job_id
+                       WHERE j.stage NOT IN ('replied', 'failed')
+                         AND jt.replied = 0
+                       ORDER BY j.job_id, jt.tweet_id"""
+
+        with self.lock:
+            rows = self.conn.execute(sql_query).fetchall()
+
+        jobs = {}
+        for job_id, game_id, user, stage, tweet_id in rows:
+            jobs.setdefault(job_id, (job_id, game_id, user, stage, []))[4].append(tweet_id)
+
+        return list(jobs.values())
+
+    def counts(self) -> dict:
+        """
+        Number of jobs at each stage
+        """
+
+        with self.lock:
+            return dict(self.conn.execute("SELECT stage, COUNT(*) FROM Job GROUP BY stage").fetchall())
@@ -0,0 +1,262 @@
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fake_chesscom import FakeChessComServer
+from fake_twitter import FakeTwitterServer
+
+logger = logging.getLogger('__main__.' + __name__)
+
+src_directory = str(Path(__file__).parent) + "/"
+
+def start_bot(twitter: FakeTwitterServer, chesscom: FakeChessComServer, work_directory: str, args) -> subprocess.Popen:
+    """
+    Run main.py against the local stand-ins with its database, journal, archives and cards in work_directory
+    """
+
+    env = dict(os.environ)
+    env['STOCKFISH_PATH'] = args.engine or src_directory + "stub_engine.py"
+    env['STUB_ENGINE_DELAY_MS'] = str(args.engine_delay_ms)
+    env['PGN_DIRECTORY'] = work_directory + "/pgns/"
+    os.makedirs(env['PGN_DIRECTORY'], exist_ok=True)
+
+    command = [sys.executable, 'main.py',
+               '--twitter_url', twitter.url,
+               '--chesscom_url', chesscom.url,
+               '--database', work_directory + "/chesscom_db.db",
+               '--journal', work_directory + "/journal.db",
+               '--card_directory', work_directory + "/cards/",
+               '--poll_period', '2',
+               '--min_poll_period', '1',
+               '--max_poll_period', '5',
+               '--max_tweet_results', '100',
+               '--metrics_file', work_directory + "/metrics.prom"] + args.bot_args
+
+    logger.info(f"Starting bot: {' '.join(command)}")
+    log = open(work_directory + "/bot.log", 'w')
+    return subprocess.Popen(command, cwd=src_directory, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+def stop_bot(bot: subprocess.Popen, timeout: float = 30) -> None:
+    """
+    Interrupt the bot like Ctrl-C, killing it if the pipeline does not drain in time
+    """
+
+    if bot.poll() is not None:
+        return
+    bot.send_signal(signal.SIGINT)
+    try:
+        bot.wait(timeout)
+    except subprocess.TimeoutExpired:
+        bot.kill()
+        bot.wait()
+
+def generate(twitter: FakeTwitterServer, game_ids: list, args) -> dict:
+    """
+    Post args.rate tweets per minute for args.duration seconds, asking for random games from random users.
+    Returns the time.time() each tweet was posted by tweet id.
+    """
+
+    rnd = random.Random(args.seed)
+    users = [f"loaduser{i}" for i in range(args.users)]
+    interval = 60 / args.rate
+
+    sent = {}
+    start = time.time()
+    while time.time() - start < args.duration:
+        tweet_id = twitter.add_tweet(f"{rnd.choice(game_ids)} #chessindata", user=rnd.choice(users))
+        sent[tweet_id] = time.time()
+        # Keep to the schedule rather than drifting by the time taken to post
+        time.sleep(max(0.0, start + len(sent) * interval - time.time()))
+
+    return sent
+
+def report(sent: dict, replies: list, started: float, finished: float) -> dict:
+    """
+    Latency percentiles and throughput of the replies to the sent tweets
+    """
+
+    replied = {}
+    for tweet_id, _, reply_time in replies:
+        if tweet_id in sent:
+            replied.setdefault(tweet_id, reply_time)
+    latencies = sorted(replied[tweet_id] - sent[tweet_id] for tweet_id in replied)
+
+    result = {'sent': len(sent),
+              'replied': len(replied),
+              'unanswered': len(sent) - len(replied),
+              'duration_s': round(finished - started, 2),
+              'throughput_per_min': round(len(replied) / (finished - started) * 60, 2) if finished > started else 0.0}
+    if len(latencies) > 1:
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+        result.update({'latency_p50_s': round(percentiles[49], 3),
+                       'latency_p95_s': round(percentiles[94], 3),
+                       'latency_p99_s': round(percentiles[98], 3),
+                       'latency_max_s': round(latencies[-1], 3)})
+    elif latencies:
+        result.update({f'latency_{p}_s': round(latencies[0], 3) for p in ('p50', 'p95', 'p99', 'max')})
+
+    return result
+
+def stage_seconds(path: str) -> dict:
+    """
+    Mean seconds per stage from the metrics file written by the bot
+    """
+
+    sums, counts = {}, {}
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as fh:
+        for line in fh:
+            if match := re.match(r'chessbot_stage_seconds_(sum|count)\{stage="(\w+)"\} (\S+)', line):
+                (sums if match.group(1) == 'sum' else counts)[match.group(2)] = float(match.group(3))
+
+    return {stage: round(sums[stage] / counts[stage], 3) for stage in sums if counts.get(stage)}
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s - %(name)s')
+
+    twitter = FakeTwitterServer(latency=args.twitter_latency).start()
+    chesscom = FakeChessComServer(pgn_directory=args.fixtures).start()
+    work_directory = tempfile.mkdtemp(prefix='loadgen-')
+    logger.info(f"Working directory {work_directory}")
+
+    bot = start_bot(twitter, chesscom, work_directory, args)
+    try:
+        # The bot is up once it has made its first search
+        deadline = time.time() + args.startup_timeout
+        while twitter.searches == 0:
+            if bot.poll() is not None or time.time() > deadline:
+                logger.error(f"Bot did not start, see {work_directory}/bot.log")
+                quit()
+            time.sleep(0.1)
+
+        started = time.time()
+        sent = generate(twitter, chesscom.game_ids, args)
+        logger.info(f"Sent {len(sent)} tweets, waiting for the replies.")
+
+        # Wait for the stragglers
+        deadline = time.time() + args.drain_timeout
+        while time.time() < deadline and bot.poll() is None:
+            if len({reply[0] for reply in twitter.replies} & sent.keys()) == len(sent):
+                break
+            time.sleep(0.2)
+        finished = max([reply[2] for reply in twitter.replies] + [started])
+    finally:
+        stop_bot(bot)
+        twitter.stop()
+        chesscom.stop()
+
+    result = report(sent, list(twitter.replies), started, finished)
+    result.update({'rate_per_min': args.rate, 'uploads': len(twitter.uploads), 'searches': twitter.searches,
+                   'chesscom_requests': dict(chesscom.requests), 'stage_seconds': stage_seconds(work_directory + "/metrics.prom")})
+
+    for key, value in result.items():
+        print(f"{key:>20}: {value}")
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(result, fh, indent=2)
+
+def parse_arguments():
+    """
+    Parse the command-line arguments
+    """
+
+    parser = argparse.ArgumentParser(prog='loadgen',
+                                     description='Run the bot against local stand-ins for Twitter and chess.com under a steady load of requests.')
+
+    parser.add_argument('-r',
+                        '--rate',
+                        help='set number of requests per minute - Default: 30 - Range: (0, inf)',
+                        type=float,
+                        action='store',
+                        default=30)
+
+    parser.add_argument('-t',
+                        '--duration',
+                        help='set seconds the requests are sent for - Default: 60 - Range: (0, inf)',
+                        type=float,
+                        action='store',
+                        default=60)
+
+    parser.add_argument('-u',
+                        '--users',
+                        help='set number of distinct users sending requests - Default: 20 - Range: [1, inf)',
+                        type=int,
+                        action='store',
+                        default=20)
+
+    parser.add_argument('-s',
+                        '--seed',
+                        help='set seed of the game and user choice - Default: 0',
+                        type=int,
+                        action='store',
+                        default=0)
+
+    parser.add_argument('-e',
+                        '--engine',
+                        help='set engine executable - Default: stub_engine.py',
+                        action='store',
+                        default=None)
+
+    parser.add_argument('-y',
+                        '--engine_delay_ms',
+                        help='set search time of the stub engine per position in ms - Default: 0 - Range: [0, inf)',
+                        type=float,
+                        action='store',
+                        default=0)
+
+    parser.add_argument('-l',
+                        '--twitter_latency',
+                        help='set latency of the fake Twitter in seconds - Default: 0 - Range: [0, inf)',
+                        type=float,
+                        action='store',
+                        default=0)
+
+    parser.add_argument('-f',
+                        '--fixtures',
+                        help='set directory of the recorded archives - Default: ../fixtures/pgns/',
+                        action='store',
+                        default=str(Path(__file__).parent.parent) + "/fixtures/pgns/")
+
+    parser.add_argument('-d',
+                        '--drain_timeout',
+                        help='set seconds to wait for replies after the last request - Default: 120',
+                        type=float,
+                        action='store',
+                        default=120)
+
+    parser.add_argument('--startup_timeout',
+                        help='set seconds to wait for the bot to start - Default: 60',
+                        type=float,
+                        action='store',
+                        default=60)
+
+    parser.add_argument('-j',
+                        '--json',
+                        help='set file to write the report to as JSON - Default: none',
+                        action='store',
+                        default=None)
+
+    # Everything after -- is passed to main.py, such as -- --renderer matplotlib --eval_workers 2
+    parser.add_argument('bot_args',
+                        help='flags passed on to main.py after --',
+                        nargs=argparse.REMAINDER)
+
+    args = parser.parse_args()
+    if args.bot_args[:1] == ['--']:
+        args.bot_args = args.bot_args[1:]
+    return args
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
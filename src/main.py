@@ -1,12 +1,18 @@
 
 import argparse
 import logging
-import patchworklib as pw
-import time
 
+from cardcache import CardCache
 from cardconstruction import CardConstruction
-from cardplotter import CardPlotter
+from cardimage import CardEncoding
 from DBConn import DBConn
+from journal import JobJournal
+from metrics import metrics
+import pgnproc
+from pipeline import CardPipeline
+from poller import AdaptivePoller
+from profiling import RequestProfiler
+from renderpool import LazyPlotter, RenderPool
 import TwitterAPI as ta
 
 def main(args):
@@ -31,29 +37,84 @@ def main(args):
 
 
     # Get database access (create if doesn't exist)
-    db = DBConn('chesscom_db.db', sf_depth=args.default_depth)
-    # Create plotting object
-    plotter = CardPlotter(db=db)
+    db = DBConn(args.database, sf_depth=args.default_depth, query_cache_size=int(args.query_cache_size))
+    # Encoding of the cards for upload
+    encoding = CardEncoding(image_format=args.image_format,
+                            quality=int(args.image_quality),
+                            max_bytes=int(args.image_max_kb) * 1024 if args.image_max_kb else None)
+    # Create plotting object, the plotting libraries are imported when the first card is drawn in this process
+    plotter = LazyPlotter(renderer=args.renderer, db=db, encoding=encoding)
+    # Create the render workers, cards are drawn in the main process without them
+    render_pool = RenderPool(renderer=args.renderer, processes=int(args.render_workers), encoding=encoding) if int(args.render_workers) else None
+    # Create the cache of rendered cards
+    cache = CardCache(directory=args.card_directory, max_bytes=int(args.card_cache_mb) * 2**20)
+    # Send the chess.com requests to a local stand-in if given
+    if args.chesscom_url:
+        pgnproc.use_chesscom_host(args.chesscom_url)
     # Create the card construction object
-    cc = CardConstruction(db=db, plotter=plotter)
-    # Create object to access Twitter API
-    twitAPI = ta.TwitterAPI(max_tweet_results=args.max_tweet_results)
+    cc = CardConstruction(db=db, plotter=plotter, cache=cache, render_pool=render_pool,
+                          chesscom_url=args.chesscom_url or "https://www.chess.com")
+    # Create the journal of card requests, holding the reply checkpoint
+    journal = JobJournal(args.journal)
+    # Create object to access Twitter API, continuing from the checkpoint of the last run
+    twitAPI = ta.TwitterAPI(max_tweet_results=args.max_tweet_results, latest_responded=journal.checkpoint, base_url=args.twitter_url)
+
+    # Profile selected requests and keep the slowest requests report
+    profiler = None
+    if args.profile_mode is not None:
+        profiler = RequestProfiler(directory=args.profile_directory,
+                                   mode=args.profile_mode,
+                                   rate=float(args.profile_rate),
+                                   game_ids=[int(game_id) for game_id in args.profile_games],
+                                   slowest=int(args.slowest))
+
+    # Create the pipeline answering the tweets, a plotter in this process can only draw one card at a time
+    pipeline = CardPipeline(cc=cc,
+                            twitter=twitAPI,
+                            fetch_workers=int(args.fetch_workers),
+                            eval_workers=int(args.eval_workers),
+                            render_workers=render_pool.processes if render_pool else 1,
+                            reply_workers=int(args.reply_workers),
+                            user_active=int(args.user_active),
+                            user_queued=int(args.user_queued),
+                            journal=journal,
+                            profiler=profiler)
+    # Export the stage timings and counters
+    if args.metrics_port is not None:
+        metrics.serve(int(args.metrics_port))
+
+    pipeline.start()
+    logger.info(f"Resumed {pipeline.resume()} unfinished jobs.")
+    # Searches speed up while tweets are arriving and slow down while idle
+    poller = AdaptivePoller(period=float(args.poll_period),
+                            min_period=float(args.min_poll_period),
+                            max_period=float(args.max_poll_period))
 
     # Loop until process is interrupted
-    while 1:
-        logger.info("-------------------- Cycle --------------------")
-        responses = []
-        for tweet in twitAPI.search_hashtag():
-            filename = cc(tweet[1].split(' ')[0])
-            responses.append((tweet[0], filename))
-        
-        if len(responses):
-            logger.info(f"Tweeting {len(responses)} times.")
-            twitAPI.reply(responses)
-        else:
-            logger.info("No new tweets.")
-
-        time.sleep(int(args.poll_period))
+    try:
+        while 1:
+            logger.info("-------------------- Cycle --------------------")
+            tweets = twitAPI.search_hashtag()
+            for tweet in tweets:
+                pipeline.submit(tweet[0], tweet[1].split(' ')[0], user=tweet[3])
+
+            if len(tweets):
+                logger.info(f"Queued {len(tweets)} tweets, {pipeline.replied} replied and {pipeline.coalesced} coalesced so far.")
+                # Queued tweets are not searched for again, they are in the journal and answered by the pipeline
+                twitAPI.latest_responded = max(tweet[0] for tweet in tweets)
+                journal.checkpoint = twitAPI.latest_responded
+            else:
+                logger.info("No new tweets.")
+            logger.info("Scheduler: " + ", ".join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}" for k, v in pipeline.scheduler.stats().items()))
+            logger.debug("Query cache: " + ", ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in db.query_cache_stats().items()))
+            if args.metrics_file:
+                metrics.write(args.metrics_file)
+
+            poller.wait(len(tweets), twitAPI.rate_limit())
+    finally:
+        pipeline.close()
+        if args.metrics_file:
+            metrics.write(args.metrics_file)
 
 def parse_arguments():
     """
@@ -70,19 +131,191 @@ def parse_arguments():
                         action='store',
                         default=15)
     
-    # Anything less than 30s is probably overkill, this is not enforced/checked anywhere
+    # The period halves when a search finds tweets and grows when it does not, the rate limit is always respected
     parser.add_argument('-p',
                         '--poll_period',
-                        help='set period of the Twitter poll in seconds - Default: 30 - Range: [30, inf)',
+                        help='set initial period of the Twitter poll in seconds - Default: 30 - Range: [min_poll_period, max_poll_period]',
                         action='store',
                         default=30)
 
+    parser.add_argument('-i',
+                        '--min_poll_period',
+                        help='set shortest period of the Twitter poll in seconds - Default: 5 - Range: [1, inf)',
+                        action='store',
+                        default=5)
+
+    parser.add_argument('-x',
+                        '--max_poll_period',
+                        help='set longest period of the Twitter poll in seconds while idle - Default: 300 - Range: [min_poll_period, inf)',
+                        action='store',
+                        default=300)
+
     # This must be between 10 and 100 inclusive, anything beyond this range will cause a Twitter API error
     parser.add_argument('-m',
                         '--max_tweet_results',
                         help='set maximum tweets pulled in a request - Default: 10 - Range: [10, 100]',
                         action='store',
                         default=10)
+
+    # Cards are a few hundred KB each
+    parser.add_argument('-c',
+                        '--card_cache_mb',
+                        help='set maximum size of the rendered card directory in MB - Default: 500 - Range: [1, inf)',
+                        action='store',
+                        default=500)
+
+    # The matplotlib renderer draws the same card without plotnine and patchworklib
+    parser.add_argument('-r',
+                        '--renderer',
+                        help='set card renderer - Default: plotnine - Options: plotnine, matplotlib',
+                        action='store',
+                        choices=['plotnine', 'matplotlib'],
+                        default='plotnine')
+
+    # Each worker holds a warm plotter, 0 draws cards in the main process
+    parser.add_argument('-w',
+                        '--render_workers',
+                        help='set number of render worker processes - Default: 0 - Range: [0, cpu count]',
+                        action='store',
+                        default=0)
+
+    # Smaller images upload faster, JPEG and WebP trade some sharpness for size
+    parser.add_argument('-f',
+                        '--image_format',
+                        help='set card image format - Default: png - Options: png, jpeg, webp',
+                        action='store',
+                        choices=['png', 'jpeg', 'webp'],
+                        default='png')
+
+    parser.add_argument('-q',
+                        '--image_quality',
+                        help='set starting JPEG/WebP quality - Default: 90 - Range: [30, 100]',
+                        action='store',
+                        default=90)
+
+    # Quality is lowered in steps until the card fits, PNG cards are reduced to a palette instead
+    parser.add_argument('-k',
+                        '--image_max_kb',
+                        help='set target card size in KB - Default: none - Range: [1, 5120]',
+                        action='store',
+                        default=None)
+
+    # Downloads from chess.com wait on the network, a couple of them can run alongside the engine
+    parser.add_argument('-n',
+                        '--fetch_workers',
+                        help='set number of concurrent chess.com downloads - Default: 2 - Range: [1, 10]',
+                        action='store',
+                        default=2)
+
+    # Each evaluation already uses a process per cpu, more than one mostly helps short games pass long ones
+    parser.add_argument('-e',
+                        '--eval_workers',
+                        help='set number of games evaluated concurrently - Default: 1 - Range: [1, cpu count]',
+                        action='store',
+                        default=1)
+
+    parser.add_argument('-u',
+                        '--reply_workers',
+                        help='set number of concurrent Twitter replies - Default: 1 - Range: [1, 10]',
+                        action='store',
+                        default=1)
+
+    # Cheaper cards are let into the pipeline first, these keep one user from crowding out everyone else
+    parser.add_argument('-a',
+                        '--user_active',
+                        help='set number of cards in progress per user - Default: 1 - Range: [1, inf)',
+                        action='store',
+                        default=1)
+
+    parser.add_argument('-l',
+                        '--user_queued',
+                        help='set number of waiting cards per user, further requests are ignored - Default: 5 - Range: [1, inf)',
+                        action='store',
+                        default=5)
+
+    parser.add_argument('-b',
+                        '--database',
+                        help='set database file - Default: chesscom_db.db',
+                        action='store',
+                        default='chesscom_db.db')
+
+    # Rows of per game queries, dropped when an evaluation or an ingest writes to the game
+    parser.add_argument('-Q',
+                        '--query_cache_size',
+                        help='set number of cached per game query results - Default: 256 - Range: [1, inf)',
+                        action='store',
+                        default=256)
+
+    parser.add_argument('-j',
+                        '--journal',
+                        help='set job journal file - Default: journal.db',
+                        action='store',
+                        default='journal.db')
+
+    parser.add_argument('-o',
+                        '--card_directory',
+                        help='set directory of the rendered card cache - Default: ./../cards/',
+                        action='store',
+                        default='./../cards/')
+
+    # Local stand-ins such as fake_twitter.py and fake_chesscom.py, no tokens are needed for a local Twitter
+    parser.add_argument('-t',
+                        '--twitter_url',
+                        help='set base url of a local Twitter API - Default: none, the real Twitter API',
+                        action='store',
+                        default=None)
+
+    parser.add_argument('-s',
+                        '--chesscom_url',
+                        help='set base url of a local chess.com - Default: none, the real chess.com',
+                        action='store',
+                        default=None)
+
+    # Prometheus text format, scraped from the port or read from the file by a textfile collector
+    parser.add_argument('-g',
+                        '--metrics_port',
+                        help='set port serving the stage timings and counters at /metrics - Default: none - Range: [1, 65535]',
+                        action='store',
+                        default=None)
+
+    parser.add_argument('-z',
+                        '--metrics_file',
+                        help='set file the stage timings and counters are written to after every poll - Default: none',
+                        action='store',
+                        default=None)
+
+    # Profiles cover the work in this process, engine and render workers only show as the time waited on them
+    parser.add_argument('-v',
+                        '--profile_mode',
+                        help='set profiler of selected requests, cProfile or stack sampling written as folded stacks - Default: none - Options: cprofile, sample',
+                        action='store',
+                        choices=['cprofile', 'sample'],
+                        default=None)
+
+    parser.add_argument('-y',
+                        '--profile_rate',
+                        help='set fraction of requests profiled - Default: 0.05 - Range: [0, 1]',
+                        action='store',
+                        default=0.05)
+
+    parser.add_argument('-G',
+                        '--profile_games',
+                        help='set game ids that are always profiled - Default: none',
+                        action='store',
+                        nargs='+',
+                        default=[])
+
+    parser.add_argument('-D',
+                        '--profile_directory',
+                        help='set directory of the profiles and the slowest requests report - Default: ./../profiles/',
+                        action='store',
+                        default='./../profiles/')
+
+    parser.add_argument('-N',
+                        '--slowest',
+                        help='set number of requests kept in the slowest requests report - Default: 10 - Range: [1, inf)',
+                        action='store',
+                        default=10)
     
     return parser.parse_args()
 
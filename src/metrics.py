@@ -0,0 +1,148 @@
+import bisect
+from contextlib import contextmanager
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class Metrics:
+    """
+    Stage timings, counters and gauges of the bot, exported in the Prometheus text format.
+    Every stage duration goes into one histogram labelled by stage.
+    """
+
+    prefix = 'chessbot'
+    # Upper bounds of the duration buckets in seconds, from a cached card to a long game at full depth
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+    descriptions = {'stage_seconds': 'Time spent in each stage of answering a request',
+                    'cache_hits_total': 'Cards served from the card cache',
+                    'cache_misses_total': 'Cards that had to be drawn',
+                    'media_reused_total': 'Replies attaching media uploaded earlier',
+                    'positions_evaluated_total': 'Positions evaluated by the engine',
+                    'query_cache_hits_total': 'Per game database queries answered from the query cache',
+                    'query_cache_misses_total': 'Per game database queries sent to SQLite',
+                    'query_cache_invalidations_total': 'Games whose cached query results were dropped by a write',
+                    'requests_total': 'Requests answered',
+                    'requests_failed_total': 'Requests given up on',
+                    'engine_positions_per_second': 'Positions per second of the last evaluated game',
+                    'engine_nodes_per_second': 'Mean nodes per second reported by the engine for the last evaluations written'}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Stage -> bucket counts followed by the total count, and stage -> sum of seconds
+        self.histogram: Dict[str, list] = {}
+        self.sums: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.server = None
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """
+        Time the body of a with statement as a stage, also when it raises
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            counts = self.histogram.setdefault(stage, [0] * (len(self.buckets) + 1))
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.sums[stage] = self.sums.get(stage, 0.0) + seconds
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: float) -> None:
+        with self.lock:
+            self.gauges[name] = value
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format
+        """
+
+        lines = []
+        with self.lock:
+            name = f"{self.prefix}_stage_seconds"
+            lines += [f"# HELP {name} {self.descriptions['stage_seconds']}", f"# TYPE {name} histogram"]
+            for stage in sorted(self.histogram):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), self.histogram[stage]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{"+Inf" if bound == float("inf") else bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {self.sums[stage]:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {cumulative}')
+
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                for key in sorted(values):
+                    lines += [f"# HELP {self.prefix}_{key} {self.descriptions.get(key, key)}",
+                              f"# TYPE {self.prefix}_{key} {kind}",
+                              f"{self.prefix}_{key} {values[key]:g}"]
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Write the metrics to a text file, replaced in one step so a collector never reads half a file
+        """
+
+        with open(path + ".tmp", 'w') as fh:
+            fh.write(self.render())
+        os.replace(path + ".tmp", path)
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """
+        Serve the metrics on http://host:port/metrics from a background thread
+        """
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                data = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+        logger.info(f"Serving metrics on http://{host}:{self.server.server_address[1]}/metrics")
+
+        return self.server
+
+
+@contextmanager
+def timed(timings: Dict[str, float], name: str) -> Iterator[None]:
+    """
+    Add the time taken by the body of a with statement to timings[name], for timings gathered away from the exporter
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+# The metrics of this process
+metrics = Metrics()
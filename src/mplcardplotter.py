@@ -0,0 +1,259 @@
+import io
+import logging
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+import numpy as np
+from typing import List, Optional
+
+from carddata import CardData
+from cardimage import CardEncoding, CardImage
+from DBConn import DBConn
+from metrics import timed
+from renderpool import renderer_versions
+from ChessPlotterColourScheme import ChessPlotterColourScheme as cpcs
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class MplCardPlotter:
+    """
+    Draw the same card as CardPlotter with plain matplotlib.
+    The figure, axes and all static styling are built once, only the data layers are drawn per card.
+    """
+
+    # Bumped in renderpool.renderer_versions when the card layout changes
+    version = renderer_versions['matplotlib']
+
+    stat_order = ['Other Moves', 'Third Best Move', 'Second Best Move', 'Best Move', 'Avg. Move Rank', 'Avg. Move Loss', 'Total Move Loss']
+    pawn_ticks = list(range(-10, 12, 2))
+    pawn_labels = ['-10', '', '-6', '', '-2', '', '2', '', '6', '', '10']
+    ribbon_fill = '#333333'
+
+    def __init__(self, db: Optional[DBConn], fig_size: tuple=(9.56, 13.27), dpi: int=200, encoding: Optional[CardEncoding]=None):
+        self.db = db
+        self.encoding = encoding or CardEncoding()
+        self.game_id = None
+        self.fig_size = fig_size
+        self.dpi = dpi
+        self.time_plot_break = 60
+
+        # Artists drawn for the current card, removed before the next one
+        self.data_artists = []
+        self.build_figure()
+
+    def build_figure(self):
+        """
+        Build the static card skeleton: background, section titles, axis labels and styling
+        """
+
+        self.fig = plt.figure(figsize=self.fig_size, dpi=self.dpi, facecolor=cpcs.background)
+
+        # Section rectangles [left, bottom, width, height] matching the patchworklib layout of CardPlotter
+        self.ax_title = self.fig.add_axes([0, 0.865, 1, 0.13])
+        self.ax_stats = self.fig.add_axes([0.16, 0.6925, 0.811, 0.125])
+        self.ax_eval = self.fig.add_axes([0.153, 0.4815, 0.836, 0.151])
+        self.ax_time = self.fig.add_axes([0.153, 0.265, 0.836, 0.151])
+        self.ax_loss = self.fig.add_axes([0.153, 0.0475, 0.836, 0.1525])
+
+        for ax in (self.ax_title, self.ax_stats, self.ax_eval, self.ax_time, self.ax_loss):
+            ax.set_facecolor(cpcs.background)
+            ax.tick_params(colors=cpcs.white, labelsize=14, length=0)
+            for spine in ax.spines.values():
+                spine.set_visible(False)
+
+        # Title and statistics have no axes to speak of
+        self.ax_title.set_axis_off()
+        self.ax_title.set_xlim(-1, 1)
+        self.ax_title.set_ylim(10, 19.5)
+        self.ax_stats.tick_params(axis='x', labelbottom=False)
+        self.ax_stats.tick_params(axis='y', labelsize=10)
+
+        # Line plots share the grid styling and the section titles
+        for ax, title, ylabel in ((self.ax_eval, "Evaluation and Material Balance", '[Pawn]'),
+                                  (self.ax_time, "Time Advantage", '[Second]'),
+                                  (self.ax_loss, "Evaluation Loss by Move", '[Pawn]')):
+            ax.set_title(title, color=cpcs.white, fontsize=14)
+            ax.set_ylabel(ylabel, color=cpcs.white, fontsize=14)
+            ax.grid(True, which='major', color=cpcs.white, linewidth=1)
+            ax.set_axisbelow(True)
+            ax.margins(0)
+
+        for ax in (self.ax_eval, self.ax_loss):
+            ax.set_ylim(-10, 10)
+            ax.set_yticks(self.pawn_ticks)
+            ax.set_yticklabels(self.pawn_labels)
+
+        self.ax_eval.tick_params(axis='x', labelbottom=False)
+        self.ax_time.tick_params(axis='x', labelbottom=False)
+        self.ax_loss.set_xlabel('[Move]', color=cpcs.white, fontsize=14)
+
+    def gen_card(self, game_id: int, filepath: str="", filename: Optional[str]=None, persist: bool=True) -> CardImage:
+        """
+        Generate all of the plots and the card.
+        This assumes that the game_id exists in the database and has been fully evaluated.
+        """
+
+        self.game_id = game_id
+        data = CardData.load(self.db, self.game_id)
+
+        if filepath == "":
+            filepath = "./../cards/"
+
+        return self.render(data, filepath + (filename or f"{self.game_id}") if persist else None)
+
+    def render(self, data: CardData, filename: Optional[str]=None) -> CardImage:
+        """
+        Draw the card for already loaded data and encode it in memory, also saved to filename if given with the extension added
+        """
+
+        self.game_id = data.game_id
+        timings = {}
+
+        try:
+            for section in (self.gen_title, self.gen_stats, self.gen_eval_plot, self.gen_time_plot, self.gen_loss_plot):
+                with timed(timings, 'plot_' + section.__name__[4:]):
+                    section(data)
+
+            with timed(timings, 'plot_draw'):
+                buffer = io.BytesIO()
+                self.fig.savefig(buffer, format='png', dpi=self.dpi, facecolor=cpcs.background)
+            with timed(timings, 'plot_encode'):
+                card = CardImage(self.encoding.encode(buffer.getvalue()), self.encoding.format)
+            card.timings = timings
+            if filename is not None:
+                card.save(filename)
+            logger.info("Rendered card")
+        except Exception as e:
+            logger.error(f"Error saving card: {e}")
+            quit()
+        finally:
+            self.clear()
+
+        return card
+
+    def clear(self):
+        """
+        Remove the data layers of the previous card, leaving the skeleton
+        """
+
+        for artist in self.data_artists:
+            artist.remove()
+        self.data_artists = []
+
+    def _keep(self, artists) -> List:
+        """
+        Track artists so they are removed after the card is saved
+        """
+
+        artists = artists if isinstance(artists, list) else [artists]
+        self.data_artists.extend(artists)
+        return artists
+
+    def _label(self, ax, x: float, y: float, text: str, colour: str, fill: str):
+        self._keep(ax.text(x, y, text, ha='left', va='center', fontsize=16, color=colour,
+                           bbox=dict(boxstyle='round,pad=0.25', facecolor=fill, edgecolor=cpcs.black)))
+
+    def _x_axis(self, ax, x_limit: float):
+        ax.set_xlim(1, x_limit)
+        ax.set_xticks(range(10, int(x_limit), 10))
+
+    def gen_title(self, data: CardData):
+        """
+        Generate the titles for the card
+        """
+
+        summary = data.summary
+        time_control = f"Time: {int(data.time_control // 60)} + {int(data.time_control % 60)}"
+
+        ax = self.ax_title
+        self._keep(ax.text(0, 18, f"{summary[0]} vs. {summary[1]}", ha='center', va='center', fontsize=30, color=cpcs.white))
+        self._keep(ax.text(0, 15.2, summary[3][:10], ha='center', va='center', fontsize=14, color=cpcs.white))
+        self._keep(ax.text(0, 13.5, time_control, ha='center', va='center', fontsize=14, color=cpcs.white))
+        self._keep(ax.text(0, 11, summary[2], ha='center', va='center', fontsize=30, color=cpcs.white))
+
+    def gen_stats(self, data: CardData):
+        """
+        Generate the statistics bars, white to the left and black to the right
+        """
+
+        stats = data.stats.set_index('colour')
+        black = stats.loc['Black', self.stat_order].to_numpy(dtype=np.float64)
+        white = stats.loc['White', self.stat_order].to_numpy(dtype=np.float64)
+        limit = np.nanmax(np.abs(np.concatenate([black, white]))) * 1.2
+
+        ax = self.ax_stats
+        rows = np.arange(len(self.stat_order))
+        self._keep(ax.barh(rows, black, height=0.9, color=cpcs.black, edgecolor=cpcs.lightgray))
+        self._keep(ax.barh(rows, -white, height=0.9, color=cpcs.white, edgecolor=cpcs.lightgray))
+
+        for row, b, w in zip(rows, black, white):
+            for value, x, colour, fill in ((b, limit / 1.2 * 1.1, cpcs.white, cpcs.black), (w, -limit / 1.2 * 1.1, cpcs.black, cpcs.white)):
+                # Zero has no side to be drawn on, and a stat without any moves to count has no value
+                if not value or np.isnan(value):
+                    continue
+                label = f"{value:.0f}" if abs(value - round(value)) < 0.001 else f"{value:.1f}"
+                self._keep(ax.text(x, row, label, ha='center', va='center', fontsize=11, color=colour,
+                                   bbox=dict(boxstyle='round,pad=0.2', facecolor=fill, edgecolor=cpcs.lightgray)))
+
+        ax.set_xlim(-limit, limit)
+        ax.set_ylim(-0.6, len(rows) - 0.4)
+        ax.set_yticks(rows)
+        ax.set_yticklabels(self.stat_order)
+
+    def gen_eval_plot(self, data: CardData):
+        """
+        Generate evaluation and material plot, the evaluation line takes the colour of the side ahead
+        """
+
+        ax = self.ax_eval
+        x = data.ply_num[:-1]
+        evaluation = data.eval[:-1]
+
+        self._keep(ax.fill_between(x, 0, evaluation, color=self.ribbon_fill, alpha=cpcs.alpha + 0.2, linewidth=0))
+        self._keep(ax.plot(x, data.material[:-1], color=cpcs.int_orange, linewidth=2))
+
+        points = np.column_stack([x, evaluation])
+        segments = np.stack([points[:-1], points[1:]], axis=1)
+        colours = np.where(data.eval_shift[:-2] < 0, cpcs.black, cpcs.white)
+        self._keep(ax.add_collection(LineCollection(segments, colors=colours, linewidths=2.5)))
+
+        label_x = (data.x_limit - 1) * 0.02 + 1
+        self._label(ax, label_x, -5.75, 'Material', cpcs.black, cpcs.int_orange)
+        self._label(ax, label_x, -8.75, 'Evaluation', cpcs.black, cpcs.white)
+        self._x_axis(ax, data.x_limit)
+
+    def gen_time_plot(self, data: CardData):
+        """
+        Generate time balance plot
+        """
+
+        ax = self.ax_time
+        largest = np.nanmax(np.abs(data.clock_diff)) if len(data.clock_diff) else 0
+        bottom_limit = int(- largest // self.time_plot_break * self.time_plot_break)
+        top_limit = int(largest // self.time_plot_break * self.time_plot_break + self.time_plot_break)
+
+        self._keep(ax.fill_between(data.clock_move_num, 0, data.clock_diff, color=self.ribbon_fill, alpha=cpcs.alpha + 0.2, linewidth=0))
+        self._keep(ax.plot(data.clock_move_num, data.clock_diff, color=cpcs.int_orange, linewidth=2.5))
+
+        label_x = (data.x_limit - 1) * 0.02 + 1
+        self._label(ax, label_x, bottom_limit * 0.875, 'Black Time Advantage', cpcs.black, cpcs.white)
+        self._label(ax, label_x, top_limit * 0.875, 'White Time Advantage', cpcs.black, cpcs.white)
+        self._x_axis(ax, data.x_limit)
+        ax.set_ylim(bottom_limit, top_limit)
+        ax.set_yticks(range(bottom_limit, top_limit + self.time_plot_break, 60))
+
+    def gen_loss_plot(self, data: CardData):
+        """
+        Generate loss plot
+        """
+
+        ax = self.ax_loss
+        for colour, line_colour in (('Black', cpcs.black), ('White', cpcs.white)):
+            mask = data.mover == colour
+            self._keep(ax.plot(data.move_num[mask], data.eval_loss[mask], color=line_colour, linewidth=2.5))
+
+        label_x = (data.x_limit - 1) * 0.02 + 1
+        self._label(ax, label_x, -8.75, 'White Eval Loss', cpcs.black, cpcs.white)
+        self._label(ax, label_x, 8.75, 'Black Eval Loss', cpcs.white, cpcs.black)
+        self._x_axis(ax, data.x_limit)
@@ -9,14 +9,14 @@ import logging
 import os
 from pathlib import Path
 import re
-from typing import Coroutine, Dict, List, Optional, Set, Tuple
+from typing import Coroutine, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, TextIO, Tuple
 
 from chessdotcom.aio import ChessDotComError, Client, get_player_game_archives, get_player_games_by_month_pgn, get_player_stats
+from chessdotcom.types import Resource
 
 logger = logging.getLogger('__main__/' + __name__)
 
-read_size = 1000000
-global_pgn_directory = str(Path(__file__).parent.parent) + "/pgns/"
+global_pgn_directory = os.environ.get('PGN_DIRECTORY', str(Path(__file__).parent.parent) + "/pgns/")
 
 Client.rate_limit_handler.retries = 4
 Client.rate_limit_handler.tts = 2
@@ -24,6 +24,11 @@ Client.rate_limit_handler.tts = 2
 # These functions are used in order to request pgn files from chess.com for a given list of usernames
 
 
+def use_chesscom_host(base_url: str) -> None:
+    """Send the archive requests to another host serving the chess.com public API under /pub, such as fake_chesscom"""
+    Resource._base_url = base_url.rstrip('/') + "/pub"
+
+
 async def gather_cors(cors: List[Coroutine]):
     """Run gather for given list of coroutines, return result"""
     responses = await asyncio.gather(*cors)
@@ -141,95 +146,124 @@ def pgn_to_gamelist(pgn: str) -> list:
     return game_list
 
 
-def pgn_to_moves(game: str) -> List[tuple]:
-    """Take a pgn as string and return list of tuples describing the moves"""
-    # Read game from string
-    fh = io.StringIO(game)
-    game_obj = chess.pgn.read_game(fh)
+class Ply(NamedTuple):
+    """One ply of a game as written to the database, a tuple so there is no dictionary per ply"""
+    game_id: str
+    move_num: int
+    uci: str
+    san: str
+    clock: Optional[float]
+    position: str
+    material: int
 
-    # Set up return objects
+
+def game_plies(game_obj: chess.pgn.Game) -> List[Ply]:
+    """Take a parsed game and return the plies, the game id string is shared by all of them"""
     movelist = []
     game_id = game_obj.headers["Link"].split('/')[-1]
 
+    # One board is played through the game, node.board() would replay the game from the start for every ply
+    board = game_obj.board()
     while not game_obj.is_end():
         # Iterate move
         game_obj = game_obj.next()
 
         # Extract information
-        movenum = (game_obj.ply() + 1)  // 2
-        uci = game_obj.uci()
-        san = game_obj.san()
+        uci = game_obj.move.uci()
+        san = board.san(game_obj.move)
         clock = game_obj.clock()
-        position = game_obj.board().fen().rsplit(' ', 2)[0]
+        board.push(game_obj.move)
+        movenum = (board.ply() + 1)  // 2
+        position = board.fen().rsplit(' ', 2)[0]
+        material = board_material(board)
 
         # Construct tuples and add to lists
-        movelist.append((game_id, movenum, uci, san, clock, position))
+        movelist.append(Ply(game_id, movenum, uci, san, clock, position, material))
     
     return movelist
 
 
-def pgn_to_db_lists(pgn: str) -> Tuple[List[tuple], Set[list], List[tuple]]:
-    """Take a pgn string and return two lists containing the information to be put in the database."""
-    # Compile re expressions to detect header information and individual moves
-    header = re.compile(r'\[(.*?) \"(.*?)\"\]')
+def pgn_to_moves(game: str) -> List[Ply]:
+    """Take a pgn as string and return list of tuples describing the moves"""
+    return game_plies(chess.pgn.read_game(io.StringIO(game)))
 
-    # Split pgn into games and prep loop
-    raw_game_list = pgn.split('\n\n\n')
-    gamelist = []
-    userlist = set()
-    movelist = []
 
-    # Loop through games in pgn list, make dictionaries of headers, add to userlist and gamelist
-    for game in raw_game_list:
-        headers = dict(header.findall(game))
-        userlist.update(((headers['White'],), (headers['Black'],)))
-        gamelist.append((headers['Link'].split('/')[-1],headers['White'], headers['Black'], headers['WhiteElo'], headers['BlackElo'], headers['Result'], headers['UTCDate'].replace('.', '-') + ' ' + headers['UTCTime'], headers.get('ECO', 'Unknown')))
-        movelist.extend(pgn_to_moves(game))
-    
-    return gamelist, userlist, movelist
+piece_values = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9}
 
 
-def construct_lists_by_username(username: str, base_directory_name: str=global_pgn_directory) -> Tuple[List[tuple], Set[list], List[tuple]]:
-    """Construct gamelist, userlist and movelist for the given user"""
-    pgn_directory_name = base_directory_name + username + "/"
-    gamelist = []
-    userlist = set()
-    movelist = []
-	# For each file, read and create a list of games and users
-    for file in os.listdir(pgn_directory_name):
+def board_material(board: chess.Board) -> int:
+    """Material balance of a board in pawns, positive is in favour of white"""
+    return sum(value * (chess.popcount(board.pieces_mask(piece, chess.WHITE)) - chess.popcount(board.pieces_mask(piece, chess.BLACK)))
+               for piece, value in piece_values.items())
+
+
+def fen_material(fen: str) -> int:
+    """Material balance of a position given as a fen, with or without the move counters"""
+    return board_material(chess.Board(fen if len(fen.split(' ')) == 6 else fen + ' 0 1'))
+
+
+def iter_pgn_games(fh: TextIO) -> Iterator[Tuple[tuple, List[Ply]]]:
+    """Yield the game tuple and the plies of each game of an open pgn in turn, only one game is held at a time"""
+    while (game_obj := chess.pgn.read_game(fh)) is not None:
+        headers = game_obj.headers
+        game = (headers['Link'].split('/')[-1], headers['White'], headers['Black'], headers['WhiteElo'], headers['BlackElo'], headers['Result'], headers['UTCDate'].replace('.', '-') + ' ' + headers['UTCTime'], headers.get('ECO', 'Unknown'), headers.get('TimeControl', 'Unknown'))
+        yield game, game_plies(game_obj)
+
+
+def iter_games_by_username(username: str, base_directory_name: Optional[str]=None) -> Iterator[Tuple[tuple, List[Ply]]]:
+    """Yield the games of every month archive of the given user, from global_pgn_directory unless given"""
+    pgn_directory_name = (base_directory_name or global_pgn_directory) + username + "/"
+    for file in sorted(os.listdir(pgn_directory_name)):
         if file[-4:] == ".txt":
             with open(pgn_directory_name + file) as fh:
-                data = fh.read(read_size)
-            games, users, moves = pgn_to_db_lists(data)
-            gamelist.extend(games)
-            userlist.update(users)
-            movelist.extend(moves)
+                yield from iter_pgn_games(fh)
 
-    return gamelist, userlist, movelist
 
-def single_pgn_to_lists_by_username(username: str, month: str, base_directory_name: str=global_pgn_directory) -> Tuple[List[tuple], Set[list], List[tuple]]:
-    """
-    Read a single pgn and construct lists to insert into the database
-    """
+def iter_games_by_username_and_month(username: str, month: str, base_directory_name: Optional[str]=None) -> Iterator[Tuple[tuple, List[Ply]]]:
+    """Yield the games of a single month archive of the given user, from global_pgn_directory unless given"""
+    with open((base_directory_name or global_pgn_directory) + username + "/" + month + '.txt') as fh:
+        yield from iter_pgn_games(fh)
 
-    filepath = base_directory_name + username + "/" + month + '.txt'
+
+def batch_games(games: Iterable[Tuple[tuple, List[Ply]]], batch_size: Optional[int]=200) -> Iterator[Tuple[List[tuple], Set[tuple], List[Ply]]]:
+    """Group games into (gamelist, userlist, movelist) batches of at most batch_size games, a single batch if batch_size is None"""
     gamelist = []
     userlist = set()
     movelist = []
-	# For each file, read and create a list of games and users
-    
-    try:
-        with open(filepath) as fh:
-            data = fh.read(read_size)
-        games, users, moves = pgn_to_db_lists(data)
-        gamelist.extend(games)
-        userlist.update(users)
-        movelist.extend(moves)
-    except FileExistsError:
-        logging.error("File Exists Error while reading pgn.")
-        quit()
-
-    return gamelist, userlist, movelist
+    for game, plies in games:
+        gamelist.append(game)
+        userlist.update(((game[1],), (game[2],)))
+        movelist.extend(plies)
+        if batch_size is not None and len(gamelist) >= batch_size:
+            yield gamelist, userlist, movelist
+            gamelist = []
+            userlist = set()
+            movelist = []
+
+    if gamelist:
+        yield gamelist, userlist, movelist
+
+
+def collect_games(games: Iterable[Tuple[tuple, List[Ply]]]) -> Tuple[List[tuple], Set[tuple], List[Ply]]:
+    """Hold every game in memory as one gamelist, userlist and movelist"""
+    return next(batch_games(games, batch_size=None), ([], set(), []))
+
+
+def pgn_to_db_lists(pgn: str) -> Tuple[List[tuple], Set[tuple], List[Ply]]:
+    """Take a pgn string and return two lists containing the information to be put in the database."""
+    return collect_games(iter_pgn_games(io.StringIO(pgn)))
+
+
+def construct_lists_by_username(username: str, base_directory_name: Optional[str]=None) -> Tuple[List[tuple], Set[tuple], List[Ply]]:
+    """Construct gamelist, userlist and movelist for the given user, from global_pgn_directory unless given"""
+    return collect_games(iter_games_by_username(username, base_directory_name))
+
+def single_pgn_to_lists_by_username(username: str, month: str, base_directory_name: Optional[str]=None) -> Tuple[List[tuple], Set[tuple], List[Ply]]:
+    """
+    Read a single pgn and construct lists to insert into the database, from global_pgn_directory unless given
+    """
+
+    return collect_games(iter_games_by_username_and_month(username, month, base_directory_name))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,306 @@
+from contextlib import nullcontext
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+from cardconstruction import CardConstruction
+from cardimage import CardImage
+from journal import JobJournal
+from metrics import metrics
+from profiling import RequestProfiler
+from scheduler import CardScheduler
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class Job:
+    """
+    A game on its way through the pipeline, the tweets asking for it and everything the stages have produced for it
+    """
+
+    def __init__(self, tweet_id: int, game_id: int, user: str = ''):
+        # Tweets asking for the same game while it is in the pipeline are attached here
+        self.tweet_ids = [tweet_id]
+        self.game_id = game_id
+        # The user of the first tweet, the job counts against their quota
+        self.user = user
+        self.archieve = None
+        self.card: Optional[CardImage] = None
+
+        # Set by the scheduler
+        self.cost = None
+        self.queued_at = None
+
+        # Journal row and the last stage completed, a resumed job skips the stages it has already done
+        self.journal_id = None
+        self.stage = JobJournal.stages[0]
+
+        self.submitted = time.perf_counter()
+        # Seconds spent in each stage, by stage name
+        self.timings = {}
+        # Set by a RequestProfiler when this job is profiled
+        self.profile = None
+
+    def reached(self, stage: str) -> bool:
+        return JobJournal.stages.index(self.stage) >= JobJournal.stages.index(stage)
+
+    def __repr__(self) -> str:
+        return f"Job(game={self.game_id}, tweets={self.tweet_ids})"
+
+
+class Stage:
+    """
+    A pool of worker threads taking jobs from an input queue, passing each job to the next stage when done
+    """
+
+    def __init__(self, name: str, func: Callable[[Job], None], workers: int = 1, failed: Optional[Callable[[Job, str], None]] = None, input=None,
+                 profiler: Optional[RequestProfiler] = None):
+        self.name = name
+        self.func = func
+        self.failed = failed
+        self.profiler = profiler
+        self.workers = max(1, workers)
+        # Anything with put, get and qsize, a FIFO queue unless given
+        self.input = input if input is not None else queue.Queue()
+        self.next: Optional['Stage'] = None
+        self.threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, job: Optional[Job]):
+        return self.input.put(job)
+
+    def stop(self) -> None:
+        """
+        Let the queued jobs finish, then end the workers
+        """
+
+        for _ in self.threads:
+            self.input.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _run(self) -> None:
+        while 1:
+            job = self.input.get()
+            if job is None:
+                return
+
+            start = time.perf_counter()
+            try:
+                with self.profiler.stage(job, self.name) if self.profiler is not None else nullcontext():
+                    self.func(job)
+            # The helpers quit() on errors, that must only drop this job rather than end the worker
+            except (Exception, SystemExit) as e:
+                logger.error(f"{self.name} failed for {job}: {e!r}")
+                if self.failed is not None:
+                    self.failed(job, f"{self.name}: {e!r}")
+                continue
+            job.timings[self.name] = time.perf_counter() - start
+
+            if self.next is not None:
+                self.next.put(job)
+
+
+class CardPipeline:
+    """
+    Answer tweets through concurrent stages: fetch -> ingest -> evaluate -> render -> reply.
+    Each stage has its own workers so downloads, engine work and rendering for different tweets overlap,
+    and every tweet is replied to as soon as its card is ready.
+    Tweets for a game already in the pipeline join its job, so they share one evaluation, render and upload.
+    New jobs wait in a CardScheduler that lets the cheapest ones in first and limits each user.
+    With a JobJournal every job and its completed stages are recorded so unfinished jobs can be resumed.
+    """
+
+    def __init__(self, cc: CardConstruction, twitter, fetch_workers: int = 2, eval_workers: int = 1,
+                 render_workers: int = 1, reply_workers: int = 1, user_active: int = 1, user_queued: int = 5,
+                 slots: Optional[int] = None, journal: Optional[JobJournal] = None, profiler: Optional[RequestProfiler] = None):
+        self.cc = cc
+        self.twitter = twitter
+        self.journal = journal
+        self.profiler = profiler
+
+        # Only as many jobs as the evaluate and render stages can work on are let in, so the order is decided by the scheduler
+        self.scheduler = CardScheduler(coverage=cc.coverage,
+                                       slots=slots or eval_workers + render_workers,
+                                       user_active=user_active,
+                                       user_queued=user_queued)
+
+        # Ingest writes a whole archieve to the database in one transaction, more workers would only wait on the lock
+        self.stages = [Stage('fetch', self._fetch, fetch_workers, self._done, input=self.scheduler, profiler=profiler),
+                       Stage('ingest', self._ingest, 1, self._done, profiler=profiler),
+                       Stage('evaluate', self._evaluate, eval_workers, self._done, profiler=profiler),
+                       Stage('render', self._render, render_workers, self._done, profiler=profiler),
+                       Stage('reply', self._reply, reply_workers, self._done, profiler=profiler)]
+        for stage, following in zip(self.stages, self.stages[1:]):
+            stage.next = following
+
+        # Jobs in the pipeline by game id
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+        self.replied = 0
+        self.coalesced = 0
+
+    def start(self) -> None:
+        for stage in self.stages:
+            stage.start()
+        logger.info("Started pipeline with " + ", ".join(f"{s.workers} {s.name}" for s in self.stages) + " workers.")
+
+    def submit(self, tweet_id: int, game_id, user: str = '') -> Optional[Job]:
+        """
+        Queue a tweet for a reply, attaching it to the running job if its game is already in the pipeline.
+        Returns immediately with the job, or None if the game id is not a number or the user is over quota.
+        """
+
+        try:
+            game_id = int(game_id)
+        except ValueError:
+            logger.warning(f"Tweet {tweet_id} does not start with a game id: {game_id}")
+            return None
+
+        if self.journal is not None and self.journal.seen(tweet_id):
+            logger.info(f"Tweet {tweet_id} is already in the journal")
+            return None
+
+        with self.lock:
+            job = self.in_flight.get(game_id)
+            if job is not None:
+                job.tweet_ids.append(tweet_id)
+                if self.journal is not None:
+                    self.journal.attach(job.journal_id, tweet_id)
+                self.coalesced += 1
+                logger.info(f"Attached tweet {tweet_id} to {job}")
+                return job
+
+            job = Job(tweet_id, game_id, user)
+            if self.journal is not None:
+                job.journal_id = self.journal.record(game_id, user, tweet_id)
+            if self.profiler is not None:
+                self.profiler.select(job)
+            self.in_flight[game_id] = job
+
+        if not self.stages[0].put(job):
+            self._done(job, "over user quota")
+            return None
+
+        logger.info(f"Queued {job} with cost {job.cost}")
+        return job
+
+    def resume(self) -> int:
+        """
+        Queue the unfinished jobs of the journal again, each continues after the last stage it completed
+        """
+
+        if self.journal is None:
+            return 0
+
+        resumed = self.journal.unfinished()
+        for journal_id, game_id, user, stage, tweet_ids in resumed:
+            job = Job(tweet_ids[0], game_id, user)
+            job.tweet_ids = tweet_ids
+            job.journal_id = journal_id
+            job.stage = stage
+            if self.profiler is not None:
+                self.profiler.select(job)
+
+            with self.lock:
+                self.in_flight.setdefault(game_id, job)
+            # Resumed jobs were accepted once already, they do not count against the quota again
+            self.scheduler.put(job, force=True)
+            logger.info(f"Resumed {job} after stage {stage}")
+
+        return len(resumed)
+
+    def pending(self) -> int:
+        """
+        Number of jobs waiting in the stage queues, jobs being worked on are not counted
+        """
+
+        return sum(stage.input.qsize() for stage in self.stages)
+
+    def close(self) -> None:
+        """
+        Finish every queued job and stop the workers, stage by stage
+        """
+
+        for stage in self.stages:
+            stage.stop()
+
+    def _advance(self, job: Job, stage: str) -> None:
+        job.stage = stage
+        if self.journal is not None:
+            self.journal.advance(job.journal_id, stage)
+
+    def _fetch(self, job: Job) -> None:
+        if not job.reached('ingested'):
+            job.archieve = self.cc.fetch(job.game_id)
+
+    def _ingest(self, job: Job) -> None:
+        if job.reached('ingested'):
+            return
+        if job.archieve is not None:
+            self.cc.ingest(*job.archieve)
+        self._advance(job, 'ingested')
+
+    def _evaluate(self, job: Job) -> None:
+        if job.reached('evaluated'):
+            return
+        self.cc.evaluate(job.game_id)
+        self._advance(job, 'evaluated')
+
+    def _render(self, job: Job) -> None:
+        # The card only lives in memory, a resumed job draws it again, usually from the card cache
+        job.card = self.cc.render(job.game_id)
+        if not job.reached('rendered'):
+            self._advance(job, 'rendered')
+
+    def _reply(self, job: Job) -> None:
+        # Close the job to new tweets first, a tweet arriving after this starts a new job that finds the card cached
+        self._finish(job)
+
+        media_id = self.twitter.upload_card(job.card)
+        for tweet_id in job.tweet_ids:
+            self.twitter.reply_media(tweet_id, media_id)
+            if self.journal is not None:
+                self.journal.replied(tweet_id)
+            self.replied += 1
+
+        self._advance(job, 'replied')
+        self.scheduler.release(job)
+
+        # From the first tweet being taken on to the last reply
+        seconds = time.perf_counter() - job.submitted
+        metrics.observe('request', seconds)
+        metrics.inc('requests_total', len(job.tweet_ids))
+        logger.info(f"Replied to {job} after {seconds:.1f}s - " +
+                    ", ".join(f"{name} {stage_seconds:.2f}s" for name, stage_seconds in job.timings.items()))
+        if self.profiler is not None:
+            self.profiler.finish(job, seconds)
+
+    def _done(self, job: Job, error: str) -> None:
+        """
+        Drop a failed job, freeing its game id and its scheduler slot
+        """
+
+        self._finish(job)
+        self.scheduler.release(job)
+        metrics.inc('requests_failed_total', len(job.tweet_ids))
+        if self.profiler is not None:
+            self.profiler.finish(job, time.perf_counter() - job.submitted, error)
+        if self.journal is not None:
+            self.journal.fail(job.journal_id, error)
+
+    def _finish(self, job: Job) -> None:
+        """
+        Remove a job from the in-flight table once it has failed or is about to be replied to
+        """
+
+        with self.lock:
+            if self.in_flight.get(job.game_id) is job:
+                del self.in_flight[job.game_id]
@@ -0,0 +1,94 @@
+import argparse
+import logging
+import time
+
+from DBConn import DBConn
+
+logger = logging.getLogger('__main__.' + __name__)
+
+def update_all(db: DBConn, batch_size: int = 500) -> int:
+    """
+    Bring the statistics of every game up to date, committing each batch.
+    Needed once for games evaluated before the statistics were kept, or after evaluations were merged from another database.
+    """
+
+    with db.lock:
+        game_ids = [row[0] for row in db.cursor.execute("SELECT game_id FROM Game ORDER BY game_id").fetchall()]
+
+    changed = 0
+    start = time.perf_counter()
+    for i in range(0, len(game_ids), batch_size):
+        changed += db.update_player_stats(game_ids[i:i + batch_size])
+        logger.info(f"Checked {min(i + batch_size, len(game_ids))} of {len(game_ids)} games, {changed} changed, "
+                    f"{min(i + batch_size, len(game_ids)) / (time.perf_counter() - start):.1f} games/s.")
+
+    return changed
+
+def format_summary(summary: dict, top: int = 5) -> str:
+    """
+    A player summary as text, with the most played ECO codes and time controls
+    """
+
+    def rate(value, digits: int = 2) -> str:
+        return '-' if value is None else f"{value:.{digits}f}"
+
+    ranks = summary['move_ranks']
+    lines = [f"{summary['username']}: {summary['games']} games, {summary['evaluated_games']} evaluated",
+             f"  Avg. Move Loss: {rate(summary['avg_move_loss'])}",
+             f"  Avg. Move Rank: {rate(summary['avg_move_rank'])}",
+             f"  Move ranks: best {ranks['best']}, second {ranks['second']}, third {ranks['third']}, other {ranks['other']}"]
+    for kind, title in (('eco', 'ECO'), ('time_control', 'Time control')):
+        lines.append(f"  {title}:")
+        for value, counts in list(summary[kind].items())[:top]:
+            lines.append(f"    {value:>10}  {counts['games']:>5} games  +{counts['wins']} ={counts['draws']} -{counts['losses']}")
+
+    return "\n".join(lines)
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s - %(name)s')
+
+    db = DBConn(args.database)
+    if args.update:
+        logger.info(f"Updated the statistics of {update_all(db)} games.")
+
+    for username in args.usernames:
+        summary = db.player_summary(username)
+        if summary is None:
+            logger.warning(f"No games of {username} in {args.database}.")
+            continue
+        print(format_summary(summary, top=int(args.top)))
+
+def parse_arguments():
+    """
+    Parse the command-line arguments
+    """
+
+    parser = argparse.ArgumentParser(prog='playerstats',
+                                     description='Summarise players from the running statistics kept as their games are ingested and evaluated.')
+
+    parser.add_argument('usernames',
+                        help='chess.com usernames to summarise',
+                        nargs='*')
+
+    parser.add_argument('-b',
+                        '--database',
+                        help='set database file - Default: chesscom_db.db',
+                        action='store',
+                        default='chesscom_db.db')
+
+    parser.add_argument('-u',
+                        '--update',
+                        help='bring the statistics of every game up to date first, such as for games evaluated before they were kept',
+                        action='store_true')
+
+    parser.add_argument('-n',
+                        '--top',
+                        help='set number of ECO codes and time controls shown - Default: 5 - Range: [1, inf)',
+                        action='store',
+                        default=5)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
@@ -0,0 +1,43 @@
+import logging
+import time
+from typing import Optional, Tuple
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class AdaptivePoller:
+    """
+    Period between Twitter searches that shortens while tweets are arriving and backs off while idle.
+    The search rate limit always wins, the remaining requests are spread over the rest of the window.
+    """
+
+    def __init__(self, period: float = 30, min_period: float = 5, max_period: float = 300, backoff: float = 1.5):
+        self.min_period = min_period
+        self.max_period = max(max_period, min_period)
+        self.backoff = backoff
+        self.period = min(max(period, self.min_period), self.max_period)
+
+    def next_delay(self, found: int, rate_limit: Optional[Tuple[int, float]] = None) -> float:
+        """
+        Seconds to wait before the next search given the number of tweets the last one found
+        and the (remaining requests, reset epoch time) of the rate limit window if known
+        """
+
+        if found:
+            self.period = max(self.min_period, self.period / 2)
+        else:
+            self.period = min(self.max_period, self.period * self.backoff)
+
+        delay = self.period
+        if rate_limit is not None:
+            remaining, reset = rate_limit
+            until_reset = max(0.0, reset - time.time())
+            # Never search faster than the window allows, and not at all once it is used up
+            delay = max(delay, until_reset / remaining if remaining > 0 else until_reset + 1)
+
+        return delay
+
+    def wait(self, found: int, rate_limit: Optional[Tuple[int, float]] = None) -> float:
+        delay = self.next_delay(found, rate_limit)
+        logger.debug(f"Next search in {delay:.1f}s.")
+        time.sleep(delay)
+        return delay
@@ -0,0 +1,93 @@
+import argparse
+import logging
+import time
+
+import DBConn as dbconn
+from DBConn import DBConn
+
+logger = logging.getLogger('__main__.' + __name__)
+
+def precompute(db: DBConn, positions: int, depth: int, min_frequency: int = 2, batch_size: int = 50, parallel: bool = False) -> int:
+    """
+    Evaluate up to positions of the most frequent positions at depth, most frequent first, committing each batch so an interrupted run keeps its work.
+    Returns the number of positions evaluated.
+    """
+
+    logger.info(f"{db.frequency_coverage(depth):.1%} of the plies held are evaluated to depth {depth}.")
+
+    evaluated = 0
+    start = time.perf_counter()
+    while evaluated < positions:
+        count = db.evaluate_frequent_positions(min(batch_size, positions - evaluated), depth, min_frequency=min_frequency, parallel=parallel)
+        if count == 0:
+            logger.info(f"No more positions reached at least {min_frequency} times below depth {depth}.")
+            break
+        evaluated += count
+        logger.info(f"Evaluated {evaluated} positions, {evaluated / (time.perf_counter() - start):.1f} positions/s, "
+                    f"{db.frequency_coverage(depth):.1%} of the plies held are evaluated to depth {depth}.")
+
+    return evaluated
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s - %(name)s')
+
+    if args.engine:
+        dbconn.stockfish_path = args.engine
+    db = DBConn(args.database)
+    precompute(db, int(args.positions), int(args.depth), min_frequency=int(args.min_frequency), batch_size=int(args.batch_size), parallel=args.parallel)
+
+def parse_arguments():
+    """
+    Parse the command-line arguments
+    """
+
+    parser = argparse.ArgumentParser(prog='precompute',
+                                     description='Evaluate the positions reached most often, such as common openings, ahead of the requests for them.')
+
+    parser.add_argument('-b',
+                        '--database',
+                        help='set database file - Default: chesscom_db.db',
+                        action='store',
+                        default='chesscom_db.db')
+
+    parser.add_argument('-n',
+                        '--positions',
+                        help='set number of positions evaluated - Default: 1000 - Range: [1, inf)',
+                        action='store',
+                        default=1000)
+
+    # Deeper than the cards need, a card accepts any evaluation at least as deep as its own
+    parser.add_argument('-d',
+                        '--depth',
+                        help='set evaluation depth in moves - Default: 20 - Range: [1, 20]',
+                        action='store',
+                        default=20)
+
+    parser.add_argument('-f',
+                        '--min_frequency',
+                        help='set number of plies that must reach a position for it to be evaluated - Default: 2 - Range: [1, inf)',
+                        action='store',
+                        default=2)
+
+    parser.add_argument('-s',
+                        '--batch_size',
+                        help='set positions evaluated between commits - Default: 50 - Range: [1, inf)',
+                        action='store',
+                        default=50)
+
+    parser.add_argument('-p',
+                        '--parallel',
+                        help='evaluate each batch with a process per position',
+                        action='store_true')
+
+    parser.add_argument('-e',
+                        '--engine',
+                        help='set engine executable - Default: STOCKFISH_PATH or /opt/homebrew/bin/stockfish',
+                        action='store',
+                        default=None)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main(parse_arguments())
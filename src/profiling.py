@@ -0,0 +1,163 @@
+import cProfile
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+import heapq
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class RequestProfiler:
+    """
+    Profile selected requests through every pipeline stage, one profile file per request, and keep the slowest requests.
+    Requests are selected by game id or sampled at a rate.
+    The cprofile mode writes pstats files, the sample mode samples the stacks of the threads working on the request
+    and writes them folded, one 'frame;frame;frame count' line per stack, as used by flamegraph.pl and speedscope.
+    Work done in the engine or render worker processes only shows as the time waiting on them.
+    """
+
+    modes = ('cprofile', 'sample')
+
+    def __init__(self, directory: str = "./../profiles/", mode: Optional[str] = 'cprofile', rate: float = 0.05,
+                 game_ids: Iterable[int] = (), slowest: int = 10, interval: float = 0.005):
+        if mode is not None and mode not in self.modes:
+            raise ValueError(f"Unsupported profiling mode {mode}.")
+
+        self.directory = directory
+        self.mode = mode
+        self.rate = rate
+        self.game_ids = set(game_ids)
+        self.slowest = slowest
+        self.interval = interval
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        # Heap of the slowest finished requests, (seconds, finished, game id, tweets, stage seconds, profile file, error)
+        self.report: List[tuple] = []
+
+        # Threads working on a sampled request: thread ident -> (stack counts of the request, stage)
+        self.active = {}
+        if self.mode == 'sample':
+            threading.Thread(target=self._sample, name='profiler', daemon=True).start()
+
+    def select(self, job) -> bool:
+        """
+        Decide whether a new job is profiled, the profile travels with the job
+        """
+
+        if self.mode is None or not (job.game_id in self.game_ids or random.random() < self.rate):
+            return False
+
+        job.profile = cProfile.Profile() if self.mode == 'cprofile' else Counter()
+        logger.info(f"Profiling {job}")
+        return True
+
+    @contextmanager
+    def stage(self, job, name: str) -> Iterator[None]:
+        """
+        Profile the body of a with statement as part of a job, if the job is profiled
+        """
+
+        # The job may finish inside the stage, which hands its profile off
+        profile = job.profile
+        if profile is None:
+            yield
+        elif self.mode == 'cprofile':
+            try:
+                profile.enable()
+            except ValueError:
+                # Only one profile can be active at a time on Python 3.12 and later, this stage goes unprofiled
+                logger.debug(f"Another profile is active, {name} of {job} is not profiled.")
+                yield
+                return
+            try:
+                yield
+            finally:
+                profile.disable()
+        else:
+            ident = threading.get_ident()
+            with self.lock:
+                self.active[ident] = (profile, name)
+            try:
+                yield
+            finally:
+                with self.lock:
+                    del self.active[ident]
+
+    def finish(self, job, seconds: float, error: Optional[str] = None) -> None:
+        """
+        Write the profile of a finished job and update the slowest requests report
+        """
+
+        path = self._write_profile(job) if job.profile is not None else None
+        job.profile = None
+
+        stages = dict(job.timings)
+        # Time waiting in the queues, and in the stage the job finished in
+        stages['other'] = max(0.0, seconds - sum(stages.values()))
+        entry = (seconds, datetime.now().isoformat(timespec='seconds'), job.game_id, len(job.tweet_ids), stages, path, error)
+
+        with self.lock:
+            if len(self.report) < self.slowest:
+                heapq.heappush(self.report, entry)
+            elif seconds > self.report[0][0]:
+                heapq.heapreplace(self.report, entry)
+            else:
+                return
+            lines = self._format_report()
+
+        with open(self.directory + "slowest.txt", 'w') as fh:
+            fh.write(lines)
+
+    def _write_profile(self, job) -> str:
+        stem = f"{self.directory}{job.game_id}_{job.tweet_ids[0]}"
+        if self.mode == 'cprofile':
+            path = stem + ".prof"
+            job.profile.dump_stats(path)
+        else:
+            path = stem + ".folded"
+            with self.lock:
+                stacks = sorted(job.profile.items())
+            with open(path, 'w') as fh:
+                fh.writelines(f"{stack} {count}\n" for stack, count in stacks)
+        logger.info(f"Wrote profile of {job} to {path}")
+
+        return path
+
+    def _format_report(self) -> str:
+        """
+        The slowest requests, slowest first, with the seconds spent in each stage
+        """
+
+        lines = [f"Slowest {len(self.report)} requests, updated {datetime.now().isoformat(timespec='seconds')}"]
+        for seconds, finished, game_id, tweets, stages, path, error in sorted(self.report, key=lambda entry: -entry[0]):
+            breakdown = ", ".join(f"{name} {stage_seconds:.2f}s" for name, stage_seconds in stages.items())
+            lines.append(f"{seconds:>9.2f}s game {game_id} ({tweets} tweets) finished {finished}"
+                         + (f" FAILED {error}" if error else "") + f" - {breakdown}" + (f" - {path}" if path else ""))
+
+        return "\n".join(lines) + "\n"
+
+    def _sample(self) -> None:
+        """
+        Count the stacks of the threads working on sampled requests every interval
+        """
+
+        while 1:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    continue
+                frames = sys._current_frames()
+                for ident, (stacks, stage) in self.active.items():
+                    frame = frames.get(ident)
+                    calls = []
+                    while frame is not None:
+                        calls.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                        frame = frame.f_back
+                    stacks[";".join([stage] + calls[::-1])] += 1
@@ -0,0 +1,137 @@
+import importlib
+import logging
+from multiprocessing import get_context
+from multiprocessing.pool import AsyncResult
+import threading
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from cardimage import CardEncoding, CardImage
+
+if TYPE_CHECKING:
+    from carddata import CardData
+
+logger = logging.getLogger('__main__.' + __name__)
+
+# Module and class of the plotter of each renderer, imported only when needed as the plotting libraries are slow to import
+renderers = {'plotnine': ('cardplotter', 'CardPlotter'), 'matplotlib': ('mplcardplotter', 'MplCardPlotter')}
+
+# Version of each renderer's card layout, part of the card cache key, kept here so it is known without importing the plotting libraries.
+# Bump when the card layout changes so cached cards are rendered again
+renderer_versions = {'plotnine': 'plotnine1', 'matplotlib': 'mpl1'}
+
+# The plotter owned by a worker process, built once by _init_worker
+_plotter = None
+
+
+def plotter_class(renderer: str) -> type:
+    """
+    Import the plotter class of a renderer
+    """
+
+    module, name = renderers[renderer]
+    return getattr(importlib.import_module(module), name)
+
+
+def _init_worker(renderer: str, encoding: CardEncoding, ready) -> None:
+    """
+    Import the plotting libraries and build the card skeleton once per worker
+    """
+
+    global _plotter
+
+    _plotter = plotter_class(renderer)(db=None, encoding=encoding)
+    if renderer == 'matplotlib':
+        # Drawing the empty skeleton once loads the fonts and fills the text layout caches
+        _plotter.fig.canvas.draw()
+
+    ready.put(renderer)
+
+
+def _render(data: 'CardData', filename: Optional[str]) -> CardImage:
+    """
+    Draw a card in the worker process
+    """
+
+    return _plotter.render(data, filename)
+
+
+class RenderPool:
+    """
+    Pool of worker processes that keep a warm plotter, cards are drawn from CardData loaded by the caller
+    """
+
+    def __init__(self, renderer: str = 'matplotlib', processes: Optional[int] = None, encoding: Optional[CardEncoding] = None):
+        self.renderer = renderer
+
+        # Spawn rather than fork so workers do not inherit the database connection or the engine
+        context = get_context('spawn')
+        self.ready = context.Queue()
+        self.pool = context.Pool(processes, initializer=_init_worker, initargs=(renderer, encoding or CardEncoding(), self.ready))
+        self.processes = self.pool._processes
+        logger.info(f"Started {self.processes} {renderer} render workers.")
+
+    def wait_ready(self) -> None:
+        """
+        Block until every worker has finished warming up
+        """
+
+        for _ in range(self.processes):
+            self.ready.get()
+
+    def submit(self, data: 'CardData', filename: Optional[str] = None) -> AsyncResult:
+        """
+        Queue a card and return immediately, the result is the CardImage
+        """
+
+        return self.pool.apply_async(_render, (data, filename))
+
+    def render(self, data: 'CardData', filename: Optional[str] = None) -> CardImage:
+        """
+        Draw a card in a worker and wait for it
+        """
+
+        return self.submit(data, filename).get()
+
+    def render_many(self, cards: List[Tuple['CardData', Optional[str]]]) -> List[CardImage]:
+        """
+        Draw several cards in parallel and wait for all of them
+        """
+
+        return self.pool.starmap(_render, cards)
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
+
+
+class LazyPlotter:
+    """
+    Stands in for the plotter of a renderer, importing the plotting libraries and building the plotter when a card is first drawn.
+    The encoding and the renderer version are available without building it, which is all that is needed when cards are drawn by a RenderPool.
+    """
+
+    def __init__(self, renderer: str, db, encoding: Optional[CardEncoding] = None):
+        self.renderer = renderer
+        self.db = db
+        self.encoding = encoding or CardEncoding()
+        self._plotter = None
+        self.lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        return renderer_versions[self.renderer]
+
+    @property
+    def plotter(self):
+        with self.lock:
+            if self._plotter is None:
+                logger.info(f"Building the {self.renderer} plotter.")
+                self._plotter = plotter_class(self.renderer)(db=self.db, encoding=self.encoding)
+
+        return self._plotter
+
+    def __getattr__(self, name: str):
+        # Only reached for attributes of the plotter, private names are never forwarded
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.plotter, name)
@@ -0,0 +1,156 @@
+import logging
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger('__main__.' + __name__)
+
+class CardScheduler:
+    """
+    Queue in front of the card pipeline that hands out the cheapest job first.
+    Cost is estimated from the ply count and how much of the game is already evaluated,
+    each user is limited in how many jobs they can have running and waiting.
+    """
+
+    # Estimated cost in units of one position evaluation
+    render_cost = 10
+    fetch_cost = 20
+    # Plies assumed for a game that is not in the database yet
+    default_plies = 80
+    # Cost forgiven per second of waiting so long games are not starved by a stream of short ones
+    aging_rate = 1.0
+
+    def __init__(self, coverage: Callable[[int], Optional[Tuple[int, int]]], slots: int = 2,
+                 user_active: int = 1, user_queued: int = 5):
+        """
+        coverage returns (plies, unevaluated plies) of a game or None if it has to be fetched
+        slots is the number of jobs let into the pipeline at once, the rest wait here to be ordered
+        """
+
+        self.coverage = coverage
+        self.slots = slots
+        self.user_active = user_active
+        self.user_queued = user_queued
+
+        self.condition = threading.Condition()
+        self.queued = []
+        self.active = set()
+        self.queued_by_user = Counter()
+        self.active_by_user = Counter()
+        self.closing = False
+
+        # Statistics
+        self.dispatched = 0
+        self.rejected = 0
+        self.waits = deque(maxlen=500)
+
+    def estimate(self, game_id: int) -> float:
+        """
+        Estimated cost of producing a card for the game
+        """
+
+        coverage = self.coverage(game_id)
+        if coverage is None:
+            return self.fetch_cost + self.default_plies + self.render_cost
+
+        _, unevaluated = coverage
+        return unevaluated + self.render_cost
+
+    def put(self, job, force: bool = False) -> bool:
+        """
+        Queue a job, returns False if its user already has too many jobs waiting unless forced.
+        None marks the end of the input, get then returns None once the queue is empty.
+        """
+
+        if job is None:
+            with self.condition:
+                self.closing = True
+                self.condition.notify_all()
+            return True
+
+        with self.condition:
+            if not force and self.queued_by_user[job.user] >= self.user_queued:
+                self.rejected += 1
+                logger.warning(f"Rejected {job}, {job.user} already has {self.user_queued} cards waiting.")
+                return False
+
+        job.cost = self.estimate(job.game_id)
+        job.queued_at = time.perf_counter()
+
+        with self.condition:
+            self.queued.append(job)
+            self.queued_by_user[job.user] += 1
+            self.condition.notify_all()
+
+        logger.debug(f"Scheduled {job} with cost {job.cost}")
+        return True
+
+    def get(self):
+        """
+        Block until a slot is free and a job whose user is under quota is waiting, return the cheapest of them
+        """
+
+        with self.condition:
+            while 1:
+                job = self._next()
+                if job is not None:
+                    break
+                if self.closing and not self.queued:
+                    return None
+                self.condition.wait()
+
+            self.queued.remove(job)
+            self.queued_by_user[job.user] -= 1
+            self.active.add(job)
+            self.active_by_user[job.user] += 1
+
+            self.dispatched += 1
+            self.waits.append(time.perf_counter() - job.queued_at)
+
+        return job
+
+    def release(self, job) -> None:
+        """
+        Free the slot of a finished or failed job, releasing twice is harmless
+        """
+
+        with self.condition:
+            if job not in self.active:
+                return
+            self.active.remove(job)
+            self.active_by_user[job.user] -= 1
+            self.condition.notify_all()
+
+    def qsize(self) -> int:
+        return len(self.queued)
+
+    def stats(self) -> Dict:
+        """
+        Queue depth, jobs in the pipeline and the wait before dispatch in seconds
+        """
+
+        with self.condition:
+            waits = list(self.waits)
+            return {'queued': len(self.queued),
+                    'active': len(self.active),
+                    'users_waiting': sum(1 for count in self.queued_by_user.values() if count),
+                    'dispatched': self.dispatched,
+                    'rejected': self.rejected,
+                    'mean_wait_s': statistics.mean(waits) if waits else 0.0,
+                    'max_wait_s': max(waits) if waits else 0.0,
+                    'oldest_wait_s': max((time.perf_counter() - job.queued_at for job in self.queued), default=0.0)}
+
+    def _next(self):
+        """
+        Cheapest eligible job after aging, None if nothing can run now
+        """
+
+        if len(self.active) >= self.slots:
+            return None
+
+        now = time.perf_counter()
+        eligible = [job for job in self.queued if self.active_by_user[job.user] < self.user_active]
+
+        return min(eligible, key=lambda job: job.cost - self.aging_rate * (now - job.queued_at), default=None)
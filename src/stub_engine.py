@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Minimal UCI engine standing in for Stockfish in benchmarks and local runs.
+It answers the commands the stockfish package sends and reports legal moves with deterministic made-up scores,
+so runs are repeatable and independent of the installed engine.
+Point STOCKFISH_PATH at this file to use it, STUB_ENGINE_DELAY_MS adds a fixed search time per position.
+"""
+
+import os
+import random
+import sys
+import time
+
+import chess
+
+version = 15
+delay = float(os.environ.get('STUB_ENGINE_DELAY_MS', 0)) / 1000
+
+
+def search(board: chess.Board, depth: str, multipv: int) -> None:
+    """
+    Print the info lines of a finished search at depth and the best move
+    """
+
+    start = time.perf_counter()
+    time.sleep(delay)
+
+    moves = sorted(board.legal_moves, key=lambda move: move.uci())
+    if not moves:
+        print(f"info depth 0 score {'mate 0' if board.is_check() else 'cp 0'}")
+        print("bestmove (none)", flush=True)
+        return
+
+    # Seeded by the position so the same position always gets the same evaluation
+    rnd = random.Random(board.fen())
+    scored = []
+    for move in moves:
+        if board.gives_check(move) and rnd.random() < 0.1:
+            scored.append((move, 'mate', rnd.choice([1, 2, 3])))
+        else:
+            scored.append((move, 'cp', rnd.randint(-300, 300)))
+    scored.sort(key=lambda item: (item[1] != 'mate', -item[2] if item[1] == 'cp' else item[2]))
+
+    # Made-up search statistics growing with the depth and the number of moves
+    nodes = len(moves) * int(depth) * 100
+    elapsed = max(1, int((time.perf_counter() - start) * 1000))
+    for i, (move, kind, value) in enumerate(scored[:multipv], start=1):
+        print(f"info depth {depth} seldepth {depth} multipv {i} score {kind} {value} nodes {nodes} nps {nodes * 1000 // elapsed} hashfull 0 time {elapsed} pv {move.uci()}")
+    print(f"bestmove {scored[0][0].uci()}", flush=True)
+
+
+def main() -> None:
+    board = chess.Board()
+    multipv = 1
+
+    print(f"Stockfish {version} stub", flush=True)
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+
+        if command == 'uci':
+            print(f"id name Stockfish {version} stub")
+            print("option name MultiPV type spin default 1 min 1 max 500")
+            print("uciok", flush=True)
+        elif command == 'isready':
+            print("readyok", flush=True)
+        elif command == 'setoption' and tokens[2] == 'MultiPV':
+            multipv = int(tokens[4])
+        elif command == 'ucinewgame':
+            board = chess.Board()
+        elif command == 'position':
+            board = chess.Board() if tokens[1] == 'startpos' else chess.Board(" ".join(tokens[2:8]))
+            if 'moves' in tokens:
+                for move in tokens[tokens.index('moves') + 1:]:
+                    board.push_uci(move)
+        elif command == 'go':
+            search(board, tokens[tokens.index('depth') + 1] if 'depth' in tokens else '1', multipv)
+        elif command == 'd':
+            print(f"Fen: {board.fen()}")
+            print("Checkers: ", flush=True)
+        elif command == 'quit':
+            return
+
+
+if __name__ == '__main__':
+    main()
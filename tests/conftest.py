@@ -0,0 +1,41 @@
+import os
+from pathlib import Path
+import sys
+
+import pytest
+
+src_directory = Path(__file__).parent.parent / 'src'
+fixture_directory = str(Path(__file__).parent.parent / 'fixtures' / 'pgns') + '/'
+
+# The modules of src import each other by name, the engine is the stub unless another is given
+sys.path.insert(0, str(src_directory))
+os.environ.setdefault('STOCKFISH_PATH', str(src_directory / 'stub_engine.py'))
+
+# The SQL scripts are read relative to src
+os.chdir(src_directory)
+
+import pgnproc
+from DBConn import DBConn
+
+
+@pytest.fixture(scope='session')
+def fixture_db(tmp_path_factory) -> DBConn:
+    """
+    Database holding every fixture game, evaluated at depth 5 by the stub engine
+    """
+
+    pgnproc.global_pgn_directory = fixture_directory
+    db = DBConn(str(tmp_path_factory.mktemp('db') / 'fixtures.db'), sf_depth=5)
+    for username in sorted(os.listdir(fixture_directory)):
+        for month in sorted(os.listdir(fixture_directory + username)):
+            db.add_pgn(username, month[:-4])
+
+    for (game_id,) in db.cursor.execute("SELECT game_id FROM Game ORDER BY game_id").fetchall():
+        db.evaluate_game_by_id(game_id)
+
+    return db
+
+
+@pytest.fixture(scope='session')
+def game_ids(fixture_db) -> list:
+    return [row[0] for row in fixture_db.cursor.execute("SELECT game_id FROM Game ORDER BY game_id").fetchall()]
@@ -0,0 +1,37 @@
+import math
+
+from carddata import CardData
+
+
+def test_game_stats_match_card_data(fixture_db, game_ids):
+    # Evaluating the games already wrote their statistics
+    assert fixture_db.update_player_stats(game_ids) == 0
+
+    for game_id in game_ids:
+        stats = CardData.load(fixture_db, game_id).stats.set_index('colour')
+        rows = fixture_db.cursor.execute("""SELECT colour, loss, moves, rank_1, rank_2, rank_3, rank_other
+                                            FROM PlayerGameStats WHERE game_id = ?""", (game_id,)).fetchall()
+        assert sorted(row[0] for row in rows) == ['Black', 'White'], game_id
+
+        for colour, loss, moves, *ranks in rows:
+            card = stats.loc[colour]
+            assert math.isclose(card['Total Move Loss'], loss), (game_id, colour)
+            if moves:
+                assert math.isclose(card['Avg. Move Loss'], loss / moves), (game_id, colour)
+            else:
+                assert math.isnan(card['Avg. Move Loss']), (game_id, colour)
+            assert [card[column] for column in CardData.rank_columns] == ranks, (game_id, colour)
+
+
+def test_player_stats_are_sums_of_games(fixture_db):
+    games = fixture_db.cursor.execute("""SELECT user_id, COUNT(*), SUM(moves), SUM(loss),
+                                                SUM(rank_1), SUM(rank_2), SUM(rank_3), SUM(rank_other)
+                                         FROM PlayerGameStats GROUP BY user_id ORDER BY user_id""").fetchall()
+    players = fixture_db.cursor.execute("""SELECT user_id, games, moves, loss, rank_1, rank_2, rank_3, rank_other
+                                           FROM PlayerStats WHERE games > 0 ORDER BY user_id""").fetchall()
+
+    assert len(players) == len(games)
+    for player, summed in zip(players, games):
+        assert player[:3] == summed[:3]
+        assert math.isclose(player[3], summed[3])
+        assert player[4:] == summed[4:]
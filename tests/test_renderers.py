@@ -0,0 +1,18 @@
+from carddata import CardData
+from cardplotter import CardPlotter
+from mplcardplotter import MplCardPlotter
+from benchmark import pixel_difference
+
+# Largest mean pixel difference accepted between the renderers, as for benchmark.py compare
+max_difference = 0.06
+
+
+def test_matplotlib_card_matches_plotnine(fixture_db, game_ids, tmp_path):
+    # The shortest and the longest game of the fixtures
+    plies = {game_id: len(CardData.load(fixture_db, game_id).move_num) for game_id in game_ids}
+    for game_id in (min(plies, key=plies.get), max(plies, key=plies.get)):
+        data = CardData.load(fixture_db, game_id)
+        plotnine_card = CardPlotter(db=fixture_db).render(data, str(tmp_path / f"plotnine_{game_id}"))
+        matplotlib_card = MplCardPlotter(db=fixture_db).render(data, str(tmp_path / f"matplotlib_{game_id}"))
+
+        assert pixel_difference(plotnine_card.path, matplotlib_card.path) <= max_difference, game_id
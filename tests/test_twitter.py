@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import tweepy as tp
+
+from cardimage import CardImage
+from fake_twitter import FakeTwitterServer
+import TwitterAPI as ta
+
+
+@pytest.fixture
+def server():
+    server = FakeTwitterServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def twitter(server, monkeypatch):
+    monkeypatch.setattr(ta.TwitterAPI, 'retry_delay', 0.01)
+    return ta.TwitterAPI(latest_responded=0, base_url=server.url)
+
+
+def card(data: bytes = b'card') -> CardImage:
+    return CardImage(data, image_format='png')
+
+
+def test_same_card_is_uploaded_once(server, twitter):
+    first = card()
+    # Slow uploads so the requests for the card overlap
+    server.latency = 0.2
+    with ThreadPoolExecutor(4) as executor:
+        media_ids = list(executor.map(lambda _: twitter.upload_card(card()), range(4)))
+
+    assert len(server.uploads) == 1
+    assert set(media_ids) == {server.uploads[0][0]}
+    assert twitter.upload_card(first) == media_ids[0]
+    assert len(server.uploads) == 1
+
+    # Another card is uploaded on its own
+    assert twitter.upload_card(card(b'other card')) != media_ids[0]
+    assert len(server.uploads) == 2
+
+
+def test_upload_retries_server_errors(server, twitter):
+    server.fail_next = twitter.retries - 1
+    media_id = twitter.upload_card(card())
+
+    assert server.uploads == [(media_id, server.uploads[0][1])]
+    assert server.fail_next == 0
+
+
+def test_upload_gives_up_after_retries(server, twitter):
+    server.fail_next = twitter.retries
+    with pytest.raises(tp.TwitterServerError):
+        twitter.upload_card(card())
+
+    # A failed upload is not cached, the next attempt uploads again
+    assert twitter.upload_card(card()) == server.uploads[0][0]
+    assert len(server.uploads) == 1
+
+
+def test_search_reads_every_new_page(server, twitter):
+    seen = server.add_tweet("1000 #chessindata")
+    twitter.latest_responded = seen
+    # More new tweets than the pages of maxResults the search used to stop at
+    new = [server.add_tweet(f"{1000 + i} #chessindata") for i in range(6 * twitter.maxResults + 3)]
+
+    tweets = twitter.search_hashtag()
+
+    assert [tweet[0] for tweet in tweets] == new[::-1]
+
+
+def test_rate_limited_search_returns_nothing(server, twitter):
+    twitter.latest_responded = server.add_tweet("1000 #chessindata")
+    for i in range(3 * twitter.maxResults):
+        server.add_tweet(f"{1000 + i} #chessindata")
+    # The second page is rate limited, the newest page alone would move the checkpoint past the others
+    server.rate_remaining = 1
+
+    assert twitter.search_hashtag() == []
+    assert server.searches == 1